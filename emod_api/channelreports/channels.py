@@ -2,11 +2,28 @@
 
 """Module for reading InsetChart.json channels."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
+import io
 import json
+import math
 import csv
+import os
+import re
 from pathlib import Path
-from typing import Union
+from typing import Callable, Iterable, Union
+
+import numpy as np
+
+from emod_api.utils.parallel import parallel_map
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+    ARROW_SUPPORT = True
+except ImportError:
+    ARROW_SUPPORT = False
 
 _CHANNELS = "Channels"
 _DTK_VERSION = "DTK_Version"
@@ -35,6 +52,11 @@ _DATA = "Data"
 
 _HEADER = "Header"
 
+_BINARY_MAGIC = b"EMODCHN1"
+_BINARY_ALIGNMENT = 64
+_CACHE_DIRECTORY = Path.home() / ".cache" / "emod_api" / "channelreports"
+_CSV_BLOCK = 65536
+
 
 class Header(object):
 
@@ -217,19 +239,38 @@ class Channel(object):
         return
 
     def as_dictionary(self) -> dict:
-        return {self.title: {_UNITS: self.units, _DATA: list(self.data)}}
+        data = self.data.tolist() if isinstance(self.data, np.ndarray) else list(self.data)
+        return {self.title: {_UNITS: self.units, _DATA: data}}
 
 
 class ChannelReport(object):
 
-    def __init__(self, filename: str = None, **kwargs):
+    def __init__(self, filename: str = None, channels: list[str] = None, cache: Union[bool, str, Path] = None, **kwargs):
+        """
+        Create a ChannelReport from a file or, optionally, blank with the specified metadata.
+
+        Args:
+            filename: channel report (e.g. InsetChart.json) to read
+            channels: optional list of channels (by name) to read from the file, other channels are skipped without being parsed
+            cache: optional cache directory (True for ~/.cache/emod_api/channelreports) of binary copies of reports,
+                keyed on the report's path, size, and modification time, which are memory-mapped on later loads
+            kwargs: header values for a blank report, e.g. Channels, DTK_Version, or Timesteps
+        """
+
+        self._derived = {}
+        self._derived_channels = {}
 
         if filename is not None:
             assert isinstance(filename, str), "filename must be a string"
-            self._from_file(filename)
+            if cache:
+                self._from_cache(filename, channels, _CACHE_DIRECTORY if cache is True else Path(cache))
+            else:
+                self._from_file(filename, channels)
         else:
             self._header = Header(**kwargs)
             self._channels = {}
+            self._data = None
+            self._data_channels = []
 
         return
 
@@ -325,11 +366,78 @@ class ChannelReport(object):
         return self._channels
 
     def __getitem__(self, item: str) -> Channel:
-        """Return Channel object by channel name/title"""
+        """Return Channel object by channel name/title, including derived channels"""
+        if (item not in self._channels) and (item in self._derived):
+            if item not in self._derived_channels:
+                function, units = self._derived[item]
+                self._derived_channels[item] = Channel(item, units, np.asarray(function(self), dtype=np.float64))
+            return self._derived_channels[item]
         return self._channels[item]
 
-    def write_file(self, filename: str, indent: int = 0, separators=(",", ":")) -> None:
-        """Write inset chart to specified text file."""
+    def derive(self, title: str, function: Callable[["ChannelReport"], np.ndarray], units: str = "") -> None:
+        """
+        Register a derived channel, computed by function(report) when first accessed, e.g. report[title], and then cached.
+
+        Derived channels are not in `channels` and are not written to files. The functions in
+        emod_api.channelreports.derived create functions for common cases, e.g. ratios, rolling means,
+        cumulative sums, and resampling, and may refer to other derived channels.
+        Registering a title again replaces the function and clears the cached data.
+
+        Examples:
+            Prevalence and its 7 time step rolling mean::
+
+                from emod_api.channelreports import derived
+                report.derive("Prevalence", derived.ratio("Infected", "Statistical Population"))
+                report.derive("Prevalence (7 step mean)", derived.rolling_mean("Prevalence", 7))
+                smoothed = report["Prevalence (7 step mean)"].data
+        """
+
+        assert title not in self._channels, f"'{title}' is already a channel."
+        self._derived[title] = (function, units)
+        self._derived_channels.clear()  # other derived channels may depend on this one
+
+        return
+
+    @property
+    def derived_names(self) -> list:
+        return sorted(self._derived)
+
+    @property
+    def data(self) -> np.ndarray:
+        """
+        Data for all channels as a 2-D array (channels x time steps), rows in the order of `channels`.
+
+        The data of each Channel is a view of its row in this array, so changes to one are seen in the other.
+        Channels added to the report since the array was built are consolidated into a new array.
+        """
+        channels = list(self._channels.values())
+        current = (self._data is not None) and (len(channels) == len(self._data_channels)) and all(
+            channel is expected for channel, expected in zip(channels, self._data_channels))
+        if not current:
+            counts = set([len(channel.data) for channel in channels])
+            assert len(counts) <= 1, f"Channels do not all have the same number of values ({counts})"
+            self._data = np.empty((len(channels), counts.pop() if counts else 0), dtype=np.float64)
+            for index, channel in enumerate(channels):
+                self._data[index, :] = channel.data
+                channel._data = self._data[index]
+            self._data_channels = channels
+
+        return self._data
+
+    def write_file(self, filename: str, indent: int = 0, separators=(",", ":"), float_format: str = None) -> None:
+        """
+        Write inset chart to specified text file.
+
+        The header and then each channel are written as they are formatted, rather than building the whole
+        report as one object, so memory use and time are linear in the number of channels. The text is the same
+        as json.dump() would write for indent and separators.
+
+        Args:
+            filename: destination file
+            indent: as for json.dump()
+            separators: as for json.dump()
+            float_format: optional %-style format for data values, e.g. "%.6g", for more compact files
+        """
 
         # in case this was generated locally, lets do some consistency checks
         assert len(self._channels) > 0, "Report has no channels."
@@ -341,19 +449,194 @@ class ChannelReport(object):
         self._header.num_channels = len(self._channels)
         self.num_time_steps = len(self._channels[self.channel_names[0]].data)
 
+        if separators is None:
+            separators = (", ", ": ") if indent is None else (",", ": ")
+        item_separator, key_separator = separators
+
+        def newline(_level: int) -> str:
+            if indent is None:
+                return ""
+            return "\n" + (" " * indent if isinstance(indent, int) else indent) * _level
+
+        def member(_key: str, _text: str, _level: int) -> str:
+            return newline(_level) + json.dumps(_key) + key_separator + _text
+
+        def data_text(_data) -> str:
+            values = _data.tolist() if isinstance(_data, np.ndarray) else list(_data)
+            if float_format is not None:
+                # NaN and infinities as json writes them
+                values = [float_format % value if math.isfinite(value) else json.dumps(value) for value in values]
+            elif indent is None:
+                return json.dumps(values, separators=separators)
+            else:
+                # the C encoder (no indent) formats the values, they are laid out one per line below
+                values = json.dumps(values, separators=(",", ":"))[1:-1].split(",") if values else []
+            if not values:
+                return "[]"
+            return "[" + newline(4) + (item_separator + newline(4)).join(values) + newline(3) + "]"
+
         with open(filename, "w", encoding="utf-8") as file:
-            channels = {}
-            for _, channel in self.channels.items():
-                # https://stackoverflow.com/questions/38987/how-do-i-merge-two-dictionaries-in-a-single-expression
-                channels = {**channels, **channel.as_dictionary()}
-            chart = {_HEADER: self.header.as_dictionary(), _CHANNELS: channels}
-            json.dump(chart, file, indent=indent, separators=separators)
+            header = json.dumps(self.header.as_dictionary(), indent=indent, separators=separators)
+            if indent is not None:
+                header = header.replace("\n", newline(1))
+            file.write("{" + member(_HEADER, header, 1) + item_separator + member(_CHANNELS, "{", 1))
+            # channels are keyed on their titles, a later channel with the same title replaces an earlier one
+            channels = {channel.title: channel for channel in self._channels.values()}
+            for index, (title, channel) in enumerate(channels.items()):
+                text = "{" + member(_UNITS, json.dumps(channel.units), 3) + item_separator
+                text += member(_DATA, data_text(channel.data), 3) + newline(2) + "}"
+                file.write((item_separator if index else "") + member(title, text, 2))
+            file.write(newline(1) + "}" + newline(0) + "}")
+
+        return
+
+    def to_binary(self, filename: Union[str, Path], dtype=np.float64) -> None:
+        """
+        Write report to a binary file which from_binary() can memory-map.
+
+        The file holds a short JSON description (header, channel titles and units, data type and shape)
+        followed by the data of all channels as one contiguous (channels x time steps) array.
+        """
+
+        data = self.data
+        metadata = {
+            _HEADER: {**self.header.as_dictionary(), _CHANNELS: len(self._channels)},
+            _CHANNELS: [[title, channel.units] for title, channel in self._channels.items()],
+            "dtype": np.dtype(dtype).newbyteorder("<").str,
+            "shape": list(data.shape),
+        }
+        text = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+        offset = _binary_offset(len(text))
+
+        with open(filename, "wb") as file:
+            file.write(_BINARY_MAGIC)
+            file.write(len(text).to_bytes(8, "little"))
+            file.write(text)
+            file.write(bytes(offset - file.tell()))
+            np.ascontiguousarray(data, dtype=metadata["dtype"]).tofile(file)
+
+        return
+
+    @classmethod
+    def from_binary(cls, filename: Union[str, Path], mmap: bool = True) -> "ChannelReport":
+        """
+        Read a report written by to_binary().
+
+        Args:
+            filename: binary channel report
+            mmap: memory-map the channel data rather than reading it; changes to the data are not written to the file
+        """
+
+        report = cls()
+        report._from_binary(str(filename), mmap)
+
+        return report
+
+    def _from_binary(self, filename: str, mmap: bool) -> None:
+
+        with open(filename, "rb") as file:
+            assert file.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC, f"'{filename}' is not a binary channel report."
+            length = int.from_bytes(file.read(8), "little")
+            metadata = json.loads(file.read(length).decode("utf-8"))
+
+        dtype = np.dtype(metadata["dtype"])
+        shape = tuple(metadata["shape"])
+        offset = _binary_offset(length)
+        if mmap and (np.prod(shape) > 0):
+            # copy-on-write, changes are not written back to the file
+            self._data = np.memmap(filename, dtype=dtype, mode="c", offset=offset, shape=shape)
+        else:
+            self._data = np.fromfile(filename, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+        self._header = Header(**metadata[_HEADER])
+        self._channels = {}
+        for index, (title, units) in enumerate(metadata[_CHANNELS]):
+            self._channels[title] = Channel(title, units, self._data[index])
+        self._data_channels = list(self._channels.values())
+
+        return
+
+    def _from_cache(self, filename: str, channel_names: list[str], directory: Path) -> None:
+
+        stat = os.stat(filename)
+        key = f"{Path(filename).resolve()}|{stat.st_size}|{stat.st_mtime_ns}"
+        path = directory / f"{Path(filename).stem}-{hashlib.sha1(key.encode('utf-8')).hexdigest()}.bin"
+
+        if not path.exists():
+            self._from_file(filename)
+            directory.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and rename so concurrent readers never see a partial cache file.
+            temporary = path.with_suffix(f".{os.getpid()}.tmp")
+            self.to_binary(temporary)
+            os.replace(temporary, path)
+
+        self._from_binary(str(path), mmap=True)
+
+        if channel_names is not None:
+            self._channels = {title: channel for title, channel in self._channels.items() if self._channel_name(title) in channel_names}
+            found = set(self._channel_name(title) for title in self._channels)
+            missing = [name for name in channel_names if name not in found]
+            assert not missing, f"'{filename}' missing channel(s) {missing}."
 
         return
 
-    def _from_file(self, filename: str) -> None:
+    @staticmethod
+    def stack(paths: Iterable[Union[str, Path]],
+              channels: list[str],
+              workers: int = None,
+              filename: Union[str, Path] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Load channels from many reports, e.g. the InsetChart.json files of an experiment, into one array.
+
+        Each report's header is read first to size the array, then reports are read in worker processes,
+        reading only the requested channels, and copied into place so no per-report objects are kept.
+
+        Args:
+            paths: channel report files
+            channels: names of the channels to load
+            workers: number of worker processes, defaults to the number of CPUs, 1 reads the reports in this process
+            filename: optional .npy file to hold the array, which is then memory-mapped; reopen it with
+                np.load(filename, mmap_mode="r")
+
+        Returns:
+            (reports x channels x time steps) array, padded with NaN after the end of shorter reports, and
+            (reports x time steps) boolean mask, True where a report has data
+        """
+
+        paths = [str(path) for path in paths]
+        workers = os.cpu_count() if workers is None else workers
+        if workers > 1:
+            # reading headers is I/O bound, threads suffice
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                headers = list(executor.map(_read_header, paths))
+        else:
+            headers = [_read_header(path) for path in paths]
+        lengths = np.array([header[_TIMESTEPS] for header in headers], dtype=np.int64)
+
+        shape = (len(paths), len(channels), int(lengths.max()) if len(paths) else 0)
+        if filename is not None:
+            array = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float64, shape=shape)
+            array[...] = np.nan
+        else:
+            array = np.full(shape, np.nan)
+        mask = np.arange(shape[2]) < lengths[:, None]
+
+        for index, data in _read_reports(paths, list(channels), workers):
+            array[index, :, :data.shape[1]] = data
+
+        if filename is not None:
+            array.flush()
+
+        return array, mask
+
+    @staticmethod
+    def _channel_name(title: str) -> str:
+        """Name used to select a channel when reading a report."""
+        return title
+
+    def _from_file(self, filename: str, channel_names: list[str] = None) -> None:
 
-        def validate_file(_jason) -> None:
+        def validate_file(_jason, _channels_len) -> None:
 
             assert _HEADER in _jason, f"'{filename}' missing '{_HEADER}' object."
             assert (
@@ -364,11 +647,15 @@ class ChannelReport(object):
             ), f"'{filename}' missing '{_HEADER}/{_TIMESTEPS}' key."
             assert _CHANNELS in _jason, f"'{filename}' missing '{_CHANNELS}' object."
             num_channels = _jason[_HEADER][_CHANNELS]
-            channels_len = len(_jason[_CHANNELS])
+            channels_len = len(_jason[_CHANNELS]) if _channels_len is None else _channels_len
             assert num_channels == channels_len, (
                 f"'{filename}': "
                 + f"'{_HEADER}/{_CHANNELS}' ({num_channels}) does not match number of {_CHANNELS} ({channels_len})."
             )
+            if channel_names is not None:
+                found = set(self._channel_name(title) for title in _jason[_CHANNELS])
+                missing = [name for name in channel_names if name not in found]
+                assert not missing, f"'{filename}' missing channel(s) {missing}."
 
             return
 
@@ -383,24 +670,33 @@ class ChannelReport(object):
 
             return
 
-        with open(filename, "rb") as file:
-            jason = json.load(file)
-            validate_file(jason)
+        if channel_names is None:
+            with open(filename, "rb") as file:
+                jason = json.load(file)
+            channels_len = None
+        else:
+            names = set(channel_names)
+            jason, channels_len = _load_selected(filename, lambda title: self._channel_name(title) in names)
 
-            header_dict = jason[_HEADER]
-            self._header = Header(**header_dict)
-            self._channels = {}
+        validate_file(jason, channels_len)
+
+        header_dict = jason[_HEADER]
+        self._header = Header(**header_dict)
+        self._channels = {}
 
-            channels = jason[_CHANNELS]
-            for title, channel in channels.items():
-                validate_channel(channel, title, self._header)
-                units = channel[_UNITS]
-                data = channel[_DATA]
-                self._channels[title] = Channel(title, units, data)
+        # All channel data is stored in one array, each Channel holds a view of its row.
+        channels = jason[_CHANNELS]
+        self._data = np.empty((len(channels), self._header.num_time_steps), dtype=np.float64)
+        for index, (title, channel) in enumerate(channels.items()):
+            validate_channel(channel, title, self._header)
+            units = channel[_UNITS]
+            self._data[index, :] = channel[_DATA]
+            self._channels[title] = Channel(title, units, self._data[index])
+        self._data_channels = list(self._channels.values())
 
         return
 
-    def to_csv(self, filename: Union[str, Path], channel_names: list[str] = None, transpose: bool = False) -> None:
+    def to_csv(self, filename: Union[str, Path], channel_names: list[str] = None, transpose: bool = False, float_format: str = None) -> None:
 
         """
         Write each channel from the report to a row, CSV style, in the given file.
@@ -411,22 +707,411 @@ class ChannelReport(object):
             filename: string or path specifying destination file
             channel_names: optional list of channels (by name) to write to the file
             transpose: write channels as columns rather than rows
+            float_format: optional %-style format for floating point data, e.g. "%.6g", defaults to str() formatting
         """
 
         if channel_names is None:
             channel_names = self.channel_names
 
-        if not transpose:  # default
-            with open(filename, "w") as g_f:
-                csv_obj = csv.writer(g_f, dialect='unix', quoting=csv.QUOTE_MINIMAL)
-                for cname in channel_names:
-                    csv_obj.writerow([cname] + list(self[cname]))
+        columns = [_channel_data(self._channels[cname]) for cname in channel_names]
+        write_csv(filename, channel_names, columns, transpose, float_format)
 
-        else:  # transposed
-            with open(filename, "w") as g_f:
-                csv_obj = csv.writer(g_f, dialect='unix', quoting=csv.QUOTE_MINIMAL)
-                csv_obj.writerow(channel_names)
-                for row_idx in range(self.num_time_steps):
-                    csv_obj.writerow([self[cname][row_idx] for cname in channel_names])
+        return
+
+    def to_parquet(self, filename: Union[str, Path], channel_names: list[str] = None) -> None:
+        """
+        Write channels to a Parquet file, one column per channel and one row per time step. Requires pyarrow.
+
+        Args:
+            filename: string or path specifying destination file
+            channel_names: optional list of channels (by name) to write to the file
+        """
+
+        if not ARROW_SUPPORT:
+            raise ImportError("Parquet export requires pyarrow (pip install pyarrow).")
+
+        if channel_names is None:
+            channel_names = self.channel_names
+
+        columns = [pyarrow.array(np.asarray(_channel_data(self._channels[cname]))) for cname in channel_names]
+        parquet.write_table(pyarrow.Table.from_arrays(columns, names=list(channel_names)), str(filename))
+
+        return
+
+
+class PropertyReport(ChannelReport):
+
+    """
+    Channel report whose channels are split by individual property (IP) values, e.g. PropertyReport.json.
+
+    Channel titles look like "Infected:Age_Bin:Age_Bin_Property_From_0_To_20,QualityOfCare:High" - channel name,
+    then comma separated IP:value pairs. Titles are parsed once into integer codes for the channel name and each
+    IP value, so aggregating over IPs is a single vectorized sum over the report's data array.
+    Selecting channels when reading, `PropertyReport(filename, channels=["Infected"])`, is by channel name.
+
+    The report is also an N-dimensional array (channel name x each IP's values x time), see `array`, and can be
+    indexed by label: `report["Infected", {"Age_Bin": "Age_Bin_Property_From_0_To_20"}]` is the Infected time
+    series for that age bin, summed over the other IPs. Indexing by full channel title returns the Channel.
+    """
+
+    def __init__(self, filename: str = None, channels: list[str] = None, cache: Union[bool, str, Path] = None, **kwargs):
+
+        super().__init__(filename, channels, cache, **kwargs)
+        self._index_titles = None
 
         return
+
+    @staticmethod
+    def _channel_name(title: str) -> str:
+        return title.split(":", 1)[0]
+
+    @property
+    def names(self) -> list[str]:
+        """Channel names without IP values, e.g. "Infected" """
+        return list(self._index()[0])
+
+    @property
+    def ips(self) -> dict[str, list[str]]:
+        """Values of each IP, keyed on IP name, in order of appearance in the report."""
+        _, ips, values, _ = self._index()
+        return {ip: list(ip_values) for ip, ip_values in zip(ips, values)}
+
+    @property
+    def dims(self) -> list[str]:
+        """Dimensions of `array`: "channel", each IP, and "time"."""
+        return ["channel"] + list(self._index()[1]) + ["time"]
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        Report data as an N-dimensional array (channel name x each IP's values x time), see `dims`, `names`, and `ips`.
+
+        If the report's channels are the full product of channel names and IP values in order, as EMOD writes them,
+        this is a view of the report's data array. Otherwise it is a new array with zeros for missing combinations.
+        """
+
+        names, ips, values, codes = self._index()
+        if np.any(codes < 0):
+            raise ValueError("Not all channels have a value for every IP.")
+        data = self.data
+        shape = (len(names),) + tuple(len(ip_values) for ip_values in values)
+        if (len(codes) == np.prod(shape)) and np.array_equal(codes, np.indices(shape).reshape(len(shape), -1).T):
+            return data.reshape(shape + data.shape[1:])
+
+        array = np.zeros(shape + data.shape[1:], dtype=data.dtype)
+        array[tuple(codes.T)] = data
+
+        return array
+
+    def __getitem__(self, item):
+        """
+        Return the Channel with the given title or, given (channel name(s), {IP: value(s)}), an array of data.
+
+        For the array, IPs not in the selection are summed over, IPs selected with one value are dropped, and
+        IPs selected with a list of values, like a list of channel names, keep a dimension (in `dims` order).
+        """
+
+        if not isinstance(item, tuple):
+            return super().__getitem__(item)
+
+        name, selection = item if len(item) == 2 else (item[0], {})
+        if name is None:
+            raise KeyError("A channel name, or list of channel names, is required.")
+        names, ips, values, _ = self._index()
+        array = self.array
+        not_found = [ip for ip in selection if ip not in ips]
+        if not_found:
+            raise KeyError(f"Specified IP(s) - {not_found} - is/are not valid IP names.")
+
+        def indices(_labels, _selected, _kind):
+            _selected = _selected if isinstance(_selected, (list, tuple)) else [_selected]
+            _missing = [label for label in _selected if label not in _labels]
+            if _missing:
+                raise KeyError(f"Specified {_kind}(s) - {_missing} - is/are not valid.")
+            return [_labels.index(label) for label in _selected]
+
+        # Select along each axis, dropping axes selected with a single label, then sum over unselected IPs.
+        axes = [(names, name, "channel name")] + [(ip_values, selection.get(ip), f"{ip} value") for ip, ip_values in zip(ips, values)]
+        summed = []
+        axis = 0
+        for labels, selected, kind in axes:
+            if selected is None:
+                summed.append(axis)
+                axis += 1
+                continue
+            array = np.take(array, indices(labels, selected, kind), axis=axis)
+            if isinstance(selected, (list, tuple)):
+                axis += 1
+            else:
+                array = array.squeeze(axis=axis)
+
+        return array.sum(axis=tuple(summed)) if summed else array
+
+    def group_by(self, channels: list[str] = None, groupby: list[str] = None) -> dict[str, np.ndarray]:
+        """
+        Sum channel data over IP values.
+
+        Args:
+            channels: channel names (without IP values) to include, None for all channels
+            groupby:  IP(s) whose values are kept, other IPs are summed over; None keeps every channel separate and [] sums over all IPs
+
+        Returns:
+            Dictionary of trace name, e.g. "Infected:Age_Bin:Age_Bin_Property_From_0_To_20", to data, sorted by trace name.
+        """
+
+        names, ips, values, codes = self._index()
+        if groupby is None:
+            groupby = ips
+        not_found = [ip for ip in groupby if ip not in ips]
+        if not_found:
+            raise ValueError(f"Specified groupby IP(s) - {not_found} - is/are not valid IP names.")
+        if channels is None:
+            channels = names
+        not_found = [name for name in channels if name not in names]
+        if not_found:
+            raise ValueError(f"Specified channel(s) - {not_found} - is/are not valid channel names.")
+
+        # Keep IPs in the order they appear in channel titles
+        columns = [0] + [1 + ips.index(ip) for ip in ips if ip in groupby]
+        rows = np.nonzero(np.isin(codes[:, 0], [names.index(name) for name in channels]))[0]
+        groups, inverse = np.unique(codes[np.ix_(rows, columns)], axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(len(groups)))
+        sums = np.add.reduceat(self.data[rows[order]], starts, axis=0)
+
+        traces = {}
+        for group, data in zip(groups, sums):
+            pairs = [f"{ips[column - 1]}:{values[column - 1][code]}" for column, code in zip(columns[1:], group[1:]) if code >= 0]
+            title = f"{names[group[0]]}:{','.join(pairs)}" if len(columns) > 1 else names[group[0]]
+            traces[title] = data
+
+        return {title: traces[title] for title in sorted(traces)}
+
+    def _index(self) -> tuple:
+        """Return channel names, IP names, values of each IP, and (channels x 1 + IPs) codes of each channel title."""
+
+        titles = list(self._channels)
+        if titles != self._index_titles:
+            names, ips, values = {}, {}, []
+            parsed = []
+            for title in titles:
+                name, _, pairs = title.partition(":")
+                kvps = [pair.split(":", 1) for pair in pairs.split(",")] if pairs else []
+                for ip, value in kvps:
+                    if ip not in ips:
+                        ips[ip] = len(ips)
+                        values.append({})
+                    values[ips[ip]].setdefault(value, len(values[ips[ip]]))
+                parsed.append((names.setdefault(name, len(names)), kvps))
+            # Channels without a value for an IP get code -1
+            codes = np.full((len(titles), 1 + len(ips)), -1, dtype=np.int64)
+            for row, (name, kvps) in enumerate(parsed):
+                codes[row, 0] = name
+                for ip, value in kvps:
+                    codes[row, 1 + ips[ip]] = values[ips[ip]][value]
+            self._index_data = (list(names), list(ips), [list(ip_values) for ip_values in values], codes)
+            self._index_titles = titles
+
+        return self._index_data
+
+
+def _read_header(filename: str) -> dict:
+    """Return the header of a channel report, usually from the first few kilobytes of the file."""
+
+    with open(filename, "rb") as file:
+        head = file.read(65536).decode("utf-8", errors="ignore")
+    match = re.search(r'"Header"\s*:\s*', head)
+    if match is not None:
+        try:
+            header, _ = _DECODER.raw_decode(head, match.end())
+            if isinstance(header, dict) and (_TIMESTEPS in header):
+                return header
+        except json.JSONDecodeError:
+            pass
+
+    # The header isn't at the start of the file, scan the whole file without decoding any channels.
+    jason, _ = _load_selected(filename, lambda title: False)
+    assert _HEADER in jason, f"'{filename}' missing '{_HEADER}' object."
+    assert _TIMESTEPS in jason[_HEADER], f"'{filename}' missing '{_HEADER}/{_TIMESTEPS}' key."
+
+    return jason[_HEADER]
+
+
+def _read_channels(path: Union[str, Path], channels: list[str]) -> np.ndarray:
+    """Return the data of the given channels of a report, shape (channels, time steps)."""
+    report = ChannelReport(str(path), channels=channels)
+    return np.stack([report[name].data for name in channels])
+
+
+def _read_reports(paths: Iterable[Union[str, Path]], channels: list[str], workers: int = None):
+    """Yield the index and channel data of each report, in completion order if read in parallel."""
+    return parallel_map(_read_channels, paths, workers, channels)
+
+
+def _binary_offset(length: int) -> int:
+    """Offset of the channel data in a binary report with length bytes of JSON metadata."""
+    unaligned = len(_BINARY_MAGIC) + 8 + length
+    return (unaligned + _BINARY_ALIGNMENT - 1) // _BINARY_ALIGNMENT * _BINARY_ALIGNMENT
+
+
+def write_csv(filename: Union[str, Path], names: list[str], columns: list, transpose: bool = False, float_format: str = None) -> None:
+    """
+    Write named series of values (lists or NumPy arrays) to a CSV file, as ChannelReport.to_csv() does.
+
+    Numeric arrays are formatted in blocks and joined directly, rather than value by value through the csv
+    module, so large (e.g. transposed) exports are fast. Values are formatted as str() would format them
+    unless float_format, e.g. "%.6g", is given for floating point arrays; that is also faster.
+
+    Transposed columns must all have the same length, otherwise a ValueError is raised.
+    """
+
+    lengths = set(len(values) for values in columns)
+    if transpose and (len(lengths) > 1):
+        raise ValueError(f"Columns must have the same length to be transposed, got lengths {sorted(lengths)}.")
+
+    with open(filename, "w") as g_f:
+        csv_obj = csv.writer(g_f, dialect='unix', quoting=csv.QUOTE_MINIMAL)
+        if not transpose:  # default
+            for name, values in zip(names, columns):
+                if _is_numeric(values):
+                    # numbers never need quoting, only the name goes through the csv module
+                    g_f.write(",".join([_csv_fields([name])] + _as_text(values, float_format)) + "\n")
+                else:
+                    csv_obj.writerow([name] + list(values))
+        else:  # transposed
+            csv_obj.writerow(names)
+            numeric = all(_is_numeric(values) for values in columns)
+            length = lengths.pop() if lengths else 0
+            for start in range(0, length, _CSV_BLOCK):
+                stop = min(start + _CSV_BLOCK, length)
+                if numeric:
+                    g_f.write("".join(",".join(row) + "\n" for row in zip(*[_as_text(values[start:stop], float_format) for values in columns])))
+                else:
+                    csv_obj.writerows(zip(*[list(values[start:stop]) for values in columns]))
+
+    return
+
+
+def _is_numeric(values) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind in "biuf"
+
+
+def _as_text(values: np.ndarray, float_format: str = None) -> list[str]:
+    if float_format and (values.dtype.kind == "f"):
+        return [float_format % value for value in values.tolist()]
+    # repr() of Python floats is faster than NumPy's string conversion and formats float64 values identically
+    return list(map(repr, values.tolist())) if values.dtype == np.float64 else values.astype(str).tolist()
+
+
+def _csv_fields(fields: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, dialect='unix', quoting=csv.QUOTE_MINIMAL).writerow(fields)
+    return buffer.getvalue()[:-1]
+
+
+def _channel_data(channel) -> Union[list, np.ndarray]:
+    # Callers, e.g. utils.save_to_csv(), have stored plain arrays in the channels dictionary.
+    return channel.data if isinstance(channel, Channel) else channel
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+def _load_selected(filename: str, wanted) -> tuple:
+    """
+    Read a channel report decoding the header and only the channels for which wanted(title) is True.
+
+    Returns the report as a dictionary, with only the wanted channels, and the number of channels in the file.
+    """
+
+    text = Path(filename).read_text(encoding="utf-8-sig")
+    jason = {}
+    channels = {}
+    count = 0
+
+    def visit_channel(key: str, index: int) -> int:
+        nonlocal count
+        count += 1
+        if wanted(key):
+            channels[key], index = _DECODER.raw_decode(text, index)
+            return index
+        return _skip_value(text, index)
+
+    def visit_member(key: str, index: int) -> int:
+        if key == _CHANNELS:
+            jason[key] = channels
+            return _scan_object(text, index, visit_channel)
+        jason[key], index = _DECODER.raw_decode(text, index)
+        return index
+
+    _scan_object(text, _WHITESPACE.match(text).end(), visit_member)
+
+    return jason, count
+
+
+def _scan_object(text: str, index: int, visit) -> int:
+    """
+    Walk the members of the JSON object starting at text[index].
+
+    visit(key, value_index) is called for each member and returns the index just past the member's value.
+    Returns the index just past the object.
+    """
+
+    def expect(_char: str, _index: int) -> None:
+        if text[_index:_index + 1] != _char:
+            raise json.JSONDecodeError(f"Expecting '{_char}'", text, _index)
+
+    expect("{", index)
+    index = _WHITESPACE.match(text, index + 1).end()
+    if text[index:index + 1] == "}":
+        return index + 1
+
+    while True:
+        expect('"', index)
+        key, index = json.decoder.scanstring(text, index + 1)
+        index = _WHITESPACE.match(text, index).end()
+        expect(":", index)
+        index = _WHITESPACE.match(text, index + 1).end()
+        index = _WHITESPACE.match(text, visit(key, index)).end()
+        if text[index:index + 1] == "}":
+            return index + 1
+        expect(",", index)
+        index = _WHITESPACE.match(text, index + 1).end()
+
+
+def _skip_value(text: str, index: int) -> int:
+    """Return the index just past the JSON value starting at text[index] without decoding arrays or objects."""
+
+    if text[index:index + 1] not in ("{", "["):
+        _, index = _DECODER.raw_decode(text, index)
+        return index
+
+    # Only brackets and strings matter, the regular expression jumps over numbers and other characters.
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(text, index)
+        if match is None:
+            raise json.JSONDecodeError("Unterminated value", text, index)
+        char = match.group()
+        index = match.end()
+        if char == '"':
+            string = _STRING.match(text, match.start())
+            if string is None:
+                raise json.JSONDecodeError("Unterminated string", text, match.start())
+            index = string.end()
+            continue
+        if char == "[":
+            # Arrays of numbers, e.g. channel data, end at the next ']' and str.find() is much faster than a regular expression.
+            end = text.find("]", index)
+            if (end >= 0) and all(text.find(nested, index, end) < 0 for nested in '[{"'):
+                index = end + 1
+                if depth == 0:
+                    return index
+                continue
+        depth += 1 if char in "{[" else -1
+        if depth == 0:
+            return index
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Functions for ChannelReport.derive() which compute derived channels from other channels.
+
+Each function returns a function of the report, evaluated when the derived channel is first accessed.
+The array versions, e.g. rolling_mean_of(), work on any NumPy array whose first axis is time.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+from emod_api.utils.resample import SUM, MEAN, LAST, MIN, MAX  # noqa: F401
+from emod_api.utils.resample import resample as _resample
+
+
+def ratio(numerator: str, denominator: str) -> Callable:
+    """numerator / denominator, NaN where the denominator is zero, e.g. prevalence = Infected / Statistical Population"""
+
+    def function(report) -> np.ndarray:
+        top = np.asarray(report[numerator].data, dtype=np.float64)
+        bottom = np.asarray(report[denominator].data, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(bottom != 0, top / bottom, np.nan)
+
+    return function
+
+
+def rolling_mean(title: str, window: int) -> Callable:
+    """Trailing mean over window time steps, see rolling_mean_of()."""
+    return lambda report: rolling_mean_of(report[title].data, window)
+
+
+def cumulative_sum(title: str) -> Callable:
+    """Running total, e.g. cumulative infections from New Infections."""
+    return lambda report: np.cumsum(np.asarray(report[title].data, dtype=np.float64), axis=0)
+
+
+def resample(title: str, interval: float, how: str = SUM) -> Callable:
+    """
+    Combine consecutive time steps into intervals of simulation time, e.g. 7 for weekly from daily data.
+
+    The number of time steps per interval is interval / the report's step_size, see resample_of().
+    """
+
+    def function(report) -> np.ndarray:
+        steps = interval / report.step_size
+        assert float(steps).is_integer() and (steps >= 1), f"interval ({interval}) must be a multiple of the report's step size ({report.step_size})."
+        return resample_of(report[title].data, int(steps), how)
+
+    return function
+
+
+def rolling_mean_of(values, window: int) -> np.ndarray:
+    """
+    Trailing mean over window time steps, the same length as values.
+
+    The first window - 1 values are means of the values so far.
+    """
+
+    assert window >= 1, "window must be >= 1"
+    values = np.asarray(values, dtype=np.float64)
+    totals = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    counts = (ends - starts).reshape((-1,) + (1,) * (values.ndim - 1))
+
+    return (totals[ends] - totals[starts]) / counts
+
+
+def resample_of(values, steps: int, how: str = SUM) -> np.ndarray:
+    """
+    Combine each run of steps consecutive time steps with "sum", "mean", "last", "min", or "max".
+
+    A final, shorter run is combined from the time steps available, see emod_api.utils.resample.
+    """
+    return _resample(values, steps, how)
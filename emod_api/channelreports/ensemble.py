@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+"""Streaming statistics over an ensemble of channel reports, e.g. all the InsetChart.json files of an experiment."""
+
+from pathlib import Path
+from typing import Callable, Iterable, Union
+
+import numpy as np
+
+from emod_api.channelreports.channels import _read_reports
+
+MEAN = "mean"
+STD = "std"
+VAR = "var"
+MIN = "min"
+MAX = "max"
+QUANTILES = "quantiles"
+COUNT = "count"
+
+STATS = [MEAN, STD, VAR, MIN, MAX, QUANTILES]
+
+
+class RunningStatistics(object):
+
+    """
+    Count, mean, variance, minimum, and maximum of a stream of time series, updated with Welford's algorithm.
+
+    Time series may have different lengths (e.g. simulations which stop early), statistics at each time step are
+    over the series which reached that time step. Each series may have additional dimensions, e.g. (time, nodes).
+    Memory use depends on the length of the series, not on the number of series.
+    """
+
+    def __init__(self):
+
+        self._count = np.zeros(0, dtype=np.int64)
+        self._mean = None
+        self._m2 = None
+        self._min = None
+        self._max = None
+
+        return
+
+    def update(self, values) -> None:
+        """Add one time series, first axis is time."""
+
+        values = np.asarray(values, dtype=np.float64)
+        length = values.shape[0]
+        self._grow(values)
+
+        self._count[:length] += 1
+        count = self._count[:length].reshape((length,) + (1,) * (values.ndim - 1))
+        delta = values - self._mean[:length]
+        self._mean[:length] += delta / count
+        self._m2[:length] += delta * (values - self._mean[:length])
+        np.minimum(self._min[:length], values, out=self._min[:length])
+        np.maximum(self._max[:length], values, out=self._max[:length])
+
+        return
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of series with a value at each time step."""
+        return self._count
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self._mean
+
+    def variance(self, ddof: int = 0) -> np.ndarray:
+        """Variance at each time step, NaN where fewer than ddof + 1 series have a value."""
+        count = (self._count - ddof).reshape((-1,) + (1,) * (self._m2.ndim - 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(count > 0, self._m2 / np.maximum(count, 1), np.nan)
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        return np.sqrt(self.variance(ddof))
+
+    @property
+    def min(self) -> np.ndarray:
+        return self._min
+
+    @property
+    def max(self) -> np.ndarray:
+        return self._max
+
+    def _grow(self, values: np.ndarray) -> None:
+
+        if self._mean is None:
+            shape = (0,) + values.shape[1:]
+            self._mean = np.zeros(shape)
+            self._m2 = np.zeros(shape)
+            self._min = np.full(shape, np.inf)
+            self._max = np.full(shape, -np.inf)
+        elif values.shape[1:] != self._mean.shape[1:]:
+            raise ValueError(f"Series shape {values.shape} does not match previous series {self._mean.shape}.")
+
+        extra = values.shape[0] - len(self._count)
+        if extra > 0:
+            shape = (extra,) + values.shape[1:]
+            self._count = np.concatenate([self._count, np.zeros(extra, dtype=np.int64)])
+            self._mean = np.concatenate([self._mean, np.zeros(shape)])
+            self._m2 = np.concatenate([self._m2, np.zeros(shape)])
+            self._min = np.concatenate([self._min, np.full(shape, np.inf)])
+            self._max = np.concatenate([self._max, np.full(shape, -np.inf)])
+
+        return
+
+
+class StreamingQuantiles(object):
+
+    """
+    Estimated quantiles of a stream of time series using the P-square algorithm (Jain and Chlamtac, 1985).
+
+    Five markers are kept per quantile and time step, so memory use does not depend on the number of series.
+    Quantiles of time steps with fewer than five values are exact. Like RunningStatistics, series may have
+    different lengths and additional dimensions.
+    """
+
+    def __init__(self, probabilities: Iterable[float] = (0.05, 0.5, 0.95)):
+
+        self._p = np.asarray(list(probabilities), dtype=np.float64)
+        if (self._p.ndim != 1) or (len(self._p) == 0) or np.any((self._p <= 0) | (self._p >= 1)):
+            raise ValueError(f"Quantile probabilities must be between 0 and 1 (exclusive), got {probabilities}.")
+        self._increments = np.stack([np.zeros_like(self._p), self._p / 2, self._p, (1 + self._p) / 2, np.ones_like(self._p)], axis=-1)
+        self._count = np.zeros(0, dtype=np.int64)
+        self._shape = None
+        self._first = None      # (time, values, 5) first five values at each time step
+        self._heights = None    # (time, values, quantiles, 5) marker heights
+        self._positions = None  # (time, values, quantiles, 5) marker positions
+        self._desired = None    # (time, values, quantiles, 5) desired marker positions
+
+        return
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return self._p
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of series with a value at each time step."""
+        return self._count
+
+    def update(self, values) -> None:
+        """Add one time series, first axis is time."""
+
+        values = np.asarray(values, dtype=np.float64)
+        length = values.shape[0]
+        self._grow(values)
+        values = values.reshape(length, -1)
+
+        count = self._count[:length]
+        starting = count < 5
+        if np.any(starting):
+            rows = np.nonzero(starting)[0]
+            self._first[rows, :, count[rows]] = values[rows]
+            ready = rows[count[rows] == 4]
+            if len(ready):
+                ordered = np.sort(self._first[ready], axis=-1)
+                self._heights[ready] = ordered[:, :, None, :]
+                self._positions[ready] = np.arange(5, dtype=np.float64)
+                self._desired[ready] = 4 * self._increments
+        rows = np.nonzero(~starting)[0]
+        if len(rows):
+            self._step(rows, values[rows])
+        self._count[:length] += 1
+
+        return
+
+    @property
+    def quantiles(self) -> np.ndarray:
+        """Quantile estimates, shape (number of quantiles, time, ...)"""
+
+        estimates = np.empty(self._heights.shape[:3])
+        estimates[...] = self._heights[..., 2]
+        for count in range(1, 5):
+            rows = np.nonzero(self._count == count)[0]
+            if len(rows):
+                # (quantiles, rows, values)
+                exact = np.quantile(self._first[rows, :, :count], self._p, axis=-1)
+                estimates[rows] = np.moveaxis(exact, 0, -1)
+
+        return np.moveaxis(estimates, -1, 0).reshape((len(self._p), len(self._count)) + self._shape)
+
+    def _step(self, rows: np.ndarray, values: np.ndarray) -> None:
+
+        heights = self._heights[rows]
+        positions = self._positions[rows]
+        desired = self._desired[rows]
+        x = np.broadcast_to(values[:, :, None], heights.shape[:3])
+
+        np.minimum(heights[..., 0], x, out=heights[..., 0])
+        np.maximum(heights[..., 4], x, out=heights[..., 4])
+        cell = np.sum(heights[..., 1:4] <= x[..., None], axis=-1)
+        positions += np.arange(5) > cell[..., None]
+        desired += self._increments
+
+        for i in (1, 2, 3):
+            offset = desired[..., i] - positions[..., i]
+            up = (offset >= 1) & (positions[..., i + 1] - positions[..., i] > 1)
+            down = (offset <= -1) & (positions[..., i - 1] - positions[..., i] < -1)
+            move = up | down
+            if not np.any(move):
+                continue
+            d = np.where(up, 1.0, -1.0)
+            n, n_lo, n_hi = positions[..., i], positions[..., i - 1], positions[..., i + 1]
+            q, q_lo, q_hi = heights[..., i], heights[..., i - 1], heights[..., i + 1]
+            parabolic = q + d / (n_hi - n_lo) * ((n - n_lo + d) * (q_hi - q) / (n_hi - n) + (n_hi - n - d) * (q - q_lo) / (n - n_lo))
+            linear = q + d * (np.where(up, q_hi, q_lo) - q) / (np.where(up, n_hi, n_lo) - n)
+            adjusted = np.where((q_lo < parabolic) & (parabolic < q_hi), parabolic, linear)
+            heights[..., i] = np.where(move, adjusted, q)
+            positions[..., i] += np.where(move, d, 0.0)
+
+        self._heights[rows] = heights
+        self._positions[rows] = positions
+        self._desired[rows] = desired
+
+        return
+
+    def _grow(self, values: np.ndarray) -> None:
+
+        if self._shape is None:
+            self._shape = values.shape[1:]
+        elif values.shape[1:] != self._shape:
+            raise ValueError(f"Series shape {values.shape} does not match previous series {(len(self._count),) + self._shape}.")
+
+        extra = values.shape[0] - len(self._count)
+        if extra > 0:
+            width = int(np.prod(self._shape))
+            markers = (extra, width, len(self._p), 5)
+            self._count = np.concatenate([self._count, np.zeros(extra, dtype=np.int64)])
+            if self._first is None:
+                self._first = np.zeros((extra, width, 5))
+                self._heights, self._positions, self._desired = np.zeros(markers), np.zeros(markers), np.zeros(markers)
+            else:
+                self._first = np.concatenate([self._first, np.zeros((extra, width, 5))])
+                self._heights = np.concatenate([self._heights, np.zeros(markers)])
+                self._positions = np.concatenate([self._positions, np.zeros(markers)])
+                self._desired = np.concatenate([self._desired, np.zeros(markers)])
+
+        return
+
+
+def aggregate(paths: Iterable[Union[str, Path]],
+              channels: list[str],
+              stats: list[str] = (MEAN, STD),
+              quantiles: Iterable[float] = (0.05, 0.5, 0.95),
+              workers: int = None,
+              transform: Callable[[np.ndarray], np.ndarray] = None) -> dict:
+    """
+    Compute statistics of channels over many channel reports (e.g. the InsetChart.json files of an experiment).
+
+    Reports are read in parallel, reading only the requested channels, and statistics are updated as each
+    report arrives so memory use does not grow with the number of reports. Reports may have different
+    numbers of time steps; statistics at each time step are over the reports which reached that time step.
+
+    Args:
+        paths: channel report files
+        channels: names of the channels to aggregate
+        stats: any of "mean", "std", "var", "min", "max", and "quantiles"
+        quantiles: probabilities of the quantiles to estimate if "quantiles" is in stats
+        workers: number of worker processes, defaults to the number of CPUs, 1 reads the reports in this process
+        transform: optional function applied to each channel's data before aggregation, e.g. smoothing
+
+    Returns:
+        Dictionary of channel name to dictionary of statistic name to array. "count" (the number of
+        reports with data at each time step) is always included and "quantiles" has shape
+        (number of quantiles, time steps).
+
+    Examples:
+        Mean and 95% interval of prevalence for an experiment::
+
+            from pathlib import Path
+            from emod_api.channelreports.ensemble import aggregate
+
+            paths = Path("experiment").glob("*/output/InsetChart.json")
+            results = aggregate(paths, ["Infected"], stats=["mean", "quantiles"], quantiles=[0.025, 0.975])
+            mean = results["Infected"]["mean"]
+    """
+
+    unknown = [stat for stat in stats if stat not in STATS]
+    if unknown:
+        raise ValueError(f"Unknown statistic(s) {unknown}, expected some of {STATS}.")
+
+    moments = {channel: RunningStatistics() for channel in channels}
+    sketches = {channel: StreamingQuantiles(quantiles) for channel in channels} if QUANTILES in stats else {}
+
+    for _, data in _read_reports(paths, list(channels), workers):
+        for channel, values in zip(channels, data):
+            if transform is not None:
+                values = transform(values)
+            moments[channel].update(values)
+            if sketches:
+                sketches[channel].update(values)
+
+    results = {}
+    for channel in channels:
+        moment = moments[channel]
+        if moment.mean is None:
+            raise ValueError("No channel reports to aggregate.")
+        result = {COUNT: moment.count}
+        if MEAN in stats:
+            result[MEAN] = moment.mean
+        if STD in stats:
+            result[STD] = moment.std()
+        if VAR in stats:
+            result[VAR] = moment.variance()
+        if MIN in stats:
+            result[MIN] = moment.min
+        if MAX in stats:
+            result[MAX] = moment.max
+        if QUANTILES in stats:
+            result[QUANTILES] = sketches[channel].quantiles
+        results[channel] = result
+
+    return results
@@ -3,12 +3,17 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import sqlite3
+import warnings
+
+from emod_api.channelreports.channels import ChannelReport
+from emod_api.channelreports.ensemble import aggregate, MEAN, STD
 
 
 def collect(exp_id: str,
             chan: str = "Infected",
             tag: str = None,
-            smoothing: bool = True) -> dict:
+            smoothing: bool = True,
+            workers: int = None) -> dict:
     """
     Collect all the time series data for a given channel for a given experiment from InsetChart.json
     files in local subdirectory that have been downoaded from COMPS, assuming following structure.
@@ -17,17 +22,89 @@ def collect(exp_id: str,
            sim_id/
                InsetChart.json
 
+    Deprecated, use summarize(), which computes the mean and standard deviation without holding every
+    simulation's data in memory. Files are read in parallel, as for summarize().
+
     Args:
         exp_id: Experiment Id that has had data downloaded to current working diretory.
         chan:   Channel name
         tag:    key=value. Using results.db (sqlite3, from emodpy), limit results to just where key=value.
                 If value is set to SWEEP, find all values for key and plot all values separately (but with mean/spread from other tags).
+        smoothing: apply a 7 day moving average to each simulation's data.
+        workers: number of worker processes, defaults to the number of CPUs.
 
     Returns:
         Array of channel data for further processing.
     """
 
+    warnings.warn("collect() is deprecated. Please use summarize().", DeprecationWarning, stacklevel=2)
+
     chan_data = {}
+    for value, simdirs in _group_simulations(exp_id, tag).items():
+        chan_data[value] = []
+        paths = _report_paths(exp_id, simdirs)
+        if paths:
+            array, mask = ChannelReport.stack(paths, [chan], workers=workers)
+            for series, valid in zip(array[:, 0], mask):
+                chan_data[value].append(_moving_average(series[valid]) if smoothing else series[valid])
+
+    max_len = max((len(data) for series in chan_data.values() for data in series), default=0)
+    if max_len == 0:
+        raise ValueError(f"No InsetChart.json files with channel data for {chan} and experiment {exp_id}.")
+    """
+    If users run simulations that end when prevalence is zero, the length of the time series can vary
+    We need to get them all the same to calc the mean.
+    """
+    data_for_plotting = {}
+    for poi in chan_data:
+        data_for_plotting[poi] = [np.pad(data, (0, max_len - len(data))) for data in chan_data[poi]]
+
+    return data_for_plotting
+
+
+def summarize(exp_id: str,
+              chan: str = "Infected",
+              tag: str = None,
+              smoothing: bool = True,
+              workers: int = None) -> dict:
+    """
+    Compute the mean and standard deviation of a channel over the InsetChart.json files of an experiment,
+    laid out as for collect(), without holding every simulation's data in memory.
+
+    Files are read in parallel. Unlike (deprecated) collect(), shorter time series are not padded with zeros; the
+    statistics at each time step are over the simulations which reached that time step.
+
+    Args:
+        exp_id: Experiment Id that has had data downloaded to current working diretory.
+        chan:   Channel name
+        tag:    key=value, as for collect().
+        smoothing: apply a 7 day moving average to each simulation's data.
+        workers: number of worker processes, defaults to the number of CPUs.
+
+    Returns:
+        Dictionary of tag value ("ref" without a tag) to dictionary of "mean", "std", and "count" arrays.
+    """
+
+    summary = {}
+    for value, simdirs in _group_simulations(exp_id, tag).items():
+        paths = _report_paths(exp_id, simdirs)
+        if paths:
+            transform = _moving_average if smoothing else None
+            summary[value] = aggregate(paths, [chan], stats=[MEAN, STD], workers=workers, transform=transform)[chan]
+    if not summary:
+        raise ValueError(f"No InsetChart.json files with channel data for {chan} and experiment {exp_id}.")
+
+    return summary
+
+
+def _report_paths(exp_id: str, simdirs: list) -> list[str]:
+    """Return the InsetChart.json files of the given simulations which exist."""
+    return [path for path in [os.path.join(exp_id, sim, "InsetChart.json") for sim in simdirs] if os.path.exists(path)]
+
+
+def _group_simulations(exp_id: str, tag: str = None) -> dict:
+    """Return simulation ids grouped by tag value ("ref" without a tag)."""
+
     groupby_values = {}
     if tag:
         if len(tag.split("=")) == 1:
@@ -58,50 +135,17 @@ def collect(exp_id: str,
         groupby_values["ref"] = os.listdir(exp_id)
         groupby_values["ref"].remove("results.db")
 
-    def moving_average(x, w=7):
-        return np.convolve(x, np.ones(w), 'valid') / w
-
-    max_len = 0
-    # poi = param of interest
-    for value in groupby_values:
-        simdirs = groupby_values[value]
-        for sim in simdirs:
-            thedir = os.path.join(exp_id, sim)
-
-            if value not in chan_data:
-                chan_data[value] = []
-            if not os.path.exists(thedir + "/InsetChart.json"):
-                continue
-            with open(thedir + "/InsetChart.json") as fp:
-                icj = json.loads(fp.read())
-            if chan not in icj["Channels"]:
-                raise ValueError(f"Can't find channel {chan} in file. Did find {icj['Channels'].keys()}.")
-            new_data = np.asarray(icj["Channels"][chan]["Data"])
-            if smoothing:
-                new_data = moving_average(new_data)
-            chan_data[value].append(new_data)
-            if len(new_data) > max_len:
-                max_len = len(new_data)
-    if max_len == 0:
-        raise ValueError(f"No InsetChart.json files with channel data for {chan} and experiment {exp_id}.")
-    """
-    If users run simulations that end when prevalence is zero, the length of the time series can vary
-    We need to get them all the same to calc the mean.
-    """
-    data_for_plotting = {}
-    for poi in chan_data:
-        data_for_plotting[poi] = []
-        for data in chan_data[poi]:
-            if len(data) < max_len:
-                data = np.pad(data, (0, max_len - len(data)))
-            data_for_plotting[poi].append(data)
+    return groupby_values
 
-    return data_for_plotting
+
+def _moving_average(x, w=7):
+    return np.convolve(x, np.ones(w), 'valid') / w
 
 
 def display(chan_data, save=False, chan_name="Infected", exp_id=None):
     """
-    Plot mean and std dev of the array/list of time series-es in chan_data.
+    Plot mean and std dev of the array/list of time series-es in chan_data, from collect(),
+    or of the mean and std dev arrays in chan_data, from summarize().
     """
     mean_chan_data = None
     spread_chan_data = None
@@ -112,13 +156,19 @@ def display(chan_data, save=False, chan_name="Infected", exp_id=None):
         prev_list = chan_data[poi_chan_data]
         if len(prev_list) == 0:
             raise ValueError("Input channel data array seems to have no data.")
-        mean_chan_data = np.mean(np.array(prev_list), axis=0)
+        if isinstance(prev_list, dict):
+            mean_chan_data = prev_list[MEAN]
+        else:
+            mean_chan_data = np.mean(np.array(prev_list), axis=0)
         if len(chan_data) == 1 and save:
             ref_json = {"Channels": {"Channel": {"Data": []}}}
             ref_json["Channels"]["Channel"]["Data"] = list(mean_chan_data)
             with open("mean_ref.json", "w") as fp:
                 json.dump(ref_json, fp, indent=4)
-        spread_chan_data = np.std(np.array(prev_list), axis=0)
+        if isinstance(prev_list, dict):
+            spread_chan_data = prev_list[STD]
+        else:
+            spread_chan_data = np.std(np.array(prev_list), axis=0)
 
         t = np.arange(len(mean_chan_data))
         ax.plot(t, mean_chan_data, label=poi_chan_data)
@@ -145,5 +195,5 @@ if __name__ == "__main__":
     if not os.path.exists(str(args.experiment_id)):
         raise ValueError(f"Don't see folder for {args.experiment_id}.")
 
-    chan_data = collect(args.experiment_id, args.channel, args.tag)
+    chan_data = summarize(args.experiment_id, args.channel, args.tag)
     display(chan_data, False, args.channel, args.experiment_id)
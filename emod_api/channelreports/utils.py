@@ -9,7 +9,7 @@ from typing import Union, Optional
 import matplotlib.pyplot as plt
 import numpy as np
 
-from emod_api.channelreports.channels import ChannelReport
+from emod_api.channelreports.channels import Channel, PropertyReport, write_csv
 
 __all__ = [
     "property_report_to_csv",
@@ -100,9 +100,12 @@ def _validate_property_report_channels(channels, channel_data) -> None:
 def _validate_property_report_ips(groupby, channel_data) -> None:
 
     if groupby:
-        first = next(iter(channel_data))
-        ip_string = first.split(":", 1)[1]
-        ips = [kvp.split(":")[0] for kvp in ip_string.split(",")]
+        # IPs from all the channels, not just the first, in order of appearance
+        ips = {}
+        for key in channel_data:
+            ip_string = key.split(":", 1)[1] if ":" in key else ""
+            ips.update((kvp.split(":")[0], None) for kvp in ip_string.split(",") if kvp)
+        ips = list(ips)
         not_found = [ip for ip in groupby if ip not in ips]
         if not_found:
             print("Valid IPs:")
@@ -130,28 +133,22 @@ def accumulate_channel_data(channels: list[str], verbose: bool, groupby: list[st
         tuple of dictionary of aggregated data, keyed on channel name, and of Numpy array of normalization values
     """
 
-    trace_values = {}
-    pool_keys = sorted(channel_data)
-
-    name_ip_pairs = map(lambda key: tuple(key.split(":", 1)), pool_keys)
-    name_ip_pairs_to_process = filter(lambda p: p[0] in channels, name_ip_pairs)
-    for (channel_title, key_value_pairs) in name_ip_pairs_to_process:
-
-        if verbose:
-            print(f"Processing channel '{channel_title}:{key_value_pairs}'")
+    # Parse the channel titles once and sum all the traces in one pass over a single array
+    report = PropertyReport()
+    for title in sorted(channel_data):
+        channel_title = title.split(":", 1)[0]
+        if channel_title in channels:
+            if verbose:
+                print(f"Processing channel '{title}'")
+            report.channels[title] = Channel(title, channel_data[title].get("Units", ""), channel_data[title]["Data"])
 
-        key_value_pairs = key_value_pairs.split(',')
-        trace_name = __get_trace_name(channel_title, key_value_pairs, groupby)
-        trace_data = np.array(channel_data[f"{channel_title}:{','.join(key_value_pairs)}"]['Data'], dtype=np.float32)
+    if not report.channels:
+        return {}
 
-        if trace_name not in trace_values:
-            if verbose:
-                print(f"New trace: '{trace_name}'")
-            trace_values[trace_name] = trace_data
-        else:
-            if verbose:
-                print(f"Add to trace: '{trace_name}'")
-            trace_values[trace_name] += trace_data
+    trace_values = {name: data.astype(np.float32) for name, data in report.group_by(channels=report.names, groupby=groupby).items()}
+    if verbose:
+        for trace_name in trace_values:
+            print(f"Trace: '{trace_name}'")
 
     return trace_values
 
@@ -202,7 +199,7 @@ def save_to_csv(trace_values: dict[str, np.ndarray],
                 transpose: bool = False) -> None:
 
     """
-    Save property report to CSV. Uses underlying ChannelReport.to_csv() function.
+    Save property report to CSV, formatted as ChannelReport.to_csv() would.
 
     Args:
         trace_values: full set of available channels, keyed on channel name
@@ -210,12 +207,8 @@ def save_to_csv(trace_values: dict[str, np.ndarray],
         transpose:    write channels as columns rather than rows
     """
 
-    report = ChannelReport()
-
-    for channel, data in trace_values.items():
-        report.channels[channel] = data
-
-    report.to_csv(Path(filename), transpose=transpose)  # by default, use _all_ the channels we just added
+    names = sorted(trace_values)    # by default, use _all_ the channels
+    write_csv(Path(filename), names, [trace_values[name] for name in names], transpose)
 
     return
 
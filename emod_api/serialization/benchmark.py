@@ -0,0 +1,357 @@
+#!/usr/bin/python
+
+"""
+Benchmarks for reading and writing serialized population files.
+
+Files of each version (1-6) are synthesized at a configurable scale (nodes x humans x infections)
+and the following are measured for each version:
+
+- write: time to write the file and the resulting throughput
+- open: time for dft.read()
+- iterate: time to visit every human in every node
+- random access: time for random (node, human) lookups
+- bulk edit: time to modify every human and store the nodes again
+- peak RSS of the process running the case
+
+Each case runs in its own process so that peak RSS is not polluted by earlier cases.
+Results are written as JSON and can be compared against a baseline results file::
+
+    python -m emod_api.serialization.benchmark --nodes 10 --humans 10000 --output results.json
+    python -m emod_api.serialization.benchmark --nodes 10 --humans 10000 --baseline results.json
+"""
+
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import emod_api.serialization.dtk_file_tools as dft
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+
+VERSIONS = [1, 2, 3, 4, 5, 6]
+AUTO = 'auto'   # engine of version 6 files, which choose the compression of each chunk by its size
+TIMINGS = ['write_s', 'open_s', 'iterate_s', 'random_access_s', 'bulk_edit_s']
+
+
+def make_simulation(num_nodes, num_humans, num_infections):
+    """
+    Return a synthetic simulation object with SUID generators consistent with the population.
+    """
+    sim = {
+        '__class__': 'Simulation',
+        'serializationMask': 0,
+        'infectionSuidGenerator': {'next_suid': {'id': num_nodes * num_humans * num_infections + 1}, 'rank': 0, 'numtasks': 1},
+        'individualHumanSuidGenerator': {'next_suid': {'id': num_nodes * num_humans + 1}, 'rank': 0, 'numtasks': 1},
+        'sim_type': 0,
+        'Run_Number': 1,
+        'nodes': []
+    }
+    return sim
+
+
+def make_node(node_index, num_humans, num_infections):
+    """
+    Return a synthetic node object (0-based node_index) with num_humans humans, each with num_infections infections.
+    """
+    first_human = node_index * num_humans
+    node = {
+        '__class__': 'Node',
+        'serializationMask': 0,
+        'suid': {'id': node_index + 1},
+        'externalId': node_index + 1,
+        'm_IndividualHumanSuidGenerator': {'next_suid': {'id': first_human + num_humans + 1}, 'rank': 0, 'numtasks': 1},
+        'home_individual_ids': [],
+        'population_scaling_factor': 1.0,
+        'individualHumans': [make_human(first_human + index + 1, num_infections) for index in range(num_humans)]
+    }
+    return node
+
+
+def make_human(suid, num_infections):
+    """
+    Return a synthetic IndividualHuman object.
+    """
+    human = {
+        '__class__': 'IndividualHuman',
+        'suid': {'id': suid},
+        'm_age': float((suid * 7919) % 36500),
+        'm_gender': suid % 2,
+        'm_mc_weight': 1.0,
+        'm_daily_mortality_rate': 0.0,
+        'is_pregnant': False,
+        'pregnancy_timer': 0.0,
+        'susceptibility': {'__class__': 'Susceptibility', 'age': 0.0, 'mod_acquire': 1.0, 'mod_transmit': 1.0, 'mod_mortality': 1.0},
+        'infections': [make_infection(suid * num_infections + index, suid) for index in range(num_infections)],
+        'interventions': {'__class__': 'InterventionsContainer', 'interventions': []},
+        'm_is_infected': num_infections > 0,
+        'infectiousness': 0.0,
+        'cumulativeInfs': num_infections,
+        'migration_mod': 1.0,
+        'home_node_id': {'id': 1},
+    }
+    return human
+
+
+def make_infection(suid, human_suid):
+    """
+    Return a synthetic Infection object.
+    """
+    infection = {
+        '__class__': 'Infection',
+        'suid': {'id': suid},
+        'duration': float(human_suid % 30),
+        'total_duration': 30.0,
+        'incubation_timer': 0.0,
+        'infectious_timer': float(human_suid % 30),
+        'infectiousness': 1.0,
+        'StateChange': 0
+    }
+    return infection
+
+
+def synthesize(version, filename, num_nodes, num_humans, num_infections, engine=dft.LZ4, collection_size=5000):
+    """
+    Write a synthetic serialized population file of the given version.
+
+    Args:
+        version (int): File version, 1-6.
+        filename (str): Output filename.
+        num_nodes (int): Number of nodes.
+        num_humans (int): Number of humans per node.
+        num_infections (int): Number of infections per human.
+        engine (str): Compression engine for versions 2-5.  Version 1 files are uncompressed
+            (EMOD only wrote them with SNAPPY) and version 6 files, written with DtkFileV6Writer,
+            choose the compression of each chunk by its size.
+        collection_size (int): Maximum number of humans per human collection chunk in version 6.
+    """
+    sim = make_simulation(num_nodes, num_humans, num_infections)
+
+    if version == 6:
+        with dft.DtkFileV6Writer(filename) as writer:
+            writer.write_simulation(json.dumps(sim, separators=(',', ':')))
+            for node_index in range(num_nodes):
+                node = make_node(node_index, num_humans, num_infections)
+                humans = node.pop('individualHumans')
+                writer.write_node(node['suid']['id'], json.dumps(node, separators=(',', ':')))
+                for start in range(0, len(humans), collection_size):
+                    collection = humans[start:start + collection_size]
+                    writer.write_human_collection(node['suid']['id'], len(collection),
+                                                  json.dumps({'human_collection': collection}, separators=(',', ':')))
+    else:
+        classes = {1: dft.DtkFileV1, 2: dft.DtkFileV2, 3: dft.DtkFileV3, 4: dft.DtkFileV4, 5: dft.DtkFileV5}
+        dtk_file = classes[version]()
+        dtk_file.compression = dft.NONE if version == 1 else engine
+        if version == 1:
+            sim['nodes'] = [{'suid': {'id': index + 1}, 'node': make_node(index, num_humans, num_infections)}
+                            for index in range(num_nodes)]
+            dtk_file.objects.append({'simulation': sim})
+        else:
+            dtk_file.objects.append({'simulation': sim} if version == 2 else sim)
+            for node_index in range(num_nodes):
+                node = make_node(node_index, num_humans, num_infections)
+                dtk_file.objects.append({'suid': node['suid'], 'node': node} if version == 2 else node)
+
+        dft.write(dtk_file, filename)
+
+    return
+
+
+def _iterate(dtk_file):
+    total = 0
+    for node in dtk_file.nodes:
+        for human in node['individualHumans']:
+            total += human['m_age']
+    return total
+
+
+def _random_access(dtk_file, num_lookups, num_humans, seed=0):
+    rng = random.Random(seed)
+    total = 0
+    if num_humans == 0:
+        return total
+    for _ in range(num_lookups):
+        node = dtk_file.nodes[rng.randrange(len(dtk_file.nodes))]
+        total += node['individualHumans'][rng.randrange(num_humans)]['m_age']
+    return total
+
+
+def _bulk_edit(dtk_file):
+    if dtk_file.version == 1:
+        # Version 1 nodes are only saved through the simulation
+        sim = dtk_file.simulation
+        for entry in sim.nodes:
+            for human in entry.node.individualHumans:
+                human.m_age += 1
+        dtk_file.simulation = sim
+    elif dtk_file.version < 6:
+        for index in range(len(dtk_file.nodes)):
+            node = dtk_file.nodes[index]
+            for human in node.individualHumans:
+                human.m_age += 1
+            dtk_file.nodes[index] = node
+    else:
+        # NodeListV6 stores each node (and its humans) when iteration moves on
+        for node in dtk_file.nodes:
+            for human in node.individualHumans:
+                human.m_age += 1
+    return
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(version, directory, num_nodes, num_humans, num_infections, engine=dft.LZ4, num_lookups=100):
+    """
+    Synthesize, read, iterate, edit, and rewrite one file version, returning a dictionary of measurements.
+    """
+    # dft.write() reports progress on stdout, keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        return _run_case(version, directory, num_nodes, num_humans, num_infections, engine, num_lookups)
+
+
+def _run_case(version, directory, num_nodes, num_humans, num_infections, engine, num_lookups):
+    filename = os.path.join(directory, f"benchmark-v{version}.dtk")
+    rewrite_filename = os.path.join(directory, f"benchmark-v{version}.rewrite.dtk")
+
+    result = {'version': version, 'engine': {1: dft.NONE, 6: AUTO}.get(version, engine)}
+
+    start = time.perf_counter()
+    synthesize(version, filename, num_nodes, num_humans, num_infections, engine)
+    result['synthesize_s'] = time.perf_counter() - start
+    result['file_bytes'] = os.path.getsize(filename)
+
+    start = time.perf_counter()
+    dtk_file = dft.read(filename)
+    result['open_s'] = time.perf_counter() - start
+    if version == 6:
+        # the V6 compression strings (e.g. LZ4, SNA, NON) of the chunks actually written
+        header = dtk_file.header
+        result['chunk_compressions'] = sorted(set([header.sim_compression] + header.node_compressions + header.human_compressions))
+
+    start = time.perf_counter()
+    _iterate(dtk_file)
+    result['iterate_s'] = time.perf_counter() - start
+    result['humans_per_s'] = (num_nodes * num_humans) / result['iterate_s'] if result['iterate_s'] > 0 else None
+
+    start = time.perf_counter()
+    _random_access(dtk_file, num_lookups, num_humans)
+    result['random_access_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _bulk_edit(dtk_file)
+    result['bulk_edit_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dft.write(dtk_file, rewrite_filename)
+    result['write_s'] = time.perf_counter() - start
+    result['write_mb_s'] = (os.path.getsize(rewrite_filename) / (1024 * 1024)) / result['write_s'] if result['write_s'] > 0 else None
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+
+    for name in [filename, rewrite_filename]:
+        os.remove(name)
+
+    return result
+
+
+def run(versions=VERSIONS, num_nodes=4, num_humans=1000, num_infections=1, engine=dft.LZ4, num_lookups=100,
+        isolate=True, directory=None):
+    """
+    Run the benchmark for each file version.
+
+    Args:
+        versions (list[int]): File versions to benchmark.
+        num_nodes (int): Number of nodes per file.
+        num_humans (int): Number of humans per node.
+        num_infections (int): Number of infections per human.
+        engine (str): Compression engine for versions 2-5.
+        num_lookups (int): Number of random (node, human) lookups.
+        isolate (bool): Run each version in a new process so peak RSS is measured per version.
+        directory (str): Directory for the synthesized files, defaults to a temporary directory.
+
+    Returns:
+        A dictionary with the configuration, platform, and a list of results, one per version.
+    """
+    results = {
+        'config': {'versions': list(versions), 'nodes': num_nodes, 'humans': num_humans,
+                   'infections': num_infections, 'engine': engine, 'lookups': num_lookups},
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()},
+        'results': []
+    }
+
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        for version in versions:
+            args = (version, temp_dir, num_nodes, num_humans, num_infections, engine, num_lookups)
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_case, *args).result()
+            else:
+                result = run_case(*args)
+            results['results'].append(result)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Return a list of messages for timings in results that are more than tolerance (a fraction) slower than baseline.
+    """
+    regressions = []
+    reference = {entry['version']: entry for entry in baseline['results']}
+    for entry in results['results']:
+        if entry['version'] not in reference:
+            continue
+        for timing in TIMINGS:
+            before = reference[entry['version']].get(timing)
+            after = entry.get(timing)
+            if before and after and after > before * (1.0 + tolerance):
+                regressions.append(f"V{entry['version']} {timing}: {after:.4f}s vs. {before:.4f}s baseline")
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serialized population read/write benchmarks')
+    parser.add_argument('-v', '--versions', type=int, nargs='+', default=VERSIONS, help=f'File versions {VERSIONS}')
+    parser.add_argument('-n', '--nodes', type=int, default=4, help='Number of nodes [4]')
+    parser.add_argument('-p', '--humans', type=int, default=1000, help='Number of humans per node [1000]')
+    parser.add_argument('-i', '--infections', type=int, default=1, help='Number of infections per human [1]')
+    parser.add_argument('-e', '--engine', default=dft.LZ4, help='Compression engine for V2-V5 {NONE|LZ4|SNAPPY|ZSTD} [LZ4]')
+    parser.add_argument('-l', '--lookups', type=int, default=100, help='Number of random lookups [100]')
+    parser.add_argument('-d', '--directory', default=None, help='Directory for temporary files')
+    parser.add_argument('-o', '--output', default=None, help='Write results JSON to file rather than stdout')
+    parser.add_argument('-b', '--baseline', default=None, help='Results JSON to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='Allowed slowdown vs. baseline [0.25]')
+    args = parser.parse_args()
+
+    benchmark_results = run(args.versions, args.nodes, args.humans, args.infections, args.engine.upper(), args.lookups,
+                            directory=args.directory)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(benchmark_results, handle, indent=2)
+    else:
+        print(json.dumps(benchmark_results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            found = compare(benchmark_results, json.load(handle), args.tolerance)
+        for message in found:
+            print(message, file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+import functools
 import lz4.block
 
 try:
@@ -8,6 +9,12 @@ try:
 except Exception:
     SNAPPY_SUPPORT = False
 
+try:
+    import zstandard
+    ZSTD_SUPPORT = True
+except Exception:
+    ZSTD_SUPPORT = False
+
 
 # noinspection PyCamelCase
 class Uncompressed(object):
@@ -47,6 +54,81 @@ class Snappy(object):
         raise UserWarning("Snappy [de]compression not available.")
 
 
+class Zstandard(object):
+    """
+    Zstandard compression, optionally with a dictionary trained on sample data.  EMOD cannot read
+    Zstandard compressed files, this engine is intended for archiving and transcoding.
+
+    The dictionary to compress with is passed to compress() by the caller, e.g. the file or writer being
+    compressed.  Every compressed frame records the ID of its dictionary, uncompress() looks it up in the
+    dictionaries of the file being read.  Compressors and decompressors are cached per dictionary because
+    loading a dictionary is the expensive part of using one.
+    """
+    level = 3
+
+    @classmethod
+    def compress(cls, data, dictionary=None):
+        if ZSTD_SUPPORT:
+            return _zstd_compressor(dictionary, cls.level).compress(data if type(data) is bytes else data.encode())
+        raise UserWarning("Zstandard [de]compression not available.")
+
+    @classmethod
+    def uncompress(cls, data, dictionaries=None):
+        """
+        Uncompress data, dictionaries maps dictionary ID to dictionary (bytes) for frames compressed with one.
+        """
+        if ZSTD_SUPPORT:
+            dict_id = zstandard.get_frame_parameters(data).dict_id
+            dictionaries = {} if dictionaries is None else dictionaries
+            if dict_id != 0 and dict_id not in dictionaries:
+                raise UserWarning(f"Zstandard dictionary {dict_id} is not available.")
+            # content size is recorded in the frame by ZstdCompressor.compress()
+            return _zstd_decompressor(dictionaries.get(dict_id)).decompress(data)
+        raise UserWarning("Zstandard [de]compression not available.")
+
+    @classmethod
+    def train_dictionary(cls, samples, dict_size=112640):
+        """
+        Train a dictionary from a list of samples (bytes).
+
+        Returns:
+            The dictionary as bytes, suitable for compress().
+        """
+        if not ZSTD_SUPPORT:
+            raise UserWarning("Zstandard [de]compression not available.")
+        return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+    @classmethod
+    def dictionary_id(cls, dictionary):
+        """
+        Return the ID of a trained dictionary (bytes), as recorded in the frames compressed with it.
+        """
+        if not ZSTD_SUPPORT:
+            raise UserWarning("Zstandard [de]compression not available.")
+        return zstandard.ZstdCompressionDict(dictionary).dict_id()
+
+    @classmethod
+    def dictionary_ids(cls, chunks):
+        """
+        Return the set of (non-zero) dictionary IDs used by the given compressed chunks.
+        """
+        ids = {zstandard.get_frame_parameters(chunk).dict_id for chunk in chunks if chunk}
+        ids.discard(0)
+        return ids
+
+
+@functools.lru_cache(maxsize=8)
+def _zstd_compressor(dictionary, level):
+    dict_data = None if dictionary is None else zstandard.ZstdCompressionDict(dictionary)
+    return zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+
+
+@functools.lru_cache(maxsize=8)
+def _zstd_decompressor(dictionary):
+    dict_data = None if dictionary is None else zstandard.ZstdCompressionDict(dictionary)
+    return zstandard.ZstdDecompressor(dict_data=dict_data)
+
+
 class SerialObject(dict):
     # noinspection PyDefaultArgument
     def __init__(self, dictionary={}):
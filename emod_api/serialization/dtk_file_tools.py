@@ -11,11 +11,14 @@ Support for three formats of serialized population files:
    node_chunk_sizes, human_compressions, human_node_suids, human_chunk_sizes added to header
 """
 
+import base64
 import copy
 import gc
 from collections.abc import MutableMapping
 import json
 import os
+import shutil
+import tempfile
 import time
 import emod_api.serialization.dtk_file_support as support
 
@@ -30,14 +33,16 @@ MAX_VERSION = 6
 NONE = 'NONE'
 LZ4 = 'LZ4'
 SNAPPY = 'SNAPPY'
+ZSTD = 'ZSTD'
 
-__engines__ = {LZ4: support.EllZeeFour, SNAPPY: support.Snappy, NONE: support.Uncompressed}
+__engines__ = {LZ4: support.EllZeeFour, SNAPPY: support.Snappy, ZSTD: support.Zstandard, NONE: support.Uncompressed}
 
 # V6 compression strings are fixed to always be three characters so that
 # the header size is predictable regardless of compression type used.
 V6_COMPRESSION_STR_NONE = "NON"
 V6_COMPRESSION_STR_LZ4 = "LZ4"
 V6_COMPRESSION_STR_SNAPPY = "SNA"
+V6_COMPRESSION_STR_ZSTD = "ZST"     # not readable by EMOD, for archived files only
 
 
 def _determine_v6_compression_type(data):
@@ -56,6 +61,8 @@ def _compression_type_v6_to_old(compression_str):
         return LZ4
     elif compression_str == V6_COMPRESSION_STR_SNAPPY:
         return SNAPPY
+    elif compression_str == V6_COMPRESSION_STR_ZSTD:
+        return ZSTD
     else:
         raise RuntimeError(f"Unknown/unsupported compression scheme '{compression_str}'")
 
@@ -67,19 +74,32 @@ def _compression_type_old_to_v6(compression_str):
         return V6_COMPRESSION_STR_LZ4
     elif compression_str == SNAPPY:
         return V6_COMPRESSION_STR_SNAPPY
+    elif compression_str == ZSTD:
+        return V6_COMPRESSION_STR_ZSTD
     else:
         raise RuntimeError(f"Unknown/unsupported compression scheme '{compression_str}'")
 
 
-def uncompress(data, engine):
-    if engine in __engines__:
+def uncompress(data, engine, dictionaries=None):
+    """
+    Uncompress data with the given engine.  The (Zstandard) dictionaries, dictionary ID to bytes,
+    are only used by the ZSTD engine.
+    """
+    if engine == ZSTD:
+        return support.Zstandard.uncompress(data, dictionaries)
+    elif engine in __engines__:
         return __engines__[engine].uncompress(data)
     else:
         raise RuntimeError(f"Unknown/unsupported compression scheme '{engine}'")
 
 
-def compress(data, engine):
-    if engine in __engines__:
+def compress(data, engine, dictionary=None):
+    """
+    Compress data with the given engine.  The (Zstandard) dictionary is only used by the ZSTD engine.
+    """
+    if engine == ZSTD:
+        return support.Zstandard.compress(data, dictionary)
+    elif engine in __engines__:
         return __engines__[engine].compress(data)
     else:
         raise RuntimeError(f"Unknown/unsupported compression scheme '{engine}'")
@@ -133,16 +153,16 @@ class DtkFile(object):
                 index += 1
 
         def __getitem__(self, index):
-            data = str(uncompress(self.__parent__.chunks[index], self.__parent__.compression), 'utf-8')
+            data = str(uncompress(self.__parent__.chunks[index], self.__parent__.compression, self.__parent__.zstd_dictionaries), 'utf-8')
             return data
 
         def __setitem__(self, index, value):
-            data = compress(value.encode(), self.__parent__.compression)
+            data = compress(value.encode(), self.__parent__.compression, self.__parent__.zstd_dictionary)
             self.__parent__.chunks[index] = data
             return
 
         def append(self, item):
-            data = compress(item, self.__parent__.compression)
+            data = compress(item, self.__parent__.compression, self.__parent__.zstd_dictionary)
             self.__parent__.chunks.append(data)
 
         def __len__(self):
@@ -187,6 +207,8 @@ class DtkFile(object):
         self._chunks = [None for index in range(header.chunkcount)]
         self.contents = self.Contents(self)
         self.objects = self.Objects(self)
+        self._zstd_dictionaries = _read_zstd_dictionaries(header)
+        self._zstd_dictionary = None
         return
 
     @property
@@ -207,6 +229,27 @@ class DtkFile(object):
     def compression(self, engine):
         self.__set_compression__(engine.upper())
 
+    @property
+    def zstd_dictionary(self):
+        """
+        Return the trained dictionary (bytes) used when compressing with ZSTD, or None.
+        """
+        return self._zstd_dictionary
+
+    @zstd_dictionary.setter
+    def zstd_dictionary(self, dictionary):
+        self._zstd_dictionary = dictionary
+        if dictionary is not None:
+            self._zstd_dictionaries[support.Zstandard.dictionary_id(dictionary)] = dictionary
+        return
+
+    @property
+    def zstd_dictionaries(self):
+        """
+        Return the dictionaries (dictionary ID to bytes) of this file for uncompressing ZSTD chunks.
+        """
+        return self._zstd_dictionaries
+
     @property
     def byte_count(self):
         total = sum(self.chunk_sizes)
@@ -273,7 +316,7 @@ class DtkFile(object):
     def __set_compression__(self, engine):
         if engine != self.compression:
             for index in range(self.chunk_count):
-                chunk = compress(self.contents[index], engine)
+                chunk = compress(self.contents[index], engine, self.zstd_dictionary)
                 self._chunks[index] = chunk
             self.__header__.engine = engine
             self.__header__['compressed'] = (engine != NONE)
@@ -568,6 +611,7 @@ class DtkFileV6(object):
             node_suid (int): The SUID of the node the chunk belongs to.
             chunk_size (int): The size of the chunk in bytes.
             chunk (bytes): The compressed chunk data.
+            dictionaries (dict): Zstandard dictionaries (dictionary ID to bytes) of the file.
         """
         def __init__(self,
                      filename,
@@ -575,7 +619,8 @@ class DtkFileV6(object):
                      v6_compression_str,
                      node_suid,
                      chunk_size,
-                     chunk):
+                     chunk,
+                     dictionaries=None):
             if chunk is None and chunk_size != 0:
                 msg = f"Chunk is None but chunk size is {chunk_size} for {obj_type_str} chunk of file '{filename}'"
                 raise UserWarning(msg)
@@ -588,6 +633,9 @@ class DtkFileV6(object):
             self._chunk_size = chunk_size
             self._chunk = chunk
             self._json = None
+            self._preferred_compression = None
+            self._dictionary = None
+            self._dictionaries = {} if dictionaries is None else dictionaries
             return
 
         def get_json(self):
@@ -596,7 +644,7 @@ class DtkFileV6(object):
             """
             if self._json is None:
                 old_compression_type = _compression_type_v6_to_old(self._v6_compression_str)
-                uncomp_data = str(uncompress(self._chunk, old_compression_type), 'utf-8')
+                uncomp_data = str(uncompress(self._chunk, old_compression_type, self._dictionaries), 'utf-8')
                 try:
                     json_data = json.loads(uncomp_data, object_hook=support.SerialObject)
                 except Exception:
@@ -622,14 +670,45 @@ class DtkFileV6(object):
             """
             if self._chunk is None:
                 json_data = json.dumps(self._json, separators=(',', ':'))
-                self._v6_compression_str = _determine_v6_compression_type(json_data)
+                if self._preferred_compression is not None:
+                    self._v6_compression_str = self._preferred_compression
+                else:
+                    self._v6_compression_str = _determine_v6_compression_type(json_data)
                 old_compression_type = _compression_type_v6_to_old(self._v6_compression_str)
-                self._chunk = compress(json_data.encode(), old_compression_type)
+                self._chunk = compress(json_data.encode(), old_compression_type, self._dictionary)
                 self._chunk_size = len(self._chunk)
                 self._json = None
                 gc.collect()
             return
 
+        def recompress(self, v6_compression_str, dictionary=None):
+            """
+            Use the given V6 compression string, and Zstandard dictionary (bytes) if compressing with ZSTD,
+            for this chunk from now on, recompressing the stored chunk if necessary.  None restores choosing
+            the compression by size.
+            """
+            changed = (v6_compression_str != self._v6_compression_str) or (dictionary != self._dictionary)
+            self._preferred_compression = v6_compression_str
+            self._dictionary = dictionary
+            if (v6_compression_str is not None) and (self._chunk is not None) and changed:
+                data = uncompress(self._chunk, _compression_type_v6_to_old(self._v6_compression_str), self._dictionaries)
+                self._v6_compression_str = v6_compression_str
+                self._chunk = compress(data, _compression_type_v6_to_old(v6_compression_str), dictionary)
+                self._chunk_size = len(self._chunk)
+            return
+
+        def compressed(self):
+            """
+            Return the compressed chunk data and its compression engine (NONE, LZ4, SNAPPY, ZSTD)
+            without changing the chunk.  If the JSON has been loaded it is compressed again.
+            """
+            if self._chunk is not None:
+                return self._chunk, _compression_type_v6_to_old(self._v6_compression_str)
+            json_data = json.dumps(self._json, separators=(',', ':'))
+            v6_compression_str = self._preferred_compression or _determine_v6_compression_type(json_data)
+            engine = _compression_type_v6_to_old(v6_compression_str)
+            return compress(json_data.encode(), engine, self._dictionary), engine
+
         @property
         def v6_compression_str(self):
             """
@@ -670,6 +749,7 @@ class DtkFileV6(object):
             num_humans (int): The number of humans in the collection.
             chunk_size (int): The size of the chunk in bytes.
             chunk (bytes): The compressed chunk data.
+            dictionaries (dict): Zstandard dictionaries (dictionary ID to bytes) of the file.
         """
         def __init__(self,
                      filename,
@@ -678,13 +758,15 @@ class DtkFileV6(object):
                      node_suid,
                      num_humans,
                      chunk_size,
-                     chunk):
+                     chunk,
+                     dictionaries=None):
             super(DtkFileV6.HumanCollectionChunkV6, self).__init__(filename,
                                                                    obj_type_str,
                                                                    v6_compression_str,
                                                                    node_suid,
                                                                    chunk_size,
-                                                                   chunk)
+                                                                   chunk,
+                                                                   dictionaries)
             self._num_humans = num_humans
             return
 
@@ -733,6 +815,9 @@ class DtkFileV6(object):
             human_chunk_list (list of DtkFileV6.HumanCollectionChunkV6):
                 The list of chunks containing the human data for the node.
         """
+        # member variables, which share __dict__ with the node JSON once it is loaded
+        _MEMBERS = ['__parent__', '_node_chunk', '_human_list', '_json']
+
         def __init__(self, parent, node_chunk, human_chunk_list):
             super(DtkFileV6.NodeV6, self).__init__()
             self.__parent__ = parent
@@ -809,6 +894,13 @@ class DtkFileV6(object):
                 gc.collect()
             return
 
+        def to_dict(self):
+            """
+            Return the node JSON dictionary without the humans, e.g. to write the node to another file.
+            """
+            self.load()
+            return {key: value for key, value in self._json.items() if key not in DtkFileV6.NodeV6._MEMBERS}
+
         def store(self):
             """
             Store the node JSON dictionary back to the chunk if it is loaded.
@@ -826,8 +918,7 @@ class DtkFileV6(object):
                 tmp_json = self._json
 
                 # remove member variables from json
-                keys_to_remove = ['__parent__', '_node_chunk', '_human_list', '_json']
-                for key in keys_to_remove:
+                for key in DtkFileV6.NodeV6._MEMBERS:
                     del tmp_json[key]
 
                 # compress json
@@ -868,7 +959,10 @@ class DtkFileV6(object):
                 node_suid=self._node_chunk.node_suid,
                 num_humans=0,
                 chunk_size=0,
-                chunk=None)
+                chunk=None,
+                dictionaries=self._node_chunk._dictionaries)
+            human_chunk._preferred_compression = self._node_chunk._preferred_compression
+            human_chunk._dictionary = self._node_chunk._dictionary
             human_chunk.set_json(json_dict_list)
             self.__parent__._human_chunks.append(human_chunk)
             self._human_list._add_human_chunk(human_chunk)
@@ -1045,6 +1139,8 @@ class DtkFileV6(object):
         self._node_chunks = []
         self._human_chunks = []
         self._nodes = DtkFileV6.NodeListV6(self)
+        self._zstd_dictionaries = _read_zstd_dictionaries(header)
+        self._zstd_dictionary = None
 
         if handle is not None:
             sim_chunk_size = int(header.sim_chunk_size, 16)
@@ -1054,7 +1150,8 @@ class DtkFileV6(object):
                                               header.sim_compression,
                                               -1,
                                               sim_chunk_size,
-                                              sim_chunk_data)
+                                              sim_chunk_data,
+                                              self._zstd_dictionaries)
 
             for index, size_string in enumerate(header.node_chunk_sizes):
                 v6_compression_str = header.node_compressions[index]
@@ -1066,7 +1163,8 @@ class DtkFileV6(object):
                                              v6_compression_str,
                                              node_suid,
                                              chunk_size,
-                                             chunk_data)
+                                             chunk_data,
+                                             self._zstd_dictionaries)
                 self._node_chunks.append(node_chunk)
 
             for index, size_string in enumerate(header.human_chunk_sizes):
@@ -1083,7 +1181,8 @@ class DtkFileV6(object):
                                                                node_suid,
                                                                num_humans,
                                                                chunk_size,
-                                                               chunk_data)
+                                                               chunk_data,
+                                                               self._zstd_dictionaries)
                 self._human_chunks.append(human_chunk)
 
             for node_chunk in self._node_chunks:
@@ -1141,6 +1240,51 @@ class DtkFileV6(object):
     def version(self):
         return self.__header__.version
 
+    @property
+    def zstd_dictionary(self):
+        """
+        Return the trained dictionary (bytes) used when compressing with ZSTD, or None.
+        """
+        return self._zstd_dictionary
+
+    @zstd_dictionary.setter
+    def zstd_dictionary(self, dictionary):
+        self._zstd_dictionary = dictionary
+        if dictionary is not None:
+            self._zstd_dictionaries[support.Zstandard.dictionary_id(dictionary)] = dictionary
+        return
+
+    @property
+    def zstd_dictionaries(self):
+        """
+        Return the dictionaries (dictionary ID to bytes) of this file for uncompressing ZSTD chunks.
+        """
+        return self._zstd_dictionaries
+
+    @property
+    def compression(self):
+        """
+        Return the compression engine (NONE, LZ4, SNAPPY, ZSTD) used for all chunks,
+        or None if the compression of each chunk is chosen by its size.
+        """
+        if self._sim_chunk is None or self._sim_chunk._preferred_compression is None:
+            return None
+        return _compression_type_v6_to_old(self._sim_chunk._preferred_compression)
+
+    @compression.setter
+    def compression(self, engine):
+        """
+        Use the given compression engine for all chunks, e.g. ZSTD when archiving a file.
+        ZSTD compresses with zstd_dictionary if it is set.
+        None restores choosing the compression of each chunk by its size.
+        """
+        v6_compression_str = None if engine is None else _compression_type_old_to_v6(engine.upper())
+        dictionary = self.zstd_dictionary if v6_compression_str == V6_COMPRESSION_STR_ZSTD else None
+        for chunk in [self._sim_chunk] + self._node_chunks + self._human_chunks:
+            if chunk is not None:
+                chunk.recompress(v6_compression_str, dictionary)
+        return
+
     @property
     def nodes(self):
         """
@@ -1266,6 +1410,13 @@ def __read_header__(handle):
     return header
 
 
+def _read_zstd_dictionaries(header):
+    """
+    Return the Zstandard dictionaries (dictionary ID to bytes) stored in a header.
+    """
+    return {int(dict_id): base64.b64decode(encoded) for dict_id, encoded in header.get('zstd_dictionaries', {}).items()}
+
+
 def __check_header_size__(header_size):
     if header_size <= 0:
         raise UserWarning(f"Invalid header size: {header_size}")
@@ -1333,6 +1484,7 @@ def __check_chunk_sizes_v6__(header):
 def write(dtk_file, filename):
 
     dtk_file._sync_header()
+    __embed_zstd_dictionaries__(dtk_file)
 
     with open(filename, 'wb') as handle:
         __write_magic_number__(handle)
@@ -1356,6 +1508,191 @@ def write(dtk_file, filename):
     return
 
 
+class DtkFileV6Writer(object):
+    """
+    Write a V6 file one chunk at a time without holding the population in memory.
+    Chunks are compressed as they are added and spooled to temporary files, when the
+    writer is closed the header is written followed by the spooled chunks.
+
+    With the LZ4 engine each chunk falls back to SNAPPY or NONE by size, as EMOD does.
+
+    Args:
+        filename (str): The file to write.
+        header (DtkHeaderV6): Header with author, tool, emod_info, etc. Chunk entries are filled in.
+        engine (str): NONE, LZ4, SNAPPY, or ZSTD.
+        dictionary (bytes): Trained Zstandard dictionary used with the ZSTD engine, e.g. from train_zstd_dictionary().
+
+    Examples:
+        Write a file from JSON text::
+
+            with dft.DtkFileV6Writer('state.dtk') as writer:
+                writer.write_simulation(sim_json)
+                writer.write_node(1, node_json)
+                writer.write_human_collection(1, 1000, '{"human_collection":[...]}')
+    """
+    def __init__(self, filename, header=None, engine=LZ4, dictionary=None):
+        self._filename = filename
+        self._header = header if header is not None else DtkHeaderV6()
+        self._engine = engine.upper()
+        self._dictionary = dictionary
+        self._sim_chunk = None
+        self._dict_ids = set()
+        self._node_spool = tempfile.TemporaryFile()
+        self._human_spool = tempfile.TemporaryFile()
+        for key in ['node_suids', 'node_compressions', 'node_chunk_sizes', 'human_compressions',
+                    'human_node_suids', 'human_num_humans', 'human_chunk_sizes']:
+            self._header[key] = []
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+        return False
+
+    @property
+    def header(self):
+        return self._header
+
+    def _compress(self, data):
+        data = data if type(data) is bytes else data.encode()
+        if self._engine == LZ4:
+            v6_compression_str = _determine_v6_compression_type(data)
+        else:
+            v6_compression_str = _compression_type_old_to_v6(self._engine)
+        chunk = compress(data, _compression_type_v6_to_old(v6_compression_str), self._dictionary)
+        if (v6_compression_str == V6_COMPRESSION_STR_ZSTD) and (self._dictionary is not None):
+            self._dict_ids.update(support.Zstandard.dictionary_ids([chunk]))
+        return v6_compression_str, chunk
+
+    def write_simulation(self, data):
+        """
+        Set the simulation JSON text (the simulation is written first when the writer is closed).
+        """
+        self._sim_chunk = self._compress(data)
+        return
+
+    def write_node(self, node_suid, data):
+        """
+        Add the JSON text of a node (without its humans).
+        """
+        v6_compression_str, chunk = self._compress(data)
+        self._node_spool.write(chunk)
+        self._header['node_suids'].append(format(node_suid, '016x'))
+        self._header['node_compressions'].append(v6_compression_str)
+        self._header['node_chunk_sizes'].append(format(len(chunk), '016x'))
+        return
+
+    def write_human_collection(self, node_suid, num_humans, data):
+        """
+        Add the JSON text of a human collection, {"human_collection":[...]}, for the given node.
+        """
+        v6_compression_str, chunk = self._compress(data)
+        self._human_spool.write(chunk)
+        self._header['human_node_suids'].append(format(node_suid, '016x'))
+        self._header['human_num_humans'].append(format(num_humans, '016x'))
+        self._header['human_compressions'].append(v6_compression_str)
+        self._header['human_chunk_sizes'].append(format(len(chunk), '016x'))
+        return
+
+    def close(self):
+        """
+        Write the header and all chunks to the file.
+        """
+        if self._sim_chunk is None:
+            self._discard()
+            raise UserWarning(f"No simulation was written to '{self._filename}'")
+
+        v6_compression_str, chunk = self._sim_chunk
+        self._header['date'] = time.strftime('%a %b %d %H:%M:%S %Y')
+        self._header['sim_compression'] = v6_compression_str
+        self._header['sim_chunk_size'] = format(len(chunk), '016x')
+        __set_zstd_dictionaries__(self._header, {dict_id: self._dictionary for dict_id in self._dict_ids})
+
+        print(f"Writing file: {self._filename}")
+        with open(self._filename, 'wb') as handle:
+            header = json.dumps(self._header, separators=(',', ':'))
+            __write_magic_number__(handle)
+            __write_header_size__(len(header), handle)
+            __write_header__(header, handle)
+            handle.write(chunk)
+            for spool in (self._node_spool, self._human_spool):
+                spool.seek(0)
+                shutil.copyfileobj(spool, handle)
+
+        self._discard()
+        return
+
+    def _discard(self):
+        self._node_spool.close()
+        self._human_spool.close()
+        return
+
+
+def __embed_zstd_dictionaries__(dtk_file):
+    """
+    Zstandard compressed chunks cannot be decompressed without the dictionary used to compress them,
+    so store the dictionaries in the header.
+    """
+    if dtk_file.version <= 5:
+        chunks = dtk_file.chunks if dtk_file.compression == ZSTD else []
+    else:
+        all_chunks = [dtk_file._sim_chunk] + dtk_file._node_chunks + dtk_file._human_chunks
+        chunks = [chunk.chunk for chunk in all_chunks if chunk.v6_compression_str == V6_COMPRESSION_STR_ZSTD]
+
+    dict_ids = support.Zstandard.dictionary_ids(chunks) if chunks else set()
+    __set_zstd_dictionaries__(dtk_file.header, {dict_id: dtk_file.zstd_dictionaries[dict_id] for dict_id in dict_ids})
+    return
+
+
+def __set_zstd_dictionaries__(header, dictionaries):
+    if dictionaries:
+        header['zstd_dictionaries'] = {
+            str(dict_id): base64.b64encode(dictionaries[dict_id]).decode()
+            for dict_id in sorted(dictionaries)}
+    elif 'zstd_dictionaries' in header:
+        del header['zstd_dictionaries']
+    return
+
+
+def train_zstd_dictionary(dtk_file, dict_size=112640, max_samples=10000):
+    """
+    Train a Zstandard dictionary from the humans in a serialized population file for ZSTD compression,
+    e.g. as the zstd_dictionary of a file or the dictionary of a DtkFileV6Writer.  Human JSON is very
+    repetitive, so a trained dictionary typically compresses human collections several times better than LZ4.
+
+    Args:
+        dtk_file: A file returned by read().
+        dict_size (int): Maximum size of the dictionary in bytes.
+        max_samples (int): Maximum number of humans used as samples.
+
+    Returns:
+        The dictionary as bytes.
+
+    Examples:
+        Archive a checkpoint with a trained dictionary::
+
+            dtk_file = dft.read('state-00365.dtk')
+            dtk_file.zstd_dictionary = dft.train_zstd_dictionary(dtk_file)
+            dtk_file.compression = dft.ZSTD
+            dft.write(dtk_file, 'state-00365.archive.dtk')
+    """
+    samples = []
+    for node in dtk_file.nodes:
+        for human in node['individualHumans']:
+            samples.append(json.dumps(human, separators=(',', ':')).encode())
+            if len(samples) >= max_samples:
+                break
+        if len(samples) >= max_samples:
+            break
+
+    return support.Zstandard.train_dictionary(samples, dict_size)
+
+
 def __write_magic_number__(handle):
     handle.write('IDTK'.encode())
     return
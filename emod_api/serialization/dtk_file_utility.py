@@ -1,12 +1,25 @@
 #!/usr/bin/python
 
 import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import emod_api.serialization.dtk_file_tools as dft
 import json
 import os
 import sys
 
 
+RAW = 'raw'
+UNFORMATTED = 'unformatted'
+FORMATTED = 'formatted'
+NDJSON = 'ndjson'
+
+INDIVIDUAL_HUMANS = 'individualHumans'
+HUMAN_COLLECTION = 'human_collection'
+
+_zstd_dictionaries = {}     # of the file being read, see _set_zstd_dictionaries()
+
+
 def __do_read__(args):
 
     if args.output is not None:
@@ -16,8 +29,16 @@ def __do_read__(args):
         prefix = root
 
     if args.raw:
+        mode = RAW
         extension = 'bin'
+    elif args.unformatted:
+        mode = UNFORMATTED
+        extension = 'json'
+    elif args.ndjson:
+        mode = NDJSON
+        extension = 'ndjson'
     else:
+        mode = FORMATTED
         extension = 'json'
 
     dtk_file = dft.read(args.filename)
@@ -28,38 +49,165 @@ def __do_read__(args):
 
     print(f'File header: {dtk_file.header}')
 
-    for index in range(len(dtk_file.chunks)):
-        if args.raw:
-            # Write raw chunks to disk
-            output = dtk_file.chunks[index]
-        else:
-            if args.unformatted:
-                # Expand compressed contents, but don't serialize and format
-                output = dtk_file.contents[index]
-            else:
-                # Expand compressed contents, serialize, write out formatted
-                obj = dtk_file.objects[index]
-                print(f'Formatting chunk {index + 1} of {len(dtk_file.chunks)}... ', end='')
-                output = json.dumps(obj, indent=2, separators=(',', ':'))
+    if dtk_file.version < 6:
+        count = len(dtk_file.chunks)
+        tasks = _chunk_tasks(dtk_file, prefix, extension, mode)
+    else:
+        count = 1 + len(dtk_file._node_chunks) + len(dtk_file._human_chunks)
+        tasks = _chunk_tasks_v6(dtk_file, prefix, extension, mode)
+
+    jobs = max(1, args.jobs)
+    if jobs == 1:
+        _set_zstd_dictionaries(dtk_file.zstd_dictionaries)
+        for index, task in enumerate(tasks):
+            print(f"Writing chunk {index + 1} of {count} to '{task[2]}'")
+            _dump_chunk(*task)
+    else:
+        # Chunks are handed to the workers still compressed, each worker decompresses, parses, and writes its own file.
+        # The Zstandard dictionaries of the file are sent to each worker once rather than with every chunk.
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_set_zstd_dictionaries,
+                                 initargs=(dtk_file.zstd_dictionaries,)) as executor:
+            futures = [executor.submit(_dump_chunk, *task) for task in tasks]
+            for future in as_completed(futures):
+                print(f"Wrote file '{future.result()}'")
+
+    return
+
 
+def _chunk_tasks(dtk_file, prefix, extension, mode):
+    """
+    Yield the (chunk, compression, output filename, mode) tuples for a V1-V5 file.
+    """
+    for index in range(len(dtk_file.chunks)):
         if index == 0:
             output_filename = '.'.join([prefix, 'simulation', extension])
         else:
             output_filename = '.'.join([prefix, f'node-{index:0>5}', extension])
+        yield dtk_file.chunks[index], dtk_file.compression, output_filename, mode
+
+    return
+
+
+def _chunk_tasks_v6(dtk_file, prefix, extension, mode):
+    """
+    Yield the (chunk, compression, output filename, mode) tuples for a V6 file.
+    Each node is written to its own file and each of its human collections is written
+    to a file named after the node, e.g. state.node-00001.humans-00001.json.
+    """
+    human_chunks = defaultdict(list)
+    for human_chunk in dtk_file._human_chunks:
+        human_chunks[human_chunk.node_suid].append(human_chunk)
+
+    yield *dtk_file._sim_chunk.compressed(), '.'.join([prefix, 'simulation', extension]), mode
+
+    for index, node_chunk in enumerate(dtk_file._node_chunks, start=1):
+        node_prefix = '.'.join([prefix, f'node-{index:0>5}'])
+        yield *node_chunk.compressed(), '.'.join([node_prefix, extension]), mode
+        for human_index, human_chunk in enumerate(human_chunks[node_chunk.node_suid], start=1):
+            # Opening the file parses the first human collection of each node, compressed() compresses a copy.
+            yield *human_chunk.compressed(), '.'.join([node_prefix, f'humans-{human_index:0>5}', extension]), mode
+
+    return
+
+
+def _set_zstd_dictionaries(dictionaries):
+    """
+    Set the Zstandard dictionaries (dictionary ID to bytes) _dump_chunk() uses in this process.
+    """
+    global _zstd_dictionaries
+    _zstd_dictionaries = dictionaries
+    return
+
 
-        print(f"Writing file '{output_filename}'")
-        if args.raw:
-            with open(output_filename, 'wb') as handle:
-                handle.write(output)
+def _dump_chunk(chunk, compression, output_filename, mode):
+    """
+    Write one chunk of a serialized population file to disk.
+
+    Args:
+        chunk (bytes): Raw (possibly compressed) chunk data.
+        compression (str): Compression engine of the chunk - NONE, LZ4, SNAPPY, or ZSTD.
+        output_filename (str): Destination file.
+        mode (str): One of RAW, UNFORMATTED, FORMATTED, or NDJSON.
+
+    Returns:
+        The name of the file written.
+    """
+    if mode == RAW:
+        with open(output_filename, 'wb') as handle:
+            handle.write(chunk)
+        return output_filename
+
+    contents = str(dft.uncompress(chunk, compression, _zstd_dictionaries), 'utf-8')
+
+    with open(output_filename, 'wt', encoding='utf-8') as handle:
+        if mode == UNFORMATTED:
+            # Expand compressed contents, but don't serialize and format
+            handle.write(contents)
+        elif mode == NDJSON:
+            _write_ndjson(json.loads(contents), handle)
         else:
-            with open(output_filename, 'wt', encoding='utf-8') as handle:
-                handle.write(output)
+            # json.dump() streams the formatted text to disk rather than building one large string in memory
+            json.dump(json.loads(contents), handle, indent=2, separators=(',', ':'))
+
+    return output_filename
+
+
+def _write_ndjson(obj, handle):
+    """
+    Write a chunk object as newline delimited JSON. The first line is the object with an empty
+    list of humans (individualHumans or human_collection), followed by one line per human.
+    Chunks without humans are written as a single line.
+    """
+    container, key = _human_container(obj)
+    humans = container.get(key, [])
+    if humans:
+        container[key] = []
+
+    handle.write(json.dumps(obj, separators=(',', ':')))
+    handle.write('\n')
+    for human in humans:
+        handle.write(json.dumps(human, separators=(',', ':')))
+        handle.write('\n')
 
     return
 
 
+def _human_container(obj):
+    """
+    Return the dictionary holding the list of humans in a chunk object and the key of that list.
+    """
+    # V6 human chunks look like this {'human_collection':[...]}
+    if HUMAN_COLLECTION in obj:
+        return obj, HUMAN_COLLECTION
+    # Version 2 node chunks look like this {'suid':{'id':id},'node':{...}}
+    node = obj['node'] if isinstance(obj.get('node'), dict) else obj
+    return node, INDIVIDUAL_HUMANS
+
+
+def _read_part(filename):
+    """
+    Return the compact JSON text (bytes) of a file written by the read command.
+    NDJSON files are reassembled into a single object.
+    """
+    if not filename.endswith('.ndjson'):
+        with open(filename, 'rb') as handle:
+            return handle.read()
+
+    with open(filename, 'rt', encoding='utf-8') as handle:
+        obj = json.loads(handle.readline())
+        humans = [json.loads(line) for line in handle if line.strip()]
+    container, key = _human_container(obj)
+    if key in container:
+        container[key] = humans
+
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
 def __do_write__(args):
 
+    if args.v6 and args.verify:
+        raise ValueError("--verify is not supported with --v6")
+
     print(f"Writing file '{args.filename}'", file=sys.stderr)
     print(f"Reading simulation data from '{args.simulation}'", file=sys.stderr)
     print(f"Reading node data from {args.nodes}", file=sys.stderr)
@@ -69,9 +217,22 @@ def __do_write__(args):
     print(f"{'Verifying' if args.verify else 'Not verifying'} contents", file=sys.stderr)
     print(f"Using compression engine '{args.engine}'", file=sys.stderr)
 
+    dictionary = None
+    if args.dictionary is not None:
+        print(f"Using Zstandard dictionary '{args.dictionary}'", file=sys.stderr)
+        with open(args.dictionary, 'rb') as handle:
+            dictionary = handle.read()
+
+    if args.v6:
+        print(f"Reading human data from {args.humans}", file=sys.stderr)
+        _write_v6(args.filename, args.simulation, args.nodes, args.humans, args.author, args.tool,
+                  args.compress, args.engine, dictionary)
+        return
+
     dtk_file = dft.DtkFileV3()
     dtk_file.author = args.author
     dtk_file.tool = args.tool
+    dtk_file.zstd_dictionary = dictionary
     dtk_file.compression = args.engine
 
     _prepare_simulation_data(args.simulation, dtk_file)
@@ -84,10 +245,9 @@ def __do_write__(args):
 
 def _prepare_simulation_data(filename, dtk_file):
 
-    with open(filename, 'rb') as handle:
-        data = handle.read()
-        # Do not use dtk_file.simulation property because this is text rather than a Python object
-        dtk_file.contents.append(data)
+    data = _read_part(filename)
+    # Do not use dtk_file.simulation property because this is text rather than a Python object
+    dtk_file.contents.append(data)
 
     return
 
@@ -96,10 +256,45 @@ def _prepare_simulation_data(filename, dtk_file):
 def _prepare_node_data(filenames, dtk_file):
 
     for filename in filenames:
-        with open(filename, 'rb') as handle:
-            data = handle.read()
-            # Do not use dtk_file.nodes here because this is text rather than a Python object
-            dtk_file.contents.append(data)
+        data = _read_part(filename)
+        # Do not use dtk_file.nodes here because this is text rather than a Python object
+        dtk_file.contents.append(data)
+
+    return
+
+
+def _write_v6(filename, simulation, nodes, humans, author, tool, compressed=True, engine=dft.LZ4, dictionary=None):
+    """
+    Assemble a V6 serialized population file from the simulation, node, and human collection
+    files written by the read command.  Human collection files are assigned to the node file
+    whose name they extend, e.g. state.node-00001.humans-00001.json belongs to state.node-00001.json,
+    a human collection file which belongs to no node file raises ValueError.  Only one part is held in memory at a time.
+    """
+    node_humans = {}
+    for node_filename in nodes:
+        node_root, _ = os.path.splitext(node_filename)
+        node_humans[node_filename] = [name for name in humans if name.startswith(node_root + '.')]
+    assigned = set(name for names in node_humans.values() for name in names)
+    unassigned = [name for name in humans if name not in assigned]
+    if unassigned:
+        raise ValueError(f"Human collection file(s) {unassigned} do not belong to any node file in {nodes}")
+
+    header = dft.DtkHeaderV6()
+    header['author'] = str(author)
+    header['tool'] = str(tool)
+
+    with dft.DtkFileV6Writer(filename, header, engine if compressed else dft.NONE, dictionary) as writer:
+
+        writer.write_simulation(_read_part(simulation))
+
+        for node_filename in nodes:
+            data = _read_part(node_filename)
+            node_suid = json.loads(data)['suid']['id']
+            writer.write_node(node_suid, data)
+
+            for human_filename in node_humans[node_filename]:
+                data = _read_part(human_filename)
+                writer.write_human_collection(node_suid, len(json.loads(data)[HUMAN_COLLECTION]), data)
 
     return
 
@@ -112,11 +307,16 @@ if __name__ == '__main__':
     read_parser = subparsers.add_parser('read', help='read help')
     read_parser.add_argument('filename')
     read_parser.add_argument('--header', default=None, help='Write header to file', metavar='<filename>')
-    read_parser.add_argument('-r', '--raw', default=False, action='store_true',
-                             help='Write raw contents of chunks to disk')
+    output_format = read_parser.add_mutually_exclusive_group()
+    output_format.add_argument('-r', '--raw', default=False, action='store_true',
+                               help='Write raw contents of chunks to disk')
     # noinspection SpellCheckingInspection
-    read_parser.add_argument('-u', '--unformatted', default=False, action='store_true',
-                             help='Write unformatted (compact) JSON to disk')
+    output_format.add_argument('-u', '--unformatted', default=False, action='store_true',
+                               help='Write unformatted (compact) JSON to disk')
+    output_format.add_argument('-n', '--ndjson', default=False, action='store_true',
+                               help='Write newline delimited JSON to disk, one human per line')
+    read_parser.add_argument('-j', '--jobs', default=1, type=int,
+                             help='Number of worker processes used to decode and write chunks [1]')
     read_parser.add_argument('-o', '--output', default=None,
                              help='Output filename prefix, defaults to input filename with .json extension')
     read_parser.set_defaults(func=__do_read__)
@@ -128,13 +328,19 @@ if __name__ == '__main__':
     write_parser.add_argument('filename', help='Output .dtk filename')
     write_parser.add_argument('simulation', help='Filename for simulation JSON')
     write_parser.add_argument('nodes', nargs='+', help='Filename(s) for node JSON')
+    write_parser.add_argument('--v6', default=False, action='store_true',
+                              help='Write a V6 file with separate human collection chunks')
+    write_parser.add_argument('--humans', nargs='*', default=[],
+                              help='Filename(s) for V6 human collection JSON, e.g. <prefix>.node-00001.humans-00001.json')
     write_parser.add_argument('-a', '--author', default=username, help=f'Author name for header [{username}]')
     write_parser.add_argument('-t', '--tool', default=tool_name, help=f'Tool name for header [{tool_name}]')
     write_parser.add_argument('-u', '--uncompressed', default=True, action='store_false', dest='compress',
                               help='Do not compress contents of new .dtk file')
     write_parser.add_argument('-v', '--verify', default=False, action='store_true',
                               help='Verify JSON in simulation and nodes (could be slow).')
-    write_parser.add_argument('-e', '--engine', default='LZ4', help='Compression engine {NONE|LZ4|SNAPPY} [LZ4]')
+    write_parser.add_argument('-e', '--engine', default='LZ4', help='Compression engine {NONE|LZ4|SNAPPY|ZSTD} [LZ4]')
+    write_parser.add_argument('-d', '--dictionary', default=None, metavar='<filename>',
+                              help='Trained Zstandard dictionary used with the ZSTD engine')
     write_parser.set_defaults(func=__do_write__)
 
     commandline_args = parser.parse_args()
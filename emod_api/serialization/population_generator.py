@@ -0,0 +1,210 @@
+"""Generate large synthetic populations and write them directly to V6 serialized population files."""
+import copy
+import json
+
+import emod_api.serialization.dtk_file_tools as dft
+
+_HOME_PLACEHOLDER = "__home_individual_ids__"
+
+
+class PopulationGenerator:
+    """Renders humans from a prototype human and per-agent columns and streams them into a V6 file.
+
+    The prototype is serialized to JSON once; each human is produced by substituting its own
+    values (SUID, infection SUIDs, and any columns such as m_age and m_gender) into that text,
+    so no per-agent Python objects are created.  Human collections are compressed and spooled
+    as they are rendered, so memory use does not grow with the size of the population.
+
+    The human SUID generator of each node and the infection SUID generator of the simulation
+    are advanced past the SUIDs that were used, and the home_individual_ids of each node lists
+    the generated humans (all of whom are at home).
+
+    Args:
+        filename: output V6 file
+        simulation: simulation object, e.g. from an existing file's dtk.simulation
+        human: prototype IndividualHuman object, e.g. an existing node's individualHumans[0]
+        collection_size: maximum number of humans per human collection chunk
+        engine: compression engine, LZ4 chooses SNAPPY or NONE for very large chunks as EMOD does
+        header: optional DtkHeaderV6 to copy author, tool, and emod_info from
+        dictionary: optional trained Zstandard dictionary used with the ZSTD engine
+
+    Examples:
+        Create a file with one million humans in one node, copying objects from an existing file::
+
+            import numpy as np
+            import emod_api.serialization.serialized_population as SerPop
+            from emod_api.serialization.population_generator import PopulationGenerator
+
+            ser_pop = SerPop.SerializedPopulation('state-00001.dtk')
+            node = ser_pop.nodes[0]
+            count = 1000000
+            with PopulationGenerator('big.dtk', ser_pop.dtk.simulation, node.individualHumans[0],
+                                     header=ser_pop.dtk.header) as generator:
+                generator.add_node(node, count, columns={
+                    'm_age': np.random.uniform(0, 36500, count),
+                    'm_gender': np.random.randint(0, 2, count)})
+    """
+
+    def __init__(self,
+                 filename: str,
+                 simulation: dict,
+                 human: dict,
+                 collection_size: int = 10000,
+                 engine: str = dft.LZ4,
+                 header: dict = None,
+                 dictionary: bytes = None):
+        self.collection_size = collection_size
+        self.simulation = copy.deepcopy(dict(simulation))
+        self.simulation['nodes'] = []
+        self.human = copy.deepcopy(dict(human))
+        self.num_humans = 0
+        self._node_suids = set()
+        self._max_human_suid = 0
+
+        new_header = dft.DtkHeaderV6()
+        if header is not None:
+            for key in ['author', 'tool', 'emod_info']:
+                if key in header:
+                    new_header[key] = copy.deepcopy(header[key])
+        self._writer = dft.DtkFileV6Writer(filename, new_header, engine, dictionary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def add_node(self,
+                 node: dict,
+                 count: int,
+                 columns: dict = None,
+                 suids=None):
+        """Render count humans from the prototype human and add them and the node to the file.
+
+        Args:
+            node: node object (its individualHumans, if any, are not written)
+            count: number of humans
+            columns: maps top-level IndividualHuman keys, e.g. m_age or m_gender, to sequences
+                (lists or NumPy arrays) of count values
+            suids: sequence of count human SUIDs, taken from the node's m_IndividualHumanSuidGenerator if None
+
+        Returns:
+            The number of humans added.
+        """
+        if isinstance(node, dft.DtkFileV6.NodeV6):
+            node = node.to_dict()
+        node = {key: copy.deepcopy(value) for key, value in node.items() if key != 'individualHumans'}
+        node_suid = node['suid']['id']
+        if node_suid in self._node_suids:
+            raise ValueError(f"Node with SUID {node_suid} has already been added.")
+        self._node_suids.add(node_suid)
+
+        columns = {} if columns is None else columns
+        for key, values in columns.items():
+            if len(values) != count:
+                raise ValueError(f"Column '{key}' has {len(values)} values, expected {count}.")
+            if key in ['suid', 'infections']:
+                raise ValueError(f"Column '{key}' is not allowed, use the suids argument for human SUIDs.")
+
+        generator = node['m_IndividualHumanSuidGenerator']
+        if suids is None:
+            suids = _take_suids(generator, count)
+        else:
+            if len(suids) != count:
+                raise ValueError(f"Expected {count} SUIDs but got {len(suids)}.")
+            suids = _as_list(suids)
+            _advance_past(generator, max(suids) if suids else 0)
+        if suids:
+            self._max_human_suid = max(self._max_human_suid, max(suids))
+
+        num_infections = len(self.human.get('infections', []))
+        infection_suids = _take_suids(self.simulation['infectionSuidGenerator'], count * num_infections) if num_infections else []
+
+        # EMOD's map of the SUIDs of the humans whose home is this node is rendered as text, like the humans
+        has_home_ids = 'home_individual_ids' in node
+        if has_home_ids:
+            node['home_individual_ids'] = _HOME_PLACEHOLDER
+        node_text = json.dumps(node, separators=(',', ':'))
+        if has_home_ids:
+            home_ids = ','.join('{"key":%d,"value":{"id":%d}}' % (suid, suid) for suid in suids)
+            node_text = node_text.replace(json.dumps(_HOME_PLACEHOLDER), '[' + home_ids + ']', 1)
+        self._writer.write_node(node_suid, node_text)
+
+        template = _human_template(self.human, list(columns.keys()))
+        encoded = [_encode_column(values) for values in columns.values()]
+        for start in range(0, count, self.collection_size):
+            stop = min(start + self.collection_size, count)
+            rows = []
+            for index in range(start, stop):
+                values = [str(suids[index])]
+                values.extend(str(suid) for suid in infection_suids[index * num_infections:(index + 1) * num_infections])
+                values.extend(column[index] for column in encoded)
+                rows.append(template % tuple(values))
+            text = '{"human_collection":[' + ','.join(rows) + ']}'
+            self._writer.write_human_collection(node_suid, stop - start, text)
+
+        self.num_humans += count
+        return count
+
+    def close(self):
+        """Write the simulation, with its SUID generators advanced, and finish the file."""
+        if 'individualHumanSuidGenerator' in self.simulation:
+            # Older simulations also track human SUIDs
+            _advance_past(self.simulation['individualHumanSuidGenerator'], self._max_human_suid)
+        self._writer.write_simulation(json.dumps(self.simulation, separators=(',', ':')))
+        self._writer.close()
+
+
+def _take_suids(generator: dict, count: int):
+    """Return count SUIDs from an EMOD SuidGenerator (next_suid, numtasks) and advance it."""
+    step = generator['numtasks']
+    first = generator['next_suid']['id']
+    generator['next_suid']['id'] = first + count * step
+    return list(range(first, first + count * step, step))
+
+
+def _advance_past(generator: dict, suid: int):
+    """Advance an EMOD SuidGenerator so its next SUID is greater than suid, keeping its rank."""
+    step = generator['numtasks']
+    next_suid = generator['next_suid']['id']
+    if next_suid <= suid:
+        generator['next_suid']['id'] = next_suid + ((suid - next_suid) // step + 1) * step
+
+
+def _as_list(values):
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+def _encode_column(values):
+    """Return the JSON text of each value in a column."""
+    values = _as_list(values)
+    if all(type(value) in (int, float, bool) for value in values):
+        # json.dumps() of the whole list is much faster than one call per value
+        text = json.dumps(values, separators=(',', ':'))[1:-1]
+        return text.split(',') if text else []
+    return [json.dumps(value, separators=(',', ':')) for value in values]
+
+
+def _human_template(human: dict, keys: list):
+    """Return a %-format string rendering one human with placeholders for its SUID, infection SUIDs, and columns."""
+    rest = {key: value for key, value in human.items() if key not in keys + ['suid', 'infections']}
+    infections = []
+    for infection in human.get('infections', []):
+        infection_rest = json.dumps({key: value for key, value in infection.items() if key != 'suid'}, separators=(',', ':'))
+        infections.append('{"suid":{"id":%s}' + _tail(infection_rest).replace('%', '%%'))
+
+    parts = ['"suid":{"id":%s}']
+    if 'infections' in human:
+        parts.append('"infections":[' + ','.join(infections) + ']')
+    parts.extend(json.dumps(key).replace('%', '%%') + ':%s' for key in keys)
+
+    return '{' + ','.join(parts) + _tail(json.dumps(rest, separators=(',', ':'))).replace('%', '%%')
+
+
+def _tail(text: str):
+    """Return the JSON text of an object after its opening brace, with a leading comma if it has members."""
+    return text[1:] if text == '{}' else ',' + text[1:]
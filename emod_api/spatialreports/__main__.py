@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 
+"""
+Command line tools for spatial reports, e.g.
+
+    python -m emod_api.spatialreports info SpatialReport_Prevalence.bin
+    python -m emod_api.spatialreports extract SpatialReport_Prevalence.bin -o subset.csv --steps 365:730 --nodes 1 2 3
+    python -m emod_api.spatialreports summary SpatialReport_Prevalence.bin -o summary.csv
+    python -m emod_api.spatialreports plot SpatialReport_Prevalence.bin -o prevalence.png
+    python -m emod_api.spatialreports transpose SpatialReport_Prevalence.bin
+
+Reports are memory mapped or read in part, so these work on reports larger than memory. The original example,
+plotting every node interactively, is still available with -f/--filename.
+"""
+
 import os
+import sys
 from argparse import ArgumentParser
-from emod_api.spatialreports.spatial import SpatialReport
+from pathlib import Path
+import numpy as np
+from emod_api.spatialreports.spatial import SpatialReport, transpose, _find_node_major, _read_header
 
 MATPLOTLIB = True
 try:
     import matplotlib
-    matplotlib.use('TkAgg')
-    import matplotlib.pyplot as plt
 except ModuleNotFoundError:
     print("This example requires the matplotlib package.")
     MATPLOTLIB = False
@@ -16,9 +30,14 @@ except ModuleNotFoundError:
 SCRIPT_PATH = os.path.realpath(__file__)
 WORKING_DIRECTORY = os.path.dirname(SCRIPT_PATH)
 
+_PLOT_BLOCK = 1024  # time steps reduced at a time when plotting statistics over all nodes
+
 
 def main(filename: str):
 
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
+
     report = SpatialReport(filename)
 
     plt.xkcd()
@@ -44,6 +63,121 @@ def dump_source():
     return
 
 
+def __do_info__(args):
+
+    num_nodes, num_time_steps, start, interval, node_ids, _ = _read_header(args.filename)
+    companion = _find_node_major(args.filename, node_ids, num_time_steps)
+
+    print(f"File:            {args.filename}")
+    print(f"Size:            {Path(args.filename).stat().st_size:,} bytes")
+    print(f"Nodes:           {num_nodes:,}" + (f" (IDs {node_ids.min()} to {node_ids.max()})" if num_nodes else ""))
+    print(f"Time steps:      {num_time_steps:,}")
+    print(f"Start:           {start}")
+    print(f"Interval:        {interval}")
+    print(f"Node-major copy: {companion[0] if companion else 'none'}")
+    if args.node_ids:
+        for node_id in node_ids:
+            print(node_id)
+
+    return
+
+
+def __do_extract__(args):
+
+    report = SpatialReport.read(args.filename, steps=_parse_steps(args.steps), node_ids=args.nodes)
+
+    if args.output.endswith(".npy"):
+        np.save(args.output, report.data)
+    else:
+        columns = np.column_stack([_times(report), report.data])
+        header = ",".join(["Time Step"] + [str(node_id) for node_id in report.node_ids])
+        np.savetxt(args.output, columns, fmt=["%d"] + [args.format] * report.node_count, delimiter=",", header=header, comments="")
+
+    print(f"Wrote {report.time_steps:,} time steps of {report.node_count:,} nodes to '{args.output}'", file=sys.stderr)
+
+    return
+
+
+def __do_summary__(args):
+
+    report = SpatialReport(args.filename, mmap=True)
+    summary = report.summary()
+
+    names = ["min", "max", "mean", "final"]
+    columns = np.column_stack([report.node_ids] + [summary[name] for name in names])
+    output = args.output if args.output else sys.stdout
+    np.savetxt(output, columns, fmt=["%d"] + [args.format] * len(names), delimiter=",", header=",".join(["Node ID"] + names), comments="")
+
+    return
+
+
+def __do_plot__(args):
+
+    # render to a file without pyplot, so the global backend is not changed
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    steps = _parse_steps(args.steps)
+    channel = Path(args.filename).stem.split("_", 1)[-1]
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+
+    if args.nodes:
+        report = SpatialReport.read(args.filename, steps=steps, node_ids=args.nodes)
+        times = _times(report)
+        for node_id in report.node_ids:
+            axes.plot(times, report[node_id].data, label=f"Node {node_id}")
+        axes.legend()
+    else:
+        # statistics over all nodes, a block of time steps at a time
+        report = SpatialReport(args.filename, mmap=True)
+        rows = range(*(steps or slice(None)).indices(report.time_steps))
+        times = report.start + report.interval * np.array(rows)
+        mean, low, high = np.empty(len(rows)), np.empty(len(rows)), np.empty(len(rows))
+        for first in range(0, len(rows), _PLOT_BLOCK):
+            block = rows[first:first + _PLOT_BLOCK]
+            chunk = np.asarray(report.data[block.start:block.stop:block.step], dtype=np.float64)
+            mean[first:first + len(chunk)] = chunk.mean(axis=1)
+            low[first:first + len(chunk)] = chunk.min(axis=1)
+            high[first:first + len(chunk)] = chunk.max(axis=1)
+        axes.fill_between(times, low, high, alpha=0.3, label="Node min - max")
+        axes.plot(times, mean, label=f"Mean of {report.node_count:,} nodes")
+        axes.legend()
+
+    axes.set_title(channel)
+    axes.set_xlabel("Time Step")
+    axes.set_ylabel(channel)
+    figure.savefig(args.output, dpi=args.dpi)
+
+    print(f"Wrote '{args.output}'", file=sys.stderr)
+
+    return
+
+
+def __do_transpose__(args):
+
+    print(f"Wrote '{transpose(args.filename, args.output)}'", file=sys.stderr)
+
+    return
+
+
+def _parse_steps(text: str) -> slice:
+    """Parse "start:stop[:step]" (any part may be empty) or a single time step index."""
+
+    if not text:
+        return None
+    parts = [int(part) if part else None for part in text.split(":")]
+    if len(parts) == 1:
+        return slice(parts[0], parts[0] + 1 if parts[0] != -1 else None)
+
+    return slice(*parts)
+
+
+def _times(report: SpatialReport) -> np.ndarray:
+    return report.start + report.interval * np.arange(report.time_steps)
+
+
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument(
@@ -56,10 +190,47 @@ if __name__ == "__main__":
         action="store_true",
         help="Write source code for this example to stdout.",
     )
+    subparsers = parser.add_subparsers(dest="command")
+
+    info_parser = subparsers.add_parser("info", help="Print the header of a spatial report")
+    info_parser.add_argument("filename")
+    info_parser.add_argument("-n", "--node-ids", default=False, action="store_true", help="Also print every node ID")
+    info_parser.set_defaults(func=__do_info__)
+
+    extract_parser = subparsers.add_parser("extract", help="Write some time steps and/or nodes to .csv or .npy")
+    extract_parser.add_argument("filename")
+    extract_parser.add_argument("-o", "--output", required=True, help="Output .csv or .npy filename")
+    extract_parser.add_argument("-s", "--steps", default=None, help="Time steps (samples) as start:stop[:step], e.g. 365:730 [all]")
+    extract_parser.add_argument("-n", "--nodes", default=None, nargs="+", type=int, help="Node IDs [all]")
+    extract_parser.add_argument("--format", default="%.7g", help="CSV number format [%%.7g]")
+    extract_parser.set_defaults(func=__do_extract__)
+
+    summary_parser = subparsers.add_parser("summary", help="Write min, max, mean, and final value of each node as CSV")
+    summary_parser.add_argument("filename")
+    summary_parser.add_argument("-o", "--output", default=None, help="Output .csv filename [stdout]")
+    summary_parser.add_argument("--format", default="%.7g", help="CSV number format [%%.7g]")
+    summary_parser.set_defaults(func=__do_summary__)
+
+    plot_parser = subparsers.add_parser("plot", help="Plot nodes, or the mean and range over all nodes, to an image file")
+    plot_parser.add_argument("filename")
+    plot_parser.add_argument("-o", "--output", required=True, help="Output image filename, e.g. plot.png")
+    plot_parser.add_argument("-s", "--steps", default=None, help="Time steps (samples) as start:stop[:step] [all]")
+    plot_parser.add_argument("-n", "--nodes", default=None, nargs="+", type=int, help="Node IDs to plot [mean and range of all nodes]")
+    plot_parser.add_argument("--dpi", default=100, type=int, help="Image resolution [100]")
+    plot_parser.set_defaults(func=__do_plot__)
+
+    transpose_parser = subparsers.add_parser("transpose", help="Write a node-major copy for fast access to node time series")
+    transpose_parser.add_argument("filename")
+    transpose_parser.add_argument("-o", "--output", default=None, help="Output filename [<name>.nodes.bin]")
+    transpose_parser.set_defaults(func=__do_transpose__)
 
     args = parser.parse_args()
 
-    if args.get:
+    if args.command:
+        if (args.command == "plot") and not MATPLOTLIB:
+            sys.exit(1)
+        args.func(args)
+    elif args.get:
         dump_source()
     elif args.filename and MATPLOTLIB:
         main(args.filename)
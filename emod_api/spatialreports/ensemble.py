@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Streaming statistics over an ensemble of spatial reports, e.g. the SpatialReport_Prevalence.bin files of an experiment."""
+
+from pathlib import Path
+from typing import Iterable, Union
+
+import numpy as np
+
+from emod_api.channelreports.ensemble import RunningStatistics, StreamingQuantiles
+from emod_api.channelreports.ensemble import MEAN, STD, VAR, MIN, MAX, QUANTILES, COUNT, STATS
+from emod_api.spatialreports.spatial import SpatialReport, _read_header
+from emod_api.utils.parallel import parallel_map
+
+NODE_IDS = "node_ids"
+
+
+def aggregate(paths: Iterable[Union[str, Path]],
+              node_ids: list[int] = None,
+              steps: slice = None,
+              stats: list[str] = (MEAN, STD),
+              quantiles: Iterable[float] = (0.05, 0.5, 0.95),
+              workers: int = None) -> dict:
+    """
+    Compute statistics, per node and time step, of one channel over many spatial reports (e.g. the
+    SpatialReport_Prevalence.bin files of an experiment).
+
+    Reports are read in parallel, reading only the requested nodes and time steps, and statistics are updated
+    as each report arrives so memory use does not grow with the number of reports. Reports may have different
+    numbers of time steps and their nodes may be in different orders.
+
+    Args:
+        paths: spatial report files
+        node_ids: nodes to aggregate, defaults to the nodes of the first report
+        steps: time steps to aggregate, e.g. slice(365, 730), defaults to all
+        stats: any of "mean", "std", "var", "min", "max", and "quantiles"
+        quantiles: probabilities of the quantiles to estimate if "quantiles" is in stats
+        workers: number of worker processes, defaults to the number of CPUs, 1 reads the reports in this process
+
+    Returns:
+        Dictionary of statistic name to array of shape (time steps, nodes), "quantiles" has shape
+        (number of quantiles, time steps, nodes). "count" (the number of reports with data at each time
+        step) and "node_ids" (the node IDs of the columns) are always included.
+
+    Examples:
+        Mean and median prevalence by node over an experiment::
+
+            from pathlib import Path
+            from emod_api.spatialreports.ensemble import aggregate
+
+            paths = Path("experiment").glob("*/output/SpatialReport_Prevalence.bin")
+            results = aggregate(paths, stats=["mean", "quantiles"], quantiles=[0.5])
+    """
+
+    unknown = [stat for stat in stats if stat not in STATS]
+    if unknown:
+        raise ValueError(f"Unknown statistic(s) {unknown}, expected some of {STATS}.")
+
+    paths = [str(path) for path in paths]
+    if not paths:
+        raise ValueError("No spatial reports to aggregate.")
+    node_ids = _read_header(paths[0])[4].tolist() if node_ids is None else list(node_ids)
+
+    moments = RunningStatistics()
+    sketch = StreamingQuantiles(quantiles) if QUANTILES in stats else None
+
+    for _, data in parallel_map(_read_series, paths, workers, node_ids, steps):
+        moments.update(data)
+        if sketch is not None:
+            sketch.update(data)
+
+    results = {NODE_IDS: node_ids, COUNT: moments.count}
+    if MEAN in stats:
+        results[MEAN] = moments.mean
+    if STD in stats:
+        results[STD] = moments.std()
+    if VAR in stats:
+        results[VAR] = moments.variance()
+    if MIN in stats:
+        results[MIN] = moments.min
+    if MAX in stats:
+        results[MAX] = moments.max
+    if QUANTILES in stats:
+        results[QUANTILES] = sketch.quantiles
+
+    return results
+
+
+def _read_series(path: str, node_ids: list[int], steps: slice) -> np.ndarray:
+    """Return the data of the given nodes and time steps of a spatial report, shape (time steps, nodes)."""
+    return SpatialReport.read(path, steps=steps, node_ids=node_ids).data
@@ -19,15 +19,18 @@ There is little to no assistance here so you need to specify a valid key and val
 """
 
 import os
-import emod_api.spatialreports.spatial as sr
+from emod_api.spatialreports.ensemble import aggregate, MEAN, NODE_IDS
 import matplotlib.pyplot as plt
-import numpy as np
 import sqlite3
 
 
-def collect(exp_id, chan="Prevalence", tag=None):
-    node_chan_data = {}
-    node_chan_means = {}
+def collect(exp_id, chan="Prevalence", tag=None, workers=None):
+    """
+    Return a dictionary of node ID to the mean, over the simulations of the experiment, of the channel at each time step.
+
+    Reports are read in parallel (workers processes, default the number of CPUs) and the means are updated as
+    each report is read so memory use does not depend on the number of simulations.
+    """
     groupby_values = {}
     if tag:
         if len(tag.split("=")) == 1:
@@ -50,18 +53,9 @@ def collect(exp_id, chan="Prevalence", tag=None):
         if "results.db" in groupby_values["ref"]:
             groupby_values["ref"].remove("results.db")
 
-    for sim_id in groupby_values["ref"]:
-        report_path = os.path.join(str(exp_id), sim_id, "SpatialReport_" + chan + ".bin")
-        data = sr.SpatialReport(report_path)
-        for node_id in data.node_ids:
-            chan_data = data[node_id].data
-            if node_id not in node_chan_data:
-                node_chan_data[node_id] = list()
-                node_chan_means[node_id] = list()
-            node_chan_data[node_id].append(chan_data)
-            node_chan_means[node_id] = np.zeros(len(node_chan_data[node_id]))
-    for node in node_chan_data.keys():
-        node_chan_means[node] = np.mean(np.array(node_chan_data[node]), axis=0)
+    report_paths = [os.path.join(str(exp_id), sim_id, "SpatialReport_" + chan + ".bin") for sim_id in groupby_values["ref"]]
+    results = aggregate(report_paths, stats=[MEAN], workers=workers)
+    node_chan_means = {node_id: results[MEAN][:, index] for index, node_id in enumerate(results[NODE_IDS])}
 
     return node_chan_means
 
@@ -2,8 +2,12 @@
 
 """emod-api spatial report module. Exposes SpatialReport and SpatialNode objects."""
 
+import os
 from pathlib import Path
 import numpy as np
+from scipy import sparse as sp
+
+from emod_api.utils.resample import MEAN, resample as _resample
 
 
 class SpatialNode(object):
@@ -42,6 +46,10 @@ class SpatialNode(object):
 NUM_STEPS_INDEX = 0
 NUM_NODES_INDEX = 1
 
+_READ_BLOCK = 1 << 24   # bytes read at a time when reading whole rows of a spatial report
+_NODE_MAJOR_MAGIC = b"EMODSPN1"
+_TRANSPOSE_TILE = 1024  # time steps and nodes per tile when transposing a spatial report
+
 
 class SpatialReport(object):
 
@@ -50,7 +58,7 @@ class SpatialReport(object):
     "Filtered" reports will have start > 0 and/or reporting interval > 1.
     """
 
-    def __init__(self, filename: str = None, node_ids: list[int] = None, data: np.array = None, start: int = 0, interval: int = 1):
+    def __init__(self, filename: str = None, node_ids: list[int] = None, data: np.array = None, start: int = 0, interval: int = 1, mmap: bool = False):
 
         """
         Args:
@@ -59,10 +67,11 @@ class SpatialReport(object):
             data: NumPy array of data, shape must be (#values, #nodes)
             start: time step of first sample (used with filtered reports)
             interval: # of time steps between samples (used with filtered reports)
+            mmap: memory map the data in filename (read-only) rather than reading it into memory
         """
 
         if isinstance(filename, str):
-            self._from_file(filename)
+            self._from_file(filename, mmap)
         else:
             self._from_node_ids_and_data(node_ids, data, start, interval)
 
@@ -70,22 +79,52 @@ class SpatialReport(object):
 
     @property
     def data(self) -> np.array:
-        """Returns full 2 dimensional NumPy array with report data. Shape is (#values, #nodes)."""
+        """
+        Returns full 2 dimensional NumPy array with report data. Shape is (#values, #nodes).
+        Reports read with mmap=True return a read-only np.memmap.
+        """
         return self._data
 
     @property
     def node_ids(self) -> list[int]:
-        """Returns list of node IDs (integers) for nodes in the report."""
+        """Returns list of node IDs (integers) for nodes in the report, in the order of the columns of data."""
         return self._node_ids
 
     @property
     def nodes(self) -> dict[int, SpatialNode]:
         """Returns dictionary of SpatialNodes keyed on node ID."""
+        if len(self._nodes) < len(self._node_ids):
+            for node_id in self._node_ids:
+                self._node(node_id)
         return self._nodes
 
     # index into report by node id
     def __getitem__(self, item: int) -> SpatialNode:
-        return self._nodes[item]
+        return self._node(item)
+
+    def series(self, node_ids: list[int] = None) -> np.ndarray:
+        """
+        Returns time series of the given nodes (default all) as a 2 dimensional NumPy array without creating SpatialNodes.
+        Shape is (#values, #nodes) with columns in the order of node_ids.
+        """
+        if node_ids is None:
+            return np.array(self._data)
+        columns = self._columns(node_ids)
+        if self._by_node is not None:
+            return np.ascontiguousarray(self._by_node[columns].T)
+        return self._data[:, columns]
+
+    def _columns(self, node_ids) -> np.ndarray:
+        """Column index of each node ID, raises KeyError for unknown node IDs."""
+        return _search(self._sorted_ids, self._order, np.asarray(node_ids))
+
+    def _node(self, node_id: int) -> SpatialNode:
+        """SpatialNode objects are created on first access, each is a view of one column of data."""
+        if node_id not in self._nodes:
+            column = int(self._columns([node_id])[0])
+            data = self._by_node[column] if self._by_node is not None else self._data[:, column]
+            self._nodes[node_id] = SpatialNode(node_id, data)
+        return self._nodes[node_id]
 
     @property
     def node_count(self) -> int:
@@ -111,18 +150,180 @@ class SpatialReport(object):
 
         """Save current nodes and timeseries data to given file."""
 
-        with open(filename, "wb") as file:
-            np.array([self.node_count], dtype=np.uint32).tofile(file)
-            np.array([self.time_steps], dtype=np.uint32).tofile(file)
-            if self.start != 0 or self.interval != 1:
-                np.array([self.start], dtype=np.float32).tofile(file)
-                np.array([self.interval], dtype=np.float32).tofile(file)
-            np.array([self.node_ids], dtype=np.uint32).tofile(file)
-            self.data.tofile(file)
+        with SpatialReportWriter(filename, self.node_ids, self.start, self.interval) as writer:
+            writer.append(self.data)
 
         return
 
-    def _from_file(self, filename: str):
+    def aggregate(self, mapping: dict[int, int], weights=None) -> "SpatialReport":
+        """
+        Combine nodes into regions, e.g. districts, summing or taking the weighted mean of their values at each time step.
+
+        The data is multiplied by a sparse (node x region) matrix a block of time steps at a time, so memory mapped
+        reports are not read into memory all at once.
+
+        Args:
+            mapping: dictionary of node ID to (integer) region ID, nodes not in mapping are left out
+            weights: None to sum the nodes of each region, or node weights for the weighted mean of each region,
+                either a dictionary of node ID to weight, a sequence of weights in the order of node_ids, or
+                a SpatialReport with the same nodes and time steps for weights which change over time, e.g. population
+
+        Returns:
+            SpatialReport with one "node" per region, with region IDs in increasing order. Regions whose weights
+            sum to zero have NaN values.
+
+        Examples:
+            Population weighted prevalence by district::
+
+                districts = prevalence.aggregate(node_to_district, weights=population)
+        """
+
+        node_ids = list(mapping.keys())
+        region_ids, regions = np.unique(np.array([mapping[node_id] for node_id in node_ids]), return_inverse=True)
+        assert len(region_ids) > 0, "mapping must not be empty"
+        columns = self._columns(node_ids)
+        matrix = sp.csr_matrix((np.ones(len(columns)), (columns, regions)), shape=(self.node_count, len(region_ids)))
+
+        dynamic = isinstance(weights, SpatialReport)
+        if dynamic:
+            assert weights.time_steps == self.time_steps, "weights must have the same number of time steps as this report"
+            weight_columns = weights._columns(self.node_ids)
+        elif weights is not None:
+            if isinstance(weights, dict):
+                vector = np.array([weights.get(node_id, 0.0) for node_id in self.node_ids], dtype=np.float64)
+            else:
+                vector = np.asarray(weights, dtype=np.float64)
+                assert vector.shape == (self.node_count,), "weights must have one value per node"
+            totals = vector @ matrix
+            matrix = sp.diags(vector) @ matrix
+
+        data = np.empty((self.time_steps, len(region_ids)), dtype=np.float32)
+        block = max(1, _READ_BLOCK // (self.node_count * 4))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for first in range(0, self.time_steps, block):
+                chunk = np.asarray(self._data[first:first + block], dtype=np.float64)
+                if dynamic:
+                    chunk_weights = np.asarray(weights.data[first:first + block], dtype=np.float64)[:, weight_columns]
+                    data[first:first + block] = (chunk * chunk_weights) @ matrix / (chunk_weights @ matrix)
+                elif weights is not None:
+                    data[first:first + block] = (chunk @ matrix) / totals
+                else:
+                    data[first:first + block] = chunk @ matrix
+
+        return SpatialReport(node_ids=region_ids, data=data, start=self.start, interval=self.interval)
+
+    def summary(self) -> dict[str, np.ndarray]:
+        """
+        Returns dictionary of "min", "max", "mean", and "final" (last sample) to an array with one value per node.
+        The data is reduced a block of time steps at a time, so memory mapped reports are not read into memory all at once.
+        """
+
+        minimum = np.full(self.node_count, np.inf)
+        maximum = np.full(self.node_count, -np.inf)
+        total = np.zeros(self.node_count)
+        block = max(1, _READ_BLOCK // (self.node_count * 4))
+        for first in range(0, self.time_steps, block):
+            chunk = np.asarray(self._data[first:first + block], dtype=np.float64)
+            np.minimum(minimum, chunk.min(axis=0), out=minimum)
+            np.maximum(maximum, chunk.max(axis=0), out=maximum)
+            total += chunk.sum(axis=0)
+
+        final = np.array(self._data[-1], dtype=np.float64) if self.time_steps else np.full(self.node_count, np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / self.time_steps
+
+        return {"min": minimum, "max": maximum, "mean": mean, "final": final}
+
+    def resample(self, interval: int, how: str = MEAN) -> "SpatialReport":
+        """
+        Combine consecutive samples into a filtered report with one sample every interval time steps, e.g. weekly
+        means of a daily report. A final, shorter run of samples is combined from the samples available.
+
+        Samples are combined a block of time steps at a time, so memory mapped reports are not read into memory
+        all at once.
+
+        Args:
+            interval: time steps between samples of the new report, a multiple of this report's interval
+            how: "mean", "sum", "max", "min", or "last"
+
+        Returns:
+            SpatialReport with the same nodes, start, and the new interval.
+        """
+
+        assert (int(interval) == interval) and (interval % self.interval == 0), f"interval ({interval}) must be a multiple of the report's interval ({self.interval})."
+        data = _resample(self._data, int(interval) // self.interval, how)
+
+        return SpatialReport(node_ids=self.node_ids, data=data, start=self.start, interval=int(interval))
+
+    @classmethod
+    def read(cls, filename: str, steps: slice = None, node_ids: list[int] = None) -> "SpatialReport":
+        """
+        Read a time window and/or a subset of the nodes of a spatial report file, reading only the bytes needed.
+
+        Data is stored by time step, so a time window is one contiguous range of the file. Node subsets are
+        read one time step at a time, reading only the range of each time step spanning the requested nodes,
+        or, if there is an up-to-date node-major copy of the file (see transpose()) and it means reading
+        fewer bytes, one node at a time from that copy.
+
+        Args:
+            filename: file from which to read data
+            steps: time steps (samples) to read, e.g. slice(365, 730), defaults to all
+            node_ids: IDs of the nodes to read, in the order of the columns of the returned data, defaults to all
+
+        Returns:
+            SpatialReport with data of shape (#steps, #nodes); start and interval are those of the first step read
+            and the spacing of the steps read.
+
+        Examples:
+            Second year of two nodes::
+
+                report = SpatialReport.read("SpatialReport_Prevalence.bin", steps=slice(365, 730), node_ids=[1, 2])
+        """
+
+        num_nodes, num_time_steps, start, interval, file_ids, offset = _read_header(filename)
+
+        steps = slice(None) if steps is None else steps
+        assert isinstance(steps, slice), "steps must be a slice"
+        rows = range(*steps.indices(num_time_steps))
+        assert rows.step >= 1, "steps must be increasing"
+
+        if node_ids is None:
+            node_ids = file_ids
+            columns = spanned = slice(None)
+            low, high = 0, num_nodes
+        else:
+            node_ids = np.asarray(node_ids)
+            order = np.argsort(file_ids, kind="stable")
+            found = _search(file_ids[order], order, node_ids, filename)
+            low, high = (int(found.min()), int(found.max()) + 1) if len(found) else (0, 0)
+            columns, spanned = found, found - low
+
+        data = np.empty((len(rows), len(node_ids)), dtype=np.float32)
+        length = (rows[-1] - rows.start + 1) if len(rows) else 0
+        companion = _find_node_major(filename, file_ids, num_time_steps) if isinstance(columns, np.ndarray) else None
+        if (companion is not None) and (len(columns) * length < len(rows) * (high - low)):
+            with open(companion[0], "rb") as file:
+                for index, column in enumerate(columns):
+                    file.seek(companion[1] + (int(column) * num_time_steps + rows.start) * 4)
+                    data[:, index] = np.fromfile(file, dtype=np.float32, count=length)[::rows.step]
+        else:
+            with open(filename, "rb") as file:
+                if (rows.step == 1) and (2 * (high - low) >= num_nodes):
+                    # read blocks of whole time steps
+                    block = max(1, _READ_BLOCK // (num_nodes * 4))
+                    for first in range(0, len(rows), block):
+                        count = min(block, len(rows) - first)
+                        file.seek(offset + rows[first] * num_nodes * 4)
+                        chunk = np.fromfile(file, dtype=np.float32, count=count * num_nodes).reshape((count, num_nodes))
+                        data[first:first + count] = chunk[:, columns]
+                else:
+                    for index, row in enumerate(rows):
+                        file.seek(offset + (row * num_nodes + low) * 4)
+                        data[index] = np.fromfile(file, dtype=np.float32, count=high - low)[spanned]
+
+        return cls(node_ids=node_ids.tolist(), data=data, start=start + rows.start * interval, interval=interval * rows.step)
+
+    def _from_file(self, filename: str, mmap: bool = False):
         """
         Read binary spatial report file.
         #nodes,
@@ -130,65 +331,44 @@ class SpatialReport(object):
         node ids (#nodes values),
         data (#nodes x #time steps values)
         """
-        # File format:
-        # number of nodes      - uint32 * 1
-        # number of time steps - uint32 * 1
-        # OPTIONAL:
-        #     starting time step - float32 * 1 (integral value in reality)
-        #     time step interval - float32 * 1 (integral value in reality)
-        # node ids             - uint32 * number of nodes
-        # data                 - (float32 * number of nodes) * number of time_steps
-
-        file_size = Path(filename).stat().st_size
-
-        with open(filename, "rb") as file:
-            num_nodes = np.fromfile(file, dtype=np.uint32, count=1)[0]
-            num_time_steps = np.fromfile(file, dtype=np.uint32, count=1)[0]
-
-            simple_size = (2 + num_nodes + (num_nodes * num_time_steps)) * 4    # num_nodes, num_time_steps, node_ids, and data
-            filtered_size = simple_size + 8     # include starting time step and time step interval
-
-            if file_size == simple_size:
-                self._start = 0
-                self._interval = 1
-            elif file_size == filtered_size:
-                self._start = int(np.fromfile(file, dtype=np.float32, count=1)[0])
-                self._interval = int(np.fromfile(file, dtype=np.float32, count=1)[0])
-                assert self.start >= 0
-                assert self.interval >= 1
-            else:
-                raise RuntimeError(f"Unexpected file size {file_size}, expected {simple_size} (standard spatial report) or {filtered_size} (filtered spatial report).")
 
-            node_ids = np.fromfile(file, dtype=np.uint32, count=num_nodes)
-            data = np.fromfile(file, dtype=np.float32, count=num_nodes * num_time_steps)
+        num_nodes, num_time_steps, start, interval, node_ids, offset = _read_header(filename)
 
         # let us index data[step, node]
-        data = data.reshape((num_time_steps, num_nodes))
-        self._from_node_ids_and_data(node_ids, data, self._start, self._interval)
+        if mmap:
+            data = np.memmap(filename, dtype=np.float32, mode="r", offset=offset, shape=(num_time_steps, num_nodes))
+        else:
+            data = np.fromfile(filename, dtype=np.float32, count=num_nodes * num_time_steps, offset=offset)
+            data = data.reshape((num_time_steps, num_nodes))
+        self._from_node_ids_and_data(node_ids, data, start, interval)
+
+        if mmap:
+            # node time series are contiguous in an up-to-date node-major copy
+            companion = _find_node_major(filename, node_ids, num_time_steps)
+            if companion is not None:
+                self._by_node = np.memmap(companion[0], dtype=np.float32, mode="r", offset=companion[1], shape=(num_nodes, num_time_steps))
 
         return
 
     def _from_node_ids_and_data(self, node_ids: list, data: np.array, start: int, interval: int) -> None:
 
         assert _is_iterable(node_ids), "node_ids must be specified and iterable"
-        concrete = list(node_ids)
-        assert len(concrete) > 0, "node_ids must not be empty"
-        assert all(map(lambda i: _isinteger(i), concrete)), "node_ids must be integers"
-        assert len(set(concrete)) == len(concrete), "node_ids must be unique"
-        self._node_ids = sorted(concrete)
+        ids = node_ids if isinstance(node_ids, np.ndarray) else np.array(list(node_ids))
+        assert (ids.ndim == 1) and (len(ids) > 0), "node_ids must not be empty"
+        assert np.issubdtype(ids.dtype, np.integer), "node_ids must be integers"
+        # sorted index of node ids for np.searchsorted(), node_ids stay in the order of the columns of data
+        self._order = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._order]
+        assert np.all(self._sorted_ids[1:] != self._sorted_ids[:-1]), "node_ids must be unique"
+        self._node_ids = ids.tolist()
         assert data.dtype is np.dtype("float32"), "data must be np.float32"
         assert data.shape[1] == len(
             self._node_ids
         ), "data shape must be (#values, #nodes)"
         self._data = data
 
-        self._node_id_to_index_map = {
-            node_ids[n]: n for n in range(data.shape[NUM_NODES_INDEX])
-        }
-        self._nodes = {
-            node_id: SpatialNode(node_id, data[:, self._node_id_to_index_map[node_id]])
-            for node_id in node_ids
-        }
+        self._nodes = {}
+        self._by_node = None
 
         assert int(start) >= 0, "start sample time must be >= 0"
         self._start = int(start)
@@ -198,13 +378,388 @@ class SpatialReport(object):
         return
 
 
+class SpatialReportWriter(object):
+
+    """
+    Writes a spatial report file one time step, or block of time steps, at a time so the report need not fit in memory.
+
+    The header is written when the writer is created and the number of time steps is filled in when it is closed.
+    If the with block raises, the incomplete file is deleted.
+
+    Examples:
+        Write a year of daily values for three nodes::
+
+            with SpatialReportWriter("SpatialReport_Synthetic.bin", [1, 2, 3]) as writer:
+                for day in range(365):
+                    writer.append(np.full(3, day))
+    """
+
+    def __init__(self, filename: str, node_ids: list[int], start: int = 0, interval: int = 1):
+
+        """
+        Args:
+            filename: file to write
+            node_ids: list of node ids, must be unique integer values, in the order of the values of each time step
+            start: time step of first sample (written as a filtered report if start > 0 or interval > 1)
+            interval: # of time steps between samples
+        """
+
+        assert _is_iterable(node_ids), "node_ids must be specified and iterable"
+        ids = np.array(list(node_ids))
+        assert (ids.ndim == 1) and (len(ids) > 0), "node_ids must not be empty"
+        assert np.issubdtype(ids.dtype, np.integer), "node_ids must be integers"
+        assert len(np.unique(ids)) == len(ids), "node_ids must be unique"
+        assert int(start) >= 0, "start sample time must be >= 0"
+        assert int(interval) >= 1, "sample interval must be >= 1"
+
+        self._node_count = len(ids)
+        self._time_steps = 0
+        self._filename = filename
+        self._file = open(filename, "wb")
+        np.array([self._node_count, 0], dtype=np.uint32).tofile(self._file)
+        if int(start) != 0 or int(interval) != 1:
+            np.array([start, interval], dtype=np.float32).tofile(self._file)
+        ids.astype(np.uint32).tofile(self._file)
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+        return False
+
+    @property
+    def node_count(self) -> int:
+        return self._node_count
+
+    @property
+    def time_steps(self) -> int:
+        """Number of time steps written so far."""
+        return self._time_steps
+
+    def append(self, values) -> None:
+        """Write one time step, shape (#nodes,), or a block of time steps, shape (#values, #nodes)."""
+
+        assert self._file is not None, "SpatialReportWriter is closed"
+        values = np.asarray(values, dtype=np.float32)
+        values = values.reshape((1, -1)) if values.ndim == 1 else values
+        if (values.ndim != 2) or (values.shape[1] != self._node_count):
+            raise ValueError(f"Expected values with shape (#values, {self._node_count}) or ({self._node_count},), got {values.shape}.")
+        np.ascontiguousarray(values).tofile(self._file)
+        self._time_steps += values.shape[0]
+
+        return
+
+    def close(self) -> None:
+        """Write the number of time steps to the header and close the file."""
+
+        if self._file is not None:
+            self._file.seek(4)
+            np.array([self._time_steps], dtype=np.uint32).tofile(self._file)
+            self._file.close()
+            self._file = None
+
+        return
+
+    def _discard(self) -> None:
+        """Close and delete the incomplete file."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._filename)
+
+        return
+
+
+class SpatialReportSet(object):
+
+    """
+    The spatial reports of one simulation, one SpatialReport_<Channel>.bin file per channel, sharing node IDs and time steps.
+
+    Reports are memory mapped (by default) and `data` presents them as a single (channel x time x node) array
+    without copying, so computations across channels read only the values they use.
+
+    Examples:
+        New infections per capita::
+
+            reports = SpatialReportSet("output")
+            per_capita = reports["New_Infections"].data / reports["Population"].data
+    """
+
+    def __init__(self, directory: str, channels: list[str] = None, prefix: str = "SpatialReport_", mmap: bool = True):
+
+        """
+        Args:
+            directory: directory containing the spatial report files
+            channels: channels to open, defaults to all the files in directory
+            prefix: filename prefix of the reports, e.g. "SpatialReportMalariaFiltered_" for filtered reports
+            mmap: memory map the reports rather than reading them into memory
+        """
+
+        paths = {path.stem[len(prefix):]: path for path in sorted(Path(directory).glob(f"{prefix}*.bin"))
+                 if not path.stem.endswith(".nodes")}   # skip node-major copies, see transpose()
+        if channels is not None:
+            missing = [channel for channel in channels if channel not in paths]
+            if missing:
+                raise ValueError(f"No {prefix}<channel>.bin file(s) in '{directory}' for channel(s) {missing}.")
+            paths = {channel: paths[channel] for channel in channels}
+        if not paths:
+            raise ValueError(f"No {prefix}*.bin files in '{directory}'.")
+
+        self._reports = {channel: SpatialReport(str(path), mmap=mmap) for channel, path in paths.items()}
+
+        first = next(iter(self._reports.values()))
+        for channel, report in self._reports.items():
+            if report.node_ids != first.node_ids:
+                raise ValueError(f"Node IDs of '{paths[channel]}' do not match those of the other reports.")
+            if (report.time_steps, report.start, report.interval) != (first.time_steps, first.start, first.interval):
+                raise ValueError(f"Time steps of '{paths[channel]}' ({report.time_steps} from {report.start} every {report.interval}) "
+                                 f"do not match those of the other reports ({first.time_steps} from {first.start} every {first.interval}).")
+
+        self._first = first
+        self._data = _ChannelStack(list(self._reports.keys()), [report.data for report in self._reports.values()])
+
+        return
+
+    @property
+    def channels(self) -> list[str]:
+        """Channel names, from the report filenames."""
+        return list(self._reports.keys())
+
+    def __getitem__(self, channel: str) -> SpatialReport:
+        return self._reports[channel]
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self._reports
+
+    def __len__(self) -> int:
+        return len(self._reports)
+
+    @property
+    def data(self) -> "_ChannelStack":
+        """
+        (channel x time x node) array-like view of the reports' data. Index with channel name(s) or index(es)
+        followed by time and node indices, e.g. data["Prevalence", 180] or data[["Population", "New_Infections"], :, 0:10].
+        Only the values selected are read; np.asarray(data) reads everything.
+        """
+        return self._data
+
+    @property
+    def node_ids(self) -> list[int]:
+        return self._first.node_ids
+
+    @property
+    def node_count(self) -> int:
+        return self._first.node_count
+
+    @property
+    def time_steps(self) -> int:
+        return self._first.time_steps
+
+    @property
+    def start(self) -> int:
+        return self._first.start
+
+    @property
+    def interval(self) -> int:
+        return self._first.interval
+
+
+class _ChannelStack(object):
+
+    """Read-only (channel x time x node) stack of same shape arrays, indexed without copying the arrays."""
+
+    def __init__(self, names: list[str], arrays: list[np.ndarray]):
+
+        self._names = names
+        self._arrays = arrays
+
+        return
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self._arrays),) + self._arrays[0].shape
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._arrays[0].dtype
+
+    def __len__(self) -> int:
+        return len(self._arrays)
+
+    def __getitem__(self, key) -> np.ndarray:
+
+        key = key if isinstance(key, tuple) else (key,)
+        channel, rest = key[0], key[1:]
+        if isinstance(channel, (str, int, np.integer)):
+            return np.asarray(self._arrays[self._channel_index(channel)][rest])
+        if isinstance(channel, slice):
+            indices = range(*channel.indices(len(self._arrays)))
+        else:
+            indices = [self._channel_index(item) for item in channel]
+
+        return np.stack([self._arrays[index][rest] for index in indices]) if len(indices) else np.empty((0,) + self._arrays[0][rest].shape, dtype=self.dtype)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return np.stack(self._arrays).astype(dtype, copy=False) if dtype is not None else np.stack(self._arrays)
+
+    def _channel_index(self, channel) -> int:
+        if isinstance(channel, str):
+            if channel not in self._names:
+                raise KeyError(f"Unknown channel '{channel}', expected one of {self._names}.")
+            return self._names.index(channel)
+        return range(len(self._arrays))[channel]
+
+
+def transpose(filename: str, output: str = None, tile: int = _TRANSPOSE_TILE) -> str:
+    """
+    Write a node-major copy of a spatial report file, where each node's time series is contiguous.
+
+    The data is transposed in tiles of time steps and nodes so memory use does not depend on the size
+    of the report. SpatialReport(filename, mmap=True) and SpatialReport.read() use the copy, if it is
+    newer than the report, when it is faster, e.g. reading the time series of individual nodes.
+
+    Args:
+        filename: spatial report file
+        output: node-major file to write, defaults to the report filename with ".nodes" before the extension,
+            e.g. SpatialReport_Prevalence.nodes.bin, which is where SpatialReport looks for it
+        tile: number of time steps and of nodes in each tile
+
+    Returns:
+        Name of the node-major file.
+    """
+
+    num_nodes, num_time_steps, start, interval, node_ids, offset = _read_header(filename)
+    output = str(_node_major_path(filename)) if output is None else output
+    partial = output + ".partial"
+
+    # node-major file format:
+    # magic                - 8 bytes, "EMODSPN1"
+    # number of nodes      - uint32 * 1
+    # number of time steps - uint32 * 1
+    # starting time step   - float32 * 1
+    # time step interval   - float32 * 1
+    # node ids             - uint32 * number of nodes
+    # data                 - (float32 * number of time steps) * number of nodes
+    with open(partial, "wb") as file:
+        file.write(_NODE_MAJOR_MAGIC)
+        np.array([num_nodes, num_time_steps], dtype=np.uint32).tofile(file)
+        np.array([start, interval], dtype=np.float32).tofile(file)
+        node_ids.tofile(file)
+        data_offset = file.tell()
+        file.truncate(data_offset + num_nodes * num_time_steps * 4)
+
+    if num_nodes * num_time_steps > 0:
+        source = np.memmap(filename, dtype=np.float32, mode="r", offset=offset, shape=(num_time_steps, num_nodes))
+        target = np.memmap(partial, dtype=np.float32, mode="r+", offset=data_offset, shape=(num_nodes, num_time_steps))
+        for first in range(0, num_nodes, tile):
+            for step in range(0, num_time_steps, tile):
+                target[first:first + tile, step:step + tile] = source[step:step + tile, first:first + tile].T
+        target.flush()
+        del source, target
+
+    os.replace(partial, output)
+
+    return output
+
+
+def _node_major_path(filename: str) -> Path:
+    path = Path(filename)
+    return path.with_name(f"{path.stem}.nodes{path.suffix}")
+
+
+def _find_node_major(filename: str, node_ids: np.ndarray, num_time_steps: int):
+    """Return (filename, data offset) of an up-to-date node-major copy of filename, None if there isn't one."""
+
+    path = _node_major_path(filename)
+    try:
+        if path.stat().st_mtime_ns < Path(filename).stat().st_mtime_ns:
+            return None
+        with open(path, "rb") as file:
+            if file.read(len(_NODE_MAJOR_MAGIC)) != _NODE_MAJOR_MAGIC:
+                return None
+            counts = np.fromfile(file, dtype=np.uint32, count=2)
+            if (len(counts) != 2) or (counts[0] != len(node_ids)) or (counts[1] != num_time_steps):
+                return None
+            file.seek(8, os.SEEK_CUR)   # start and interval
+            if not np.array_equal(np.fromfile(file, dtype=np.uint32, count=len(node_ids)), node_ids):
+                return None
+            offset = file.tell()
+    except OSError:
+        return None
+
+    if path.stat().st_size != offset + len(node_ids) * num_time_steps * 4:
+        return None
+
+    return str(path), offset
+
+
+def _read_header(filename: str) -> tuple:
+    """
+    Read the header of a binary spatial report file.
+
+    Returns:
+        (number of nodes, number of time steps, start, interval, node ids, byte offset of the data)
+    """
+    # File format:
+    # number of nodes      - uint32 * 1
+    # number of time steps - uint32 * 1
+    # OPTIONAL:
+    #     starting time step - float32 * 1 (integral value in reality)
+    #     time step interval - float32 * 1 (integral value in reality)
+    # node ids             - uint32 * number of nodes
+    # data                 - (float32 * number of nodes) * number of time_steps
+
+    file_size = Path(filename).stat().st_size
+
+    with open(filename, "rb") as file:
+        num_nodes = int(np.fromfile(file, dtype=np.uint32, count=1)[0])
+        num_time_steps = int(np.fromfile(file, dtype=np.uint32, count=1)[0])
+
+        simple_size = (2 + num_nodes + (num_nodes * num_time_steps)) * 4    # num_nodes, num_time_steps, node_ids, and data
+        filtered_size = simple_size + 8     # include starting time step and time step interval
+
+        if file_size == simple_size:
+            start = 0
+            interval = 1
+        elif file_size == filtered_size:
+            start = int(np.fromfile(file, dtype=np.float32, count=1)[0])
+            interval = int(np.fromfile(file, dtype=np.float32, count=1)[0])
+            assert start >= 0
+            assert interval >= 1
+        else:
+            raise RuntimeError(f"Unexpected file size {file_size}, expected {simple_size} (standard spatial report) or {filtered_size} (filtered spatial report).")
+
+        node_ids = np.fromfile(file, dtype=np.uint32, count=num_nodes)
+        offset = file.tell()
+
+    return num_nodes, num_time_steps, start, interval, node_ids, offset
+
+
+def _search(sorted_ids: np.ndarray, order: np.ndarray, node_ids: np.ndarray, source: str = None) -> np.ndarray:
+    """Return the index (into the unsorted ids) of each of node_ids, raising KeyError for node IDs which aren't found."""
+
+    found = np.minimum(np.searchsorted(sorted_ids, node_ids), len(sorted_ids) - 1)
+    missing = node_ids[sorted_ids[found] != node_ids]
+    if len(missing):
+        raise KeyError(f"Node IDs {missing.tolist()} are not in {repr(source) if source else 'the report'}.")
+
+    return order[found]
+
+
 def _is_iterable(obj) -> bool:
     try:
         _ = iter(obj)
         return True
     except TypeError:
         return False
-
-
-def _isinteger(item) -> bool:
-    return isinstance(item, (int, np.integer))
@@ -0,0 +1,47 @@
+"""Mapping a function over many items (e.g. report files) in worker processes, shared by channel and spatial reports."""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import os
+from typing import Callable, Iterable
+
+
+def parallel_map(function: Callable, items: Iterable, workers: int = None, *args):
+    """
+    Yield the index and result of function(item, *args) for each item, in completion order if run in worker processes.
+
+    Only a bounded number of items (twice the number of workers) are in flight at a time, so results do not pile up
+    in memory faster than they are consumed.
+
+    Args:
+        function: picklable function, e.g. at module level, called as function(item, *args)
+        items: items to map function over
+        workers: number of worker processes, defaults to the number of CPUs, 1 runs function in this process, in order
+        args: additional arguments passed to each call of function
+
+    Returns:
+        Generator of (index of item, result) tuples.
+    """
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        for index, item in enumerate(items):
+            yield index, function(item, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        items = enumerate(items)
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * workers:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    pending[executor.submit(function, item[1], *args)] = item[0]
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+    return
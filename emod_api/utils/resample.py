@@ -0,0 +1,67 @@
+"""Downsampling of time series by combining consecutive values, shared by channel reports, spatial reports, and weather files."""
+
+import numpy as np
+
+SUM = "sum"
+MEAN = "mean"
+LAST = "last"
+MIN = "min"
+MAX = "max"
+
+HOW = [SUM, MEAN, LAST, MIN, MAX]
+
+_BLOCK = 1 << 24    # approximate bytes of input reduced at a time
+
+
+def resample(values, steps: int, how: str = SUM, axis: int = 0) -> np.ndarray:
+    """
+    Combine each run of steps consecutive values along axis with "sum", "mean", "last", "min", or "max".
+
+    A final, shorter run is combined from the values available. Values are reduced a block of runs at a time,
+    so memory mapped arrays are not read into memory all at once.
+
+    Args:
+        values: array (or list) of values, e.g. time series with time on axis
+        steps: number of consecutive values to combine
+        how: "sum", "mean", "last", "min", or "max"
+        axis: time axis of values
+
+    Returns:
+        Array with ceil(length / steps) values along axis, floating point arrays keep their type, other
+        values are returned as float64.
+    """
+
+    assert how in HOW, f"how must be one of {HOW}, got '{how}'."
+    assert steps >= 1, "steps must be >= 1"
+    values = values if isinstance(values, np.ndarray) else np.asarray(values, dtype=np.float64)
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+    moved = np.moveaxis(values, axis, 0)
+    length = moved.shape[0]
+
+    results = np.empty((-(-length // steps),) + moved.shape[1:], dtype=dtype)
+    row_bytes = max(1, moved[:1].nbytes)
+    block = max(1, _BLOCK // (row_bytes * steps)) * steps
+    for first in range(0, length, block):
+        chunk = np.asarray(moved[first:first + block], dtype=np.float64)
+        results[first // steps:(first + len(chunk) + steps - 1) // steps] = _reduce(chunk, steps, how)
+
+    return np.moveaxis(results, 0, axis)
+
+
+def _reduce(values: np.ndarray, steps: int, how: str) -> np.ndarray:
+
+    starts = np.arange(0, len(values), steps)
+
+    if how == LAST:
+        return values[np.minimum(starts + steps, len(values)) - 1]
+    if how == MIN:
+        return np.minimum.reduceat(values, starts, axis=0)
+    if how == MAX:
+        return np.maximum.reduceat(values, starts, axis=0)
+
+    totals = np.add.reduceat(values, starts, axis=0)
+    if how == MEAN:
+        counts = np.diff(np.append(starts, len(values))).reshape((-1,) + (1,) * (values.ndim - 1))
+        totals = totals / counts
+
+    return totals
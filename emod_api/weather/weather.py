@@ -12,6 +12,8 @@ import getpass
 import json
 import numpy as np
 
+from emod_api.utils.resample import MEAN, resample as _resample
+
 
 IDREF_LEGACY = "Legacy"
 IDREF_GRUMP30ARCSEC = "Gridded world grump30arcsec"
@@ -24,6 +26,12 @@ CLIMATE_UPDATE_WEEK = "CLIMATE_UPDATE_WEEK"
 CLIMATE_UPDATE_DAY = "CLIMATE_UPDATE_DAY"
 CLIMATE_UPDATE_HOUR = "CLIMATE_UPDATE_HOUR"
 
+# update resolution after combining data values, (resolution, values combined) -> resolution
+_RESAMPLED_RESOLUTION = {
+    (CLIMATE_UPDATE_HOUR, 24): CLIMATE_UPDATE_DAY,
+    (CLIMATE_UPDATE_DAY, 7): CLIMATE_UPDATE_WEEK,
+}
+
 
 class WeatherNode(object):
     """Represents information for a single node: ID and timeseries data."""
@@ -342,6 +350,39 @@ class Weather(object):
 
         return
 
+    def resample(self, interval: int, how: str = MEAN, frequency: str = None):
+        """
+        Combine each run of interval consecutive data values, e.g. weekly means of daily air temperature.
+        A final, shorter run is combined from the values available.
+
+        Args:
+            interval: number of data values to combine
+            how: "mean", "sum", "max", "min", or "last"
+            frequency: update resolution of the new weather, e.g. CLIMATE_UPDATE_WEEK, may be omitted when
+                combining 24 hourly values or 7 daily values
+
+        Returns:
+            Weather with the same nodes and metadata and ceil(datavalue_count / interval) data values.
+        """
+
+        if frequency is None:
+            key = (self.update_resolution, int(interval))
+            if key not in _RESAMPLED_RESOLUTION:
+                raise ValueError(f"frequency is required to resample {self.update_resolution} weather by {interval}.")
+            frequency = _RESAMPLED_RESOLUTION[key]
+
+        data = _resample(self._data, int(interval), how, axis=1)
+
+        return Weather(
+            node_ids=self.node_ids,
+            datavalue_count=data.shape[1],
+            author=self.author,
+            frequency=frequency,
+            provenance=self.provenance,
+            reference=self.id_reference,
+            data=np.ascontiguousarray(data, dtype=np.float32),
+        )
+
     def _from_file(self, filename: str):
         """Reads metadata from filename.json and data from filename."""
         self._metadata = Metadata.from_file(filename + ".json")
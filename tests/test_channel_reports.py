@@ -3,11 +3,15 @@ import os
 import csv
 from pathlib import Path
 import tempfile
-from emod_api.channelreports.channels import ChannelReport, Header, Channel
+from emod_api.channelreports.channels import ChannelReport, Header, Channel, ARROW_SUPPORT, write_csv
 from emod_api.channelreports.plot_prop_report import prop_report_json_to_csv
+from emod_api.channelreports.ensemble import aggregate, RunningStatistics, StreamingQuantiles
+from emod_api.channelreports import plot_icj_means
+from emod_api.channelreports import derived
 from datetime import datetime
 from random import random, randint
 import json
+import numpy as np
 from tests import manifest
 
 
@@ -420,6 +424,355 @@ class TestChannels(unittest.TestCase):
 
         return
 
+    def test_fromFileSelectedChannels(self):
+
+        filename = os.path.join(manifest.reports_folder, "InsetChart.json")
+        full = ChannelReport(filename)
+        chart = ChannelReport(filename, channels=["Statistical Population", "Infected"])
+        self.assertEqual(chart.header.num_time_steps, 365)
+        self.assertListEqual(chart.channel_names, ["Infected", "Statistical Population"])
+        self.assertEqual(chart.data.shape, (2, 365))
+        for name in chart.channel_names:
+            self.assertEqual(chart[name].units, full[name].units)
+            self.assertTrue(np.array_equal(chart[name].data, full[name].data))
+
+        # Requested channels must be in the file
+        with self.assertRaises(AssertionError):
+            ChannelReport(filename, channels=["Infected", "Not A Channel"])
+
+        # The header is still validated, channels are validated if requested
+        for bad in ["missingHeader.json", "missingChannels.json"]:
+            with self.assertRaises(AssertionError):
+                ChannelReport(os.path.join(manifest.reports_folder, bad), channels=[])
+        with self.assertRaises(AssertionError):
+            ChannelReport(os.path.join(manifest.reports_folder, "missingUnits.json"), channels=["Births"])
+
+        return
+
+    def test_binaryRoundTrip(self):
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        with tempfile.TemporaryDirectory() as temp:
+            filename = Path(temp) / "InsetChart.bin"
+            chart.to_binary(filename)
+            for mmap in [True, False]:
+                binary = ChannelReport.from_binary(filename, mmap=mmap)
+                self.assertEqual(binary.header.as_dictionary(), chart.header.as_dictionary())
+                self.assertListEqual(list(binary.channels), list(chart.channels))
+                self.assertEqual(binary["Births"].units, "Births")
+                self.assertTrue(np.array_equal(binary.data, chart.data))
+            self.assertIsInstance(ChannelReport.from_binary(filename).data, np.memmap)
+
+            # Changes to memory-mapped data are not written to the file
+            binary = ChannelReport.from_binary(filename)
+            binary["Infected"][0] = 42
+            self.assertEqual(binary.data[list(binary.channels).index("Infected"), 0], 42)
+            self.assertEqual(ChannelReport.from_binary(filename)["Infected"][0], chart["Infected"][0])
+
+            float32 = Path(temp) / "InsetChart32.bin"
+            chart.to_binary(float32, dtype=np.float32)
+            self.assertEqual(ChannelReport.from_binary(float32).data.dtype, np.float32)
+            self.assertTrue(np.allclose(ChannelReport.from_binary(float32).data, chart.data, rtol=1e-6))
+
+            with self.assertRaises(AssertionError):
+                ChannelReport.from_binary(os.path.join(manifest.reports_folder, "InsetChart.json"))
+
+        return
+
+    def test_cache(self):
+
+        with tempfile.TemporaryDirectory() as temp:
+            source = Path(temp) / "InsetChart.json"
+            source.write_bytes(Path(manifest.reports_folder, "InsetChart.json").read_bytes())
+            cache = Path(temp) / "cache"
+
+            chart = ChannelReport(str(source), cache=cache)
+            self.assertEqual(len(list(cache.glob("*.bin"))), 1)
+            self.assertTrue(np.array_equal(chart.data, ChannelReport(str(source)).data))
+
+            cached = ChannelReport(str(source), cache=str(cache), channels=["Infected"])
+            self.assertIsInstance(cached["Infected"].data, np.memmap)
+            self.assertListEqual(cached.channel_names, ["Infected"])
+            self.assertEqual(len(list(cache.glob("*.bin"))), 1)
+
+            # A modified source file gets a new cache entry
+            jason = json.loads(source.read_text())
+            jason["Channels"]["Infected"]["Data"][0] = 0.25
+            source.write_text(json.dumps(jason))
+            os.utime(source, ns=(0, 0))
+            self.assertEqual(ChannelReport(str(source), cache=cache)["Infected"][0], 0.25)
+            self.assertEqual(len(list(cache.glob("*.bin"))), 2)
+
+        return
+
+    def test_writeFileMatchesJson(self):
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        chart.channels["Integers"] = Channel("Integers", "units", list(range(365)))
+        chart.channels["Not a number"] = Channel("Not a number", "units", np.full(365, np.nan))
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = Path(temp) / "chart.json"
+            for indent in [0, None, 2, "\t"]:
+                for separators in [(",", ":"), (", ", ": "), None]:
+                    chart.write_file(str(filename), indent=indent, separators=separators)
+                    jason = {"Header": chart.header.as_dictionary(),
+                             "Channels": {title: channel.as_dictionary()[title] for title, channel in chart.channels.items()}}
+                    self.assertEqual(filename.read_text(), json.dumps(jason, indent=indent, separators=separators), f"{indent=}, {separators=}")
+
+            chart.write_file(str(filename), float_format="%.4g")
+            compact = ChannelReport(str(filename))
+            self.assertEqual(compact["Infected"][10], float("%.4g" % chart["Infected"][10]))
+            self.assertTrue(np.all(np.isnan(compact["Not a number"].data)))
+
+        return
+
+    def test_toCsv(self):
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        chart.channels["Counts, Integer"] = Channel("Counts, Integer", "units", list(range(365)))
+        chart.channels["Float32"] = np.arange(365, dtype=np.float32) / 7
+        names = ["Infected", "Births", "Counts, Integer", "Float32"]
+
+        def expected(name):
+            return [str(value) for value in (chart[name].data if name != "Float32" else chart[name])]
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = Path(temp) / "chart.csv"
+            chart.to_csv(filename, channel_names=names)
+            with filename.open() as handle:
+                rows = list(csv.reader(handle))
+            self.assertListEqual([row[0] for row in rows], names)
+            for row in rows:
+                self.assertListEqual(row[1:], expected(row[0]))
+
+            chart.to_csv(filename, channel_names=names, transpose=True)
+            with filename.open() as handle:
+                rows = list(csv.reader(handle))
+            self.assertListEqual(rows[0], names)
+            self.assertEqual(len(rows), 366)
+            for column, name in enumerate(names):
+                self.assertListEqual([row[column] for row in rows[1:]], expected(name))
+
+            chart.to_csv(filename, channel_names=["Infected"], transpose=True, float_format="%.3g")
+            with filename.open() as handle:
+                rows = list(csv.reader(handle))
+            self.assertListEqual([row[0] for row in rows[1:]], ["%.3g" % value for value in chart["Infected"].data])
+
+            with self.assertRaises(ValueError):
+                write_csv(filename, ["a", "b"], [np.arange(3), np.arange(2)], transpose=True)
+
+        return
+
+    @unittest.skipUnless(ARROW_SUPPORT, "requires pyarrow")
+    def test_toParquet(self):
+
+        import pyarrow.parquet as parquet
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        with tempfile.TemporaryDirectory() as temp:
+            filename = Path(temp) / "chart.parquet"
+            chart.to_parquet(filename, channel_names=["Infected", "Births"])
+            table = parquet.read_table(filename)
+            self.assertListEqual(table.column_names, ["Infected", "Births"])
+            self.assertTrue(np.array_equal(table.column("Births").to_numpy(), chart["Births"].data))
+
+        return
+
+    def test_derivedChannels(self):
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        infected = np.array(chart["Infected"].data)
+        population = np.array(chart["Statistical Population"].data)
+        births = np.array(chart["Births"].data)
+
+        calls = []
+
+        def prevalence(report):
+            calls.append(1)
+            return derived.ratio("Infected", "Statistical Population")(report)
+
+        chart.derive("Prevalence", prevalence, units="fraction")
+        chart.derive("Prevalence 7", derived.rolling_mean("Prevalence", 7))
+        chart.derive("Total Births", derived.cumulative_sum("Births"))
+        chart.derive("Weekly Births", derived.resample("Births", 7))
+        chart.derive("Weekly Prevalence", derived.resample("Prevalence", 7, how="mean"))
+
+        self.assertListEqual(chart.derived_names, ["Prevalence", "Prevalence 7", "Total Births", "Weekly Births", "Weekly Prevalence"])
+        self.assertNotIn("Prevalence", chart.channels)
+        self.assertEqual(calls, [])    # nothing evaluated yet
+
+        self.assertTrue(np.allclose(chart["Prevalence"].data, infected / population))
+        self.assertEqual(chart["Prevalence"].units, "fraction")
+        self.assertTrue(np.allclose(chart["Prevalence 7"].data[6:], np.convolve(infected / population, np.ones(7), "valid") / 7))
+        self.assertAlmostEqual(chart["Prevalence 7"].data[1], np.mean(infected[:2] / population[:2]))
+        self.assertTrue(np.allclose(chart["Total Births"].data, np.cumsum(births)))
+        self.assertEqual(len(chart["Weekly Births"].data), 53)    # 52 weeks and one day
+        self.assertEqual(chart["Weekly Births"].data[1], births[7:14].sum())
+        self.assertEqual(chart["Weekly Births"].data[52], births[364])
+        self.assertAlmostEqual(chart["Weekly Prevalence"].data[0], np.mean(infected[:7] / population[:7]))
+        self.assertEqual(len(calls), 1)    # cached
+
+        chart.derive("Prevalence", prevalence)
+        _ = chart["Prevalence 7"]
+        self.assertEqual(len(calls), 2)    # re-registering clears the cache
+
+        with self.assertRaises(AssertionError):
+            chart.derive("Infected", derived.cumulative_sum("Births"))
+        chart.derive("Monthly", derived.resample("Births", 10.5))
+        with self.assertRaises(AssertionError):
+            _ = chart["Monthly"]
+
+        self.assertTrue(np.array_equal(derived.resample_of([1, 5, 2, 4, 3], 2, "max"), [5, 4, 3]))
+        self.assertTrue(np.array_equal(derived.resample_of([1, 5, 2, 4, 3], 2, "last"), [5, 4, 3]))
+        self.assertTrue(np.array_equal(derived.resample_of([1, 5, 2, 4, 3], 2, "min"), [1, 2, 3]))
+
+        return
+
+    def test_dataArray(self):
+
+        chart = ChannelReport(os.path.join(manifest.reports_folder, "InsetChart.json"))
+        self.assertEqual(chart.data.shape, (16, 365))
+        self.assertEqual(chart.data.dtype, np.float64)
+
+        # Channel data are views of rows of the report's array
+        infected = chart.channels["Infected"]
+        row = list(chart.channels.keys()).index("Infected")
+        self.assertTrue(np.shares_memory(infected.data, chart.data))
+        infected[10] = 0.5
+        self.assertEqual(chart.data[row, 10], 0.5)
+        self.assertEqual(chart.channels["Infected"].as_dictionary()["Infected"]["Data"][10], 0.5)
+
+        # Channels added to the report are consolidated into a new array
+        chart.channels["Extra"] = Channel("Extra", "units", list(range(365)))
+        self.assertEqual(chart.data.shape, (17, 365))
+        self.assertTrue(np.shares_memory(chart.channels["Extra"].data, chart.data))
+        self.assertEqual(chart.data[row, 10], 0.5)
+        self.assertEqual(chart.data[16, 364], 364)
+
+        chart.channels["Short"] = Channel("Short", "units", [1, 2, 3])
+        with self.assertRaises(AssertionError):
+            _ = chart.data
+
+        return
+
+
+class TestEnsemble(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # An "experiment" of three simulations with different lengths (365, 300, 200 time steps)
+        cls.temp = tempfile.TemporaryDirectory()
+        cls.experiment = Path(cls.temp.name) / "experiment"
+        with open(os.path.join(manifest.reports_folder, "InsetChart.json")) as handle:
+            cls.source = json.load(handle)
+        cls.paths = []
+        for index, length in enumerate([365, 300, 200]):
+            jason = json.loads(json.dumps(cls.source))
+            jason["Header"]["Timesteps"] = length
+            for channel in jason["Channels"].values():
+                channel["Data"] = [value * (index + 1) for value in channel["Data"][:length]]
+            path = cls.experiment / f"sim{index}" / "InsetChart.json"
+            path.parent.mkdir(parents=True)
+            path.write_text(json.dumps(jason))
+            cls.paths.append(path)
+        (cls.experiment / "results.db").touch()
+
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp.cleanup()
+        return
+
+    def test_aggregate(self):
+
+        results = aggregate(self.paths, ["Births", "Infected"], stats=["mean", "std", "min", "max", "quantiles"], workers=1)
+        births = np.array(self.source["Channels"]["Births"]["Data"])
+        self.assertListEqual(list(results["Births"]["count"][[0, 250, 350]]), [3, 2, 1])
+        self.assertTrue(np.allclose(results["Births"]["mean"][:200], births[:200] * 2))
+        self.assertTrue(np.allclose(results["Births"]["mean"][200:300], births[200:300] * 1.5))
+        self.assertTrue(np.allclose(results["Births"]["mean"][300:], births[300:]))
+        self.assertTrue(np.allclose(results["Births"]["std"][:200], births[:200] * np.std([1, 2, 3])))
+        self.assertTrue(np.allclose(results["Births"]["max"][:200], births[:200] * 3))
+        self.assertEqual(results["Births"]["quantiles"].shape, (3, 365))
+        self.assertTrue(np.allclose(results["Births"]["quantiles"][1, :200], births[:200] * 2))
+
+        parallel = aggregate(self.paths, ["Births", "Infected"], stats=["mean", "std", "min", "max", "quantiles"], workers=2)
+        for channel in ["Births", "Infected"]:
+            for stat in ["count", "mean", "std", "min", "max", "quantiles"]:
+                self.assertTrue(np.allclose(results[channel][stat], parallel[channel][stat], equal_nan=True), f"{channel} {stat}")
+
+        with self.assertRaises(ValueError):
+            aggregate(self.paths, ["Births"], stats=["median"])
+
+        return
+
+    def test_stack(self):
+
+        array, mask = ChannelReport.stack(self.paths, ["Births", "Infected"], workers=1)
+        births = np.array(self.source["Channels"]["Births"]["Data"])
+        self.assertEqual(array.shape, (3, 2, 365))
+        self.assertListEqual(list(mask.sum(axis=1)), [365, 300, 200])
+        self.assertTrue(np.array_equal(array[1, 0, :300], births[:300] * 2))
+        self.assertTrue(np.all(np.isnan(array[2, :, 200:])))
+        self.assertFalse(np.any(np.isnan(array[mask[:, None, :].repeat(2, axis=1)])))
+
+        parallel, parallel_mask = ChannelReport.stack(self.paths, ["Births", "Infected"], workers=2)
+        self.assertTrue(np.array_equal(array, parallel, equal_nan=True))
+        self.assertTrue(np.array_equal(mask, parallel_mask))
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = Path(temp) / "ensemble.npy"
+            mapped, _ = ChannelReport.stack(self.paths, ["Births", "Infected"], workers=1, filename=filename)
+            self.assertIsInstance(mapped, np.memmap)
+            del mapped
+            reopened = np.load(filename, mmap_mode="r")
+            self.assertTrue(np.array_equal(reopened, array, equal_nan=True))
+            del reopened
+
+        return
+
+    def test_streamingStatistics(self):
+
+        rng = np.random.default_rng(20240101)
+        series = [rng.normal(size=(rng.integers(50, 100), 2)) for _ in range(2000)]
+        moments = RunningStatistics()
+        sketch = StreamingQuantiles([0.1, 0.5, 0.9])
+        for values in series:
+            moments.update(values)
+            sketch.update(values)
+
+        for step in [0, 75]:
+            values = np.array([s[step] for s in series if len(s) > step])
+            self.assertEqual(moments.count[step], len(values))
+            self.assertTrue(np.allclose(moments.mean[step], values.mean(axis=0)))
+            self.assertTrue(np.allclose(moments.std()[step], values.std(axis=0)))
+            expected = np.quantile(values, [0.1, 0.5, 0.9], axis=0)
+            self.assertTrue(np.allclose(sketch.quantiles[:, step], expected, atol=0.1))
+
+        # Exact for fewer than five values
+        sketch = StreamingQuantiles([0.5])
+        for value in [3.0, 1.0, 2.0]:
+            sketch.update([value])
+        self.assertEqual(sketch.quantiles[0, 0], 2.0)
+
+        with self.assertRaises(ValueError):
+            StreamingQuantiles([0.0, 0.5])
+
+        return
+
+    def test_plotIcjMeansSummarize(self):
+
+        summary = plot_icj_means.summarize(str(self.experiment), "Births", smoothing=False, workers=1)
+        with self.assertWarns(DeprecationWarning):
+            collected = plot_icj_means.collect(str(self.experiment), "Births", smoothing=False, workers=1)
+        # collect() pads shorter simulations with zeros, summarize() does not
+        self.assertTrue(np.allclose(summary["ref"]["mean"][:200], np.mean(collected["ref"], axis=0)[:200]))
+        self.assertListEqual(list(summary["ref"]["count"][[0, 250, 350]]), [3, 2, 1])
+
+        return
+
 
 class TestPropReport(unittest.TestCase):
     @classmethod
@@ -1,10 +1,12 @@
 from functools import reduce
+import json
 from pathlib import Path
 import os
 import tempfile
 import unittest
 
 from emod_api.channelreports.utils import property_report_to_csv, read_json_file, get_report_channels, accumulate_channel_data, save_to_csv, plot_traces
+from emod_api.channelreports.channels import PropertyReport
 from emod_api.channelreports.utils import __get_trace_name as utils__get_trace_name, __index_for as utils__index_for, __title_for as utils__title_for
 
 import numpy as np
@@ -243,6 +245,117 @@ class TestPublicApi(unittest.TestCase):
         return
 
 
+class TestPropertyReport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # The truncated report's header still counts all the channels and time steps of the original report
+        with open(os.path.join(manifest.proprep_folder, "propertyReportTruncated.json")) as handle:
+            cls.jason = json.load(handle)
+        cls.jason["Header"]["Channels"] = len(cls.jason["Channels"])
+        cls.jason["Header"]["Timesteps"] = len(next(iter(cls.jason["Channels"].values()))["Data"])
+        cls.temp = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.temp.name, "PropertyReport.json")
+        with open(cls.filename, "w") as handle:
+            json.dump(cls.jason, handle)
+
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp.cleanup()
+        return
+
+    def test_index(self):
+
+        report = PropertyReport(self.filename)
+        self.assertListEqual(report.names, ["Infected", "New Infections", "Statistical Population"])
+        self.assertListEqual(list(report.ips), ["Age_Bin", "QualityOfCare", "QualityOfCare1", "QualityOfCare2"])
+        self.assertEqual(len(report.ips["Age_Bin"]), 4)
+        self.assertListEqual(report.ips["QualityOfCare"], ["High", "Low", "None"])
+
+        # Reading selects channels by name
+        infected = PropertyReport(self.filename, channels=["Infected"])
+        self.assertEqual(infected.num_channels, 108)
+        self.assertListEqual(infected.names, ["Infected"])
+
+        return
+
+    def test_group_by(self):
+
+        report = PropertyReport(self.filename)
+        channels = self.jason["Channels"]
+
+        def expected(name, **ips):
+            rows = [channel["Data"] for title, channel in channels.items()
+                    if title.startswith(name + ":") and all(f"{ip}:{value}" in title.split(":", 1)[1].split(",") for ip, value in ips.items())]
+            return np.sum(rows, axis=0)
+
+        traces = report.group_by(["Infected", "Statistical Population"], [])
+        self.assertListEqual(list(traces), ["Infected", "Statistical Population"])
+        self.assertTrue(np.array_equal(traces["Infected"], expected("Infected")))
+
+        traces = report.group_by(["Infected"], ["QualityOfCare", "Age_Bin"])
+        self.assertEqual(len(traces), 12)
+        title = "Infected:Age_Bin:Age_Bin_Property_From_0_To_20,QualityOfCare:Low"
+        self.assertTrue(np.array_equal(traces[title], expected("Infected", Age_Bin="Age_Bin_Property_From_0_To_20", QualityOfCare="Low")))
+
+        traces = report.group_by(["New Infections"])
+        self.assertEqual(len(traces), 108)
+        title = "New Infections:Age_Bin:Age_Bin_Property_From_0_To_20,QualityOfCare:High,QualityOfCare1:Low,QualityOfCare2:None"
+        self.assertTrue(np.array_equal(traces[title], channels[title]["Data"]))
+
+        with self.assertRaises(ValueError):
+            report.group_by(["Infected"], ["NotAnIP"])
+        with self.assertRaises(ValueError):
+            report.group_by(["NotAChannel"], [])
+
+        # accumulate_channel_data() produces the same traces
+        trace_values = accumulate_channel_data(channels=["Infected"], verbose=False, groupby=["Age_Bin"], channel_data=channels)
+        grouped = report.group_by(["Infected"], ["Age_Bin"])
+        self.assertListEqual(list(trace_values), list(grouped))
+        for title, values in trace_values.items():
+            self.assertEqual(values.dtype, np.float32)
+            self.assertTrue(np.array_equal(values, grouped[title]))
+
+        return
+
+
+    def test_label_indexing(self):
+
+        report = PropertyReport(self.filename)
+        self.assertListEqual(report.dims, ["channel", "Age_Bin", "QualityOfCare", "QualityOfCare1", "QualityOfCare2", "time"])
+        self.assertEqual(report.array.shape, (3, 4, 3, 3, 3, 256))
+        # EMOD writes the full product of channels and IP values, so the array is a view of the report's data
+        self.assertTrue(np.shares_memory(report.array, report.data))
+
+        age_bin = "Age_Bin_Property_From_0_To_20"
+        infected = report["Infected", {"Age_Bin": age_bin}]
+        self.assertEqual(infected.shape, (256,))
+        self.assertTrue(np.array_equal(infected, report.group_by(["Infected"], ["Age_Bin"])[f"Infected:Age_Bin:{age_bin}"]))
+
+        selected = report[["Infected", "New Infections"], {"Age_Bin": age_bin, "QualityOfCare": ["Low", "High"]}]
+        self.assertEqual(selected.shape, (2, 2, 256))
+        self.assertTrue(np.array_equal(selected[0, 1], report.group_by(["Infected"], ["Age_Bin", "QualityOfCare"])[f"Infected:Age_Bin:{age_bin},QualityOfCare:High"]))
+        self.assertTrue(np.array_equal(report["Infected", {}], report.group_by(["Infected"], [])["Infected"]))
+
+        title = f"Infected:Age_Bin:{age_bin},QualityOfCare:High,QualityOfCare1:High,QualityOfCare2:High"
+        self.assertEqual(report[title].title, title)
+        self.assertEqual(report["Infected", {"Age_Bin": age_bin, "QualityOfCare": "High", "QualityOfCare1": "High", "QualityOfCare2": "High"}][10], report[title][10])
+
+        with self.assertRaises(KeyError):
+            _ = report["Infected", {"NotAnIP": "High"}]
+        with self.assertRaises(KeyError):
+            _ = report["Infected", {"QualityOfCare": "Medium"}]
+
+        # Reports missing some combinations are scattered into a new array with zeros
+        del report.channels[title]
+        self.assertFalse(np.shares_memory(report.array, report.data))
+        self.assertEqual(report["Infected", {"Age_Bin": age_bin, "QualityOfCare": "High", "QualityOfCare1": "High", "QualityOfCare2": "High"}][10], 0)
+
+        return
+
+
 class TestInternalApi(unittest.TestCase):
 
     def test__get_trace_name(self):
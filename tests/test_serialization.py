@@ -9,6 +9,11 @@ import time
 import emod_api.serialization.dtk_file_tools as dft
 import emod_api.serialization.dtk_file_support as support
 import emod_api.serialization.serialized_population as SerPop
+import emod_api.serialization.dtk_file_utility as utility
+import emod_api.serialization.benchmark as benchmark
+from emod_api.serialization.population_generator import PopulationGenerator
+import argparse
+import json
 from tests import manifest
 
 skip_tests = False
@@ -1564,6 +1569,288 @@ class TestReadVersion6(unittest.TestCase):
         if os.path.exists(output_file):
             os.remove(output_file)
 
+    def test_node_to_dict(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        node = dft.read(input_file).nodes[0]
+        data = node.to_dict()
+        self.assertNotIn('individualHumans', data)
+        self.assertNotIn('_node_chunk', data)
+        self.assertEqual(node.suid, data['suid'])
+        json.dumps(data)
+
+    def test_chunk_compressed(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        dtk_file = dft.read(input_file)
+        for chunk in [dtk_file._sim_chunk, dtk_file._human_chunks[0]]:
+            loaded = chunk.chunk is None
+            data, engine = chunk.compressed()
+            self.assertEqual(loaded, chunk.chunk is None)
+            contents = json.loads(dft.uncompress(data, engine))
+            self.assertIn('human_collection' if chunk is dtk_file._human_chunks[0] else 'nodes', contents)
+
+    def test_compression_of_empty_file(self):
+        dtk_file = dft.DtkFileV6()
+        dtk_file.compression = dft.LZ4
+        self.assertIsNone(dtk_file.compression)
+
+
+
+class TestDtkFileUtility(unittest.TestCase):
+
+    @staticmethod
+    def read_args(filename, prefix, **kwargs):
+        args = {'filename': filename, 'output': prefix, 'header': None, 'raw': False,
+                'unformatted': False, 'ndjson': False, 'jobs': 1}
+        args.update(kwargs)
+        return argparse.Namespace(**args)
+
+    def test_read_formatted_parallel_matches_serial(self):
+        input_file = os.path.join(manifest.serialization_folder, "baseline.dtk")
+        dtk_file = dft.read(input_file)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            serial = os.path.join(temp_dir, "serial")
+            parallel = os.path.join(temp_dir, "parallel")
+            utility.__do_read__(self.read_args(input_file, serial))
+            utility.__do_read__(self.read_args(input_file, parallel, jobs=2))
+            for index in range(dtk_file.chunk_count):
+                name = 'simulation' if index == 0 else f'node-{index:0>5}'
+                with open(f"{serial}.{name}.json") as handle:
+                    serial_obj = json.load(handle)
+                with open(f"{parallel}.{name}.json") as handle:
+                    parallel_obj = json.load(handle)
+                self.assertEqual(serial_obj, parallel_obj)
+                self.assertEqual(dtk_file.objects[index], serial_obj)
+
+    def test_read_ndjson(self):
+        input_file = os.path.join(manifest.serialization_folder, "baseline.dtk")
+        dtk_file = dft.read(input_file)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prefix = os.path.join(temp_dir, "baseline")
+            utility.__do_read__(self.read_args(input_file, prefix, ndjson=True, jobs=2))
+            for index, node in enumerate(dtk_file.nodes):
+                with open(f"{prefix}.node-{index + 1:0>5}.ndjson") as handle:
+                    lines = [json.loads(line) for line in handle]
+                self.assertEqual([], lines[0]['individualHumans'])
+                self.assertEqual(node.individualHumans, lines[1:])
+                self.assertEqual(node.suid, lines[0]['suid'])
+
+    def test_read_write_v6_round_trip(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        original = dft.read(input_file)
+        for ndjson in [False, True]:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                prefix = os.path.join(temp_dir, "state")
+                utility.__do_read__(self.read_args(input_file, prefix, ndjson=ndjson))
+                extension = 'ndjson' if ndjson else 'json'
+                files = sorted(os.listdir(temp_dir))
+                nodes = [os.path.join(temp_dir, name) for name in files
+                         if name.startswith("state.node-") and "humans" not in name]
+                humans = [os.path.join(temp_dir, name) for name in files if ".humans-" in name]
+                self.assertEqual(3, len(nodes))
+                self.assertEqual(len(original._human_chunks), len(humans))
+
+                output_file = os.path.join(temp_dir, "reassembled.dtk")
+                utility._write_v6(output_file, f"{prefix}.simulation.{extension}", nodes, humans, "author", "tool")
+                reassembled = dft.read(output_file)
+                self.assertEqual(6, reassembled.version)
+                self.assertEqual(original.simulation, reassembled.simulation)
+                self.assertEqual(len(original.nodes), len(reassembled.nodes))
+                for expected, actual in zip(original.nodes, reassembled.nodes):
+                    self.assertEqual(expected.suid, actual.suid)
+                    self.assertEqual(list(expected.individualHumans), list(actual.individualHumans))
+
+    def test_write_v6_unassigned_humans(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prefix = os.path.join(temp_dir, "state")
+            utility.__do_read__(self.read_args(input_file, prefix))
+            files = sorted(os.listdir(temp_dir))
+            nodes = [os.path.join(temp_dir, name) for name in files
+                     if name.startswith("state.node-") and "humans" not in name]
+            humans = [os.path.join(temp_dir, name) for name in files if ".humans-" in name]
+            output_file = os.path.join(temp_dir, "reassembled.dtk")
+            with self.assertRaises(ValueError):
+                utility._write_v6(output_file, f"{prefix}.simulation.json", nodes[1:], humans, "author", "tool")
+            self.assertFalse(os.path.exists(output_file))
+
+    def test_write_v6_verify_rejected(self):
+        args = argparse.Namespace(filename="out.dtk", simulation="sim.json", nodes=["node.json"], humans=[],
+                                  v6=True, verify=True)
+        with self.assertRaises(ValueError):
+            utility.__do_write__(args)
+
+@unittest.skipIf(not support.ZSTD_SUPPORT, "zstandard is not installed")
+class TestZstandard(unittest.TestCase):
+
+    def test_round_trip_with_dictionary(self):
+        input_file = os.path.join(manifest.serialization_folder, "baseline.dtk")
+        original = dft.read(input_file)
+        dictionary = dft.train_zstd_dictionary(original, dict_size=16384)
+        self.assertLessEqual(len(dictionary), 16384)
+
+        archive = dft.read(input_file)
+        archive.zstd_dictionary = dictionary
+        archive.compression = dft.ZSTD
+        self.assertLess(archive.byte_count, original.byte_count)
+        output_file = os.path.join(manifest.output_folder, "TestZstandard.baseline.dtk")
+        dft.write(archive, output_file)
+
+        self.assertIn('zstd_dictionaries', archive.header)
+        restored = dft.read(output_file)
+        self.assertEqual(dft.ZSTD, restored.compression)
+        self.assertEqual(original.simulation, restored.simulation)
+        for expected, actual in zip(original.nodes, restored.nodes):
+            self.assertEqual(expected, actual)
+        os.remove(output_file)
+
+    def test_v6_round_trip(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        original = dft.read(input_file)
+        archive = dft.read(input_file)
+        archive.compression = dft.ZSTD
+        self.assertEqual(dft.ZSTD, archive.compression)
+        archive.nodes[0].individualHumans = [archive.nodes[0].individualHumans[0]]
+        output_file = os.path.join(manifest.output_folder, "TestZstandard.state-00004-reduced.dtk")
+        dft.write(archive, output_file)
+
+        restored = dft.read(output_file)
+        self.assertEqual(set([dft.V6_COMPRESSION_STR_ZSTD]),
+                         set(restored.header.human_compressions + restored.header.node_compressions))
+        self.assertEqual(dft.V6_COMPRESSION_STR_ZSTD, restored.header.sim_compression)
+        self.assertEqual(original.simulation, restored.simulation)
+        self.assertEqual(1, len(restored.nodes[0].individualHumans))
+        self.assertEqual([len(node.individualHumans) for node in original.nodes][1:],
+                         [len(node.individualHumans) for node in restored.nodes][1:])
+        os.remove(output_file)
+
+    def test_dictionary_is_scoped_to_file(self):
+        input_file = os.path.join(manifest.serialization_folder, "baseline.dtk")
+        dictionary = dft.train_zstd_dictionary(dft.read(input_file), dict_size=16384)
+        with_dictionary = dft.read(input_file)
+        with_dictionary.zstd_dictionary = dictionary
+        support._zstd_compressor.cache_clear()
+        with_dictionary.compression = dft.ZSTD
+        self.assertEqual(1, support._zstd_compressor.cache_info().misses)   # one compressor for every chunk
+        without_dictionary = dft.read(input_file)
+        without_dictionary.compression = dft.ZSTD
+        self.assertEqual({support.Zstandard.dictionary_id(dictionary)},
+                         support.Zstandard.dictionary_ids(with_dictionary.chunks))
+        self.assertEqual(set(), support.Zstandard.dictionary_ids(without_dictionary.chunks))
+
+    def test_read_parallel_with_dictionary(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        original = dft.read(input_file)
+        archive = dft.read(input_file)
+        archive.zstd_dictionary = dft.train_zstd_dictionary(original, dict_size=16384)
+        archive.compression = dft.ZSTD
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_file = os.path.join(temp_dir, "archive.dtk")
+            dft.write(archive, archive_file)
+            prefix = os.path.join(temp_dir, "archive")
+            utility.__do_read__(TestDtkFileUtility.read_args(archive_file, prefix, jobs=2))
+            with open(f"{prefix}.node-00001.humans-00001.json") as handle:
+                humans = json.load(handle)['human_collection']
+        self.assertEqual(list(original.nodes[0].individualHumans)[:len(humans)], humans)
+
+    def test_v6_writer_dictionary(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        original = dft.read(input_file)
+        dictionary = dft.train_zstd_dictionary(original, dict_size=16384)
+        output_file = os.path.join(manifest.output_folder, "TestZstandard.test_v6_writer_dictionary.dtk")
+        with dft.DtkFileV6Writer(output_file, engine=dft.ZSTD, dictionary=dictionary) as writer:
+            writer.write_simulation(json.dumps(original.simulation))
+            writer.write_node(1, json.dumps({'suid': {'id': 1}, 'individualHumans': []}))
+            writer.write_human_collection(1, 1, json.dumps({'human_collection': [original.nodes[0].individualHumans[0]]}))
+
+        restored = dft.read(output_file)
+        self.assertEqual(1, len(restored.header['zstd_dictionaries']))
+        self.assertEqual(original.simulation, restored.simulation)
+        self.assertEqual([original.nodes[0].individualHumans[0]], list(restored.nodes[0].individualHumans))
+        os.remove(output_file)
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_synthesize(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for version in benchmark.VERSIONS:
+                filename = os.path.join(temp_dir, f"v{version}.dtk")
+                benchmark.synthesize(version, filename, num_nodes=2, num_humans=7, num_infections=2, collection_size=3)
+                dtk_file = dft.read(filename)
+                self.assertEqual(version, dtk_file.version)
+                self.assertEqual(2, len(dtk_file.nodes))
+                suids = []
+                for node in dtk_file.nodes:
+                    self.assertEqual(7, len(node['individualHumans']))
+                    for human in node['individualHumans']:
+                        self.assertEqual(2, len(human['infections']))
+                        suids.append(human['suid']['id'])
+                self.assertEqual(list(range(1, 15)), suids)
+
+    def test_run_and_compare(self):
+        results = benchmark.run(versions=[3, 6], num_nodes=2, num_humans=10, num_lookups=5, isolate=False)
+        self.assertEqual([3, 6], [entry['version'] for entry in results['results']])
+        self.assertEqual([dft.LZ4, benchmark.AUTO], [entry['engine'] for entry in results['results']])
+        self.assertEqual([dft.V6_COMPRESSION_STR_LZ4], results['results'][1]['chunk_compressions'])
+        for entry in results['results']:
+            for timing in benchmark.TIMINGS:
+                self.assertGreaterEqual(entry[timing], 0)
+            self.assertGreater(entry['file_bytes'], 0)
+        self.assertEqual([], benchmark.compare(results, results))
+
+        slower = json.loads(json.dumps(results))
+        slower['results'][0]['open_s'] = results['results'][0]['open_s'] * 2 + 1
+        self.assertEqual(1, len(benchmark.compare(slower, results)))
+
+class TestPopulationGenerator(unittest.TestCase):
+
+    def test_generate(self):
+        input_file = os.path.join(manifest.serialization_folder, "state-00004-reduced.dtk")
+        pop = SerPop.SerializedPopulation(input_file)
+        sim = pop.dtk.simulation
+        node_1 = pop.nodes[0]
+        node_2 = pop.nodes[1]
+        human = dict(node_1.individualHumans[0])
+        human['infections'] = [{'__class__': 'Infection', 'suid': {'id': 0}, 'duration': 1.5},
+                               {'__class__': 'Infection', 'suid': {'id': 0}, 'duration': 2.5}]
+        next_infection_suid = sim.infectionSuidGenerator.next_suid.id
+        human_generator = node_1.m_IndividualHumanSuidGenerator
+
+        output_file = os.path.join(manifest.output_folder, "TestPopulationGenerator.test_generate.dtk")
+        with PopulationGenerator(output_file, sim, human, collection_size=4, header=pop.dtk.header) as generator:
+            generator.add_node(node_1, 10, columns={'m_age': [float(age) for age in range(10)], 'm_gender': [0, 1] * 5})
+            generator.add_node(node_2, 3, suids=[1000, 1003, 1006])
+            with self.assertRaises(ValueError):
+                generator.add_node(node_2, 1)
+
+        generated = SerPop.SerializedPopulation(output_file)
+        self.assertEqual(2, len(generated.nodes))
+        self.assertEqual([4, 4, 2, 3], [int(num, 16) for num in generated.dtk.header.human_num_humans])
+
+        humans = list(generated.nodes[0].individualHumans)
+        self.assertEqual(10, len(humans))
+        expected_suids = [human_generator.next_suid.id + index * human_generator.numtasks for index in range(10)]
+        self.assertEqual(expected_suids, [h.suid.id for h in humans])
+        self.assertEqual([float(age) for age in range(10)], [h.m_age for h in humans])
+        self.assertEqual([0, 1] * 5, [h.m_gender for h in humans])
+        self.assertEqual(human['m_is_infected'], humans[3]['m_is_infected'])
+        infection_suids = [infection.suid.id for h in humans for infection in h.infections]
+        self.assertEqual(list(range(next_infection_suid, next_infection_suid + 20)), infection_suids)
+        self.assertEqual([1.5, 2.5], [infection.duration for infection in humans[0].infections])
+        self.assertEqual(expected_suids[-1] + human_generator.numtasks,
+                         generated.nodes[0].m_IndividualHumanSuidGenerator.next_suid.id)
+        self.assertEqual(expected_suids, [entry.key for entry in generated.nodes[0].home_individual_ids])
+        self.assertEqual(expected_suids, [entry.value.id for entry in generated.nodes[0].home_individual_ids])
+
+        humans = list(generated.nodes[1].individualHumans)
+        self.assertEqual([1000, 1003, 1006], [h.suid.id for h in humans])
+        self.assertEqual(human['m_age'], humans[0].m_age)
+        self.assertLess(1006, generated.nodes[1].m_IndividualHumanSuidGenerator.next_suid.id)
+        self.assertEqual([1000, 1003, 1006], [entry.key for entry in generated.nodes[1].home_individual_ids])
+        self.assertEqual(next_infection_suid + 26, generated.dtk.simulation.infectionSuidGenerator.next_suid.id)
+        self.assertEqual(sim.falciparumPfEMP1Vars, generated.dtk.simulation.falciparumPfEMP1Vars)
+        generated = None
+        gc.collect()
+        os.remove(output_file)
 
 
 if __name__ == "__main__":
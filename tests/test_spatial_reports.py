@@ -1,9 +1,17 @@
+import argparse
+import contextlib
+import io
 import unittest
+import unittest.mock
 import numpy as np
 import os
 import pathlib
+import shutil
 import tempfile
-from emod_api.spatialreports.spatial import SpatialReport, SpatialNode
+from emod_api.spatialreports.spatial import SpatialReport, SpatialReportSet, SpatialReportWriter, SpatialNode, transpose
+from emod_api.spatialreports.ensemble import aggregate
+from emod_api.spatialreports import plot_spat_means
+import emod_api.spatialreports.__main__ as cli
 
 from tests import manifest
 
@@ -186,3 +194,473 @@ class TestSpatial(unittest.TestCase):
         self.assertEqual(report.interval, SAMPLE_INTERVAL)
 
         return
+
+    def test_memoryMapped(self):
+
+        for name in ["SpatialReport_Prevalence.bin", "SpatialReportMalariaFiltered_Adult_Vectors.bin"]:
+            filename = os.path.join(manifest.spatrep_folder, name)
+            report = SpatialReport(filename)
+            mapped = SpatialReport(filename, mmap=True)
+
+            self.assertIsInstance(mapped.data, np.memmap)
+            self.assertFalse(mapped.data.flags.writeable)
+            self.assertEqual(mapped.data.shape, report.data.shape)
+            self.assertTrue(np.array_equal(mapped.data, report.data))
+            self.assertListEqual(mapped.node_ids, report.node_ids)
+            self.assertEqual(mapped.start, report.start)
+            self.assertEqual(mapped.interval, report.interval)
+
+            self.assertEqual(len(mapped._nodes), 0)     # nodes are created on first access
+            node_id = mapped.node_ids[-1]
+            self.assertIs(mapped[node_id], mapped[node_id])
+            self.assertTrue(np.array_equal(mapped[node_id].data, report[node_id].data))
+            self.assertEqual(len(mapped._nodes), 1)
+            self.assertEqual(len(mapped.nodes), report.node_count)
+
+            with self.assertRaises(ValueError):
+                mapped[node_id][0] = 1.0
+
+        return
+
+    def test_read(self):
+
+        filename = os.path.join(manifest.spatrep_folder, "SpatialReport_Prevalence.bin")
+        report = SpatialReport(filename)
+        columns = list(range(report.node_count))     # node_ids are in the order of the columns of data
+
+        subset = SpatialReport.read(filename)
+        self.assertTrue(np.array_equal(subset.data, report.data))
+
+        subset = SpatialReport.read(filename, steps=slice(180, 365))
+        self.assertEqual(subset.data.shape, (185, report.node_count))
+        self.assertTrue(np.array_equal(subset.data, report.data[180:365]))
+        self.assertEqual(subset.start, 180)
+        self.assertEqual(subset.interval, 1)
+
+        node_ids = [report.node_ids[1000], report.node_ids[7], report.node_ids[500]]
+        subset = SpatialReport.read(filename, node_ids=node_ids)
+        self.assertEqual(subset.data.shape, (report.time_steps, 3))
+        self.assertTrue(np.array_equal(subset.data, report.data[:, [columns[1000], columns[7], columns[500]]]))
+        self.assertTrue(np.array_equal(subset[node_ids[1]].data, report[node_ids[1]].data))
+
+        subset = SpatialReport.read(filename, steps=slice(10, 100, 7), node_ids=node_ids[:2])
+        self.assertTrue(np.array_equal(subset.data, report.data[10:100:7][:, [columns[1000], columns[7]]]))
+        self.assertEqual(subset.start, 10)
+        self.assertEqual(subset.interval, 7)
+
+        filtered = os.path.join(manifest.spatrep_folder, "SpatialReportMalariaFiltered_Adult_Vectors.bin")
+        subset = SpatialReport.read(filtered, steps=slice(2, None, 2))
+        self.assertTrue(np.array_equal(subset.data, SpatialReport(filtered).data[2::2]))
+        self.assertEqual(subset.start, 8 + 2 * 16)
+        self.assertEqual(subset.interval, 32)
+
+        with self.assertRaises(KeyError):
+            SpatialReport.read(filename, node_ids=[report.node_ids[0], 42])
+
+        return
+
+    def test_transpose(self):
+
+        report = SpatialReport(os.path.join(manifest.spatrep_folder, "SpatialReportMalariaFiltered_Adult_Vectors.bin"))
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "SpatialReport_Adult_Vectors.bin")
+            shutil.copyfile(os.path.join(manifest.spatrep_folder, "SpatialReportMalariaFiltered_Adult_Vectors.bin"), filename)
+
+            self.assertIsNone(SpatialReport(filename, mmap=True)._by_node)
+            output = transpose(filename, tile=100)     # several partial tiles
+            self.assertEqual(output, os.path.join(temp, "SpatialReport_Adult_Vectors.nodes.bin"))
+
+            mapped = SpatialReport(filename, mmap=True)
+            self.assertIsNotNone(mapped._by_node)
+            self.assertTrue(np.array_equal(mapped._by_node, report.data.T))
+            self.assertTrue(np.array_equal(mapped.data, report.data))
+            node_id = mapped.node_ids[1234]
+            self.assertTrue(mapped[node_id].data.flags.c_contiguous)
+            self.assertTrue(np.array_equal(mapped[node_id].data, report[node_id].data))
+            self.assertEqual(mapped.start, report.start)
+            self.assertEqual(mapped.interval, report.interval)
+
+            node_ids = [report.node_ids[1400], report.node_ids[0], report.node_ids[700]]
+            columns = [report.node_ids.index(node_id) for node_id in node_ids]
+            subset = SpatialReport.read(filename, steps=slice(5, 40, 3), node_ids=node_ids)    # reads the node-major copy
+            self.assertTrue(np.array_equal(subset.data, report.data[5:40:3][:, columns]))
+
+            # a report newer than its node-major copy doesn't use the copy
+            stat = os.stat(output)
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            self.assertIsNone(SpatialReport(filename, mmap=True)._by_node)
+
+        return
+
+    def test_unsortedNodeIds(self):
+
+        NODE_IDS = [30, 10, 20, 40]
+        data = np.array([[node_id + step for node_id in NODE_IDS] for step in range(5)], dtype=np.float32)
+        report = SpatialReport(node_ids=NODE_IDS, data=data)
+
+        self.assertListEqual(report.node_ids, NODE_IDS)
+        self.assertEqual(len(report._nodes), 0)     # nodes are created on first access
+        self.assertTrue(np.array_equal(report[10].data, [10, 11, 12, 13, 14]))
+        self.assertTrue(np.array_equal(report[40].data, [40, 41, 42, 43, 44]))
+        self.assertEqual(len(report._nodes), 2)
+
+        series = report.series([20, 30])
+        self.assertEqual(len(report._nodes), 2)     # no nodes created
+        self.assertEqual(series.shape, (5, 2))
+        self.assertTrue(np.array_equal(series[:, 0], report[20].data))
+        self.assertTrue(np.array_equal(series[:, 1], report[30].data))
+        self.assertTrue(np.array_equal(report.series(), data))
+
+        with self.assertRaises(KeyError):
+            _ = report[50]
+        with self.assertRaises(KeyError):
+            report.series([10, 50])
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "spatial_report.bin")
+            report.write_file(filename)
+            test = SpatialReport(filename)
+            self.assertListEqual(test.node_ids, NODE_IDS)
+            for node_id in NODE_IDS:
+                self.assertTrue(np.array_equal(test[node_id].data, report[node_id].data))
+
+        return
+
+    def test_aggregate(self):
+
+        NODE_IDS = [4, 1, 3, 2, 5]
+        data = np.arange(6 * 5, dtype=np.float32).reshape((6, 5))
+        report = SpatialReport(node_ids=NODE_IDS, data=data, start=3, interval=2)
+        mapping = {1: 20, 2: 20, 3: 10, 4: 10}     # node 5 is not in a region
+
+        regions = report.aggregate(mapping)
+        self.assertListEqual(regions.node_ids, [10, 20])
+        self.assertEqual(regions.data.dtype, np.float32)
+        self.assertEqual((regions.start, regions.interval), (3, 2))
+        self.assertTrue(np.array_equal(regions[10].data, report[3].data + report[4].data))
+        self.assertTrue(np.array_equal(regions[20].data, report[1].data + report[2].data))
+
+        weights = {1: 1.0, 2: 3.0, 3: 0.0, 4: 0.0}
+        regions = report.aggregate(mapping, weights=weights)
+        self.assertTrue(np.allclose(regions[20].data, (report[1].data + 3 * report[2].data) / 4))
+        self.assertTrue(np.all(np.isnan(regions[10].data)))     # weights sum to zero
+        sequence = [weights.get(node_id, 0.0) for node_id in NODE_IDS]
+        self.assertTrue(np.allclose(report.aggregate(mapping, weights=sequence)[20].data, regions[20].data))
+
+        # weights which change over time, with nodes in a different order
+        population = SpatialReport(node_ids=NODE_IDS[::-1], data=np.arange(1, 31, dtype=np.float32).reshape((6, 5)))
+        regions = report.aggregate(mapping, weights=population)
+        w1, w2 = population[1].data, population[2].data
+        self.assertTrue(np.allclose(regions[20].data, (report[1].data * w1 + report[2].data * w2) / (w1 + w2)))
+
+        # memory mapped
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "SpatialReport_Prevalence.bin")
+            report.write_file(filename)
+            mapped = SpatialReport(filename, mmap=True)
+            self.assertTrue(np.array_equal(mapped.aggregate(mapping).data, report.aggregate(mapping).data))
+
+        with self.assertRaises(KeyError):
+            report.aggregate({1: 10, 6: 10})
+
+        return
+
+    def test_resample(self):
+
+        filename = os.path.join(manifest.spatrep_folder, "SpatialReport_Prevalence.bin")
+        report = SpatialReport(filename)
+
+        weekly = report.resample(7)
+        self.assertEqual(weekly.data.shape, (105, report.node_count))    # 104 weeks and two days
+        self.assertEqual((weekly.start, weekly.interval), (0, 7))
+        self.assertListEqual(weekly.node_ids, report.node_ids)
+        self.assertEqual(weekly.data.dtype, np.float32)
+        self.assertTrue(np.allclose(weekly.data[10], report.data[70:77].mean(axis=0)))
+        self.assertTrue(np.allclose(weekly.data[104], report.data[728:730].mean(axis=0)))
+        self.assertTrue(np.array_equal(report.resample(30, how="max").data[3], report.data[90:120].max(axis=0)))
+
+        # memory mapped and reduced in several blocks
+        with unittest.mock.patch("emod_api.utils.resample._BLOCK", 20 * report.node_count * 4):
+            mapped = SpatialReport(filename, mmap=True).resample(7, how="sum")
+        self.assertTrue(np.allclose(mapped.data, report.resample(7, how="sum").data))
+
+        filtered = SpatialReport(os.path.join(manifest.spatrep_folder, "SpatialReportMalariaFiltered_Adult_Vectors.bin"))
+        monthly = filtered.resample(64, how="last")
+        self.assertEqual((monthly.start, monthly.interval), (8, 64))
+        self.assertTrue(np.array_equal(monthly.data[0], filtered.data[3]))
+        with self.assertRaises(AssertionError):
+            filtered.resample(30)
+
+        with tempfile.TemporaryDirectory() as temp:
+            weekly.write_file(os.path.join(temp, "weekly.bin"))
+            test = SpatialReport(os.path.join(temp, "weekly.bin"))
+            self.assertEqual((test.start, test.interval), (0, 7))
+            self.assertTrue(np.array_equal(test.data, weekly.data))
+
+        return
+
+
+class TestSpatialReportWriter(unittest.TestCase):
+
+    def test_append(self):
+
+        NODE_IDS = [5, 3, 9]
+        data = np.arange(20 * 3, dtype=np.float32).reshape((20, 3))
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "SpatialReport_Synthetic.bin")
+            with SpatialReportWriter(filename, NODE_IDS) as writer:
+                writer.append(data[0])                  # one time step
+                writer.append(data[1:2].tolist())       # one time step as a block
+                writer.append(data[2:20])               # block of time steps
+                self.assertEqual(writer.time_steps, 20)
+                with self.assertRaises(ValueError):
+                    writer.append(np.zeros(4))
+
+            report = SpatialReport(filename)
+            self.assertListEqual(report.node_ids, NODE_IDS)
+            self.assertTrue(np.array_equal(report.data, data))
+            self.assertEqual((report.start, report.interval), (0, 1))
+
+            filtered = os.path.join(temp, "SpatialReportFiltered_Synthetic.bin")
+            writer = SpatialReportWriter(filtered, NODE_IDS, start=30, interval=7)
+            for row in data:
+                writer.append(row)
+            writer.close()
+            report = SpatialReport(filtered)
+            self.assertTrue(np.array_equal(report.data, data))
+            self.assertEqual((report.start, report.interval), (30, 7))
+
+            with self.assertRaises(AssertionError):
+                writer.append(data[0])
+            with self.assertRaises(AssertionError):
+                SpatialReportWriter(filename, [1, 2, 1])
+
+        return
+
+    def test_exception_discards_file(self):
+
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "SpatialReport_Synthetic.bin")
+            with self.assertRaises(RuntimeError):
+                with SpatialReportWriter(filename, [1, 2]) as writer:
+                    writer.append([1.0, 2.0])
+                    raise RuntimeError("simulated failure")
+            self.assertFalse(os.path.exists(filename))
+
+        return
+
+
+class TestSpatialReportSet(unittest.TestCase):
+
+    NODE_IDS = [3, 1, 2]
+    TIME_STEPS = 10
+
+    def write_report(self, directory, channel, scale, node_ids=None, time_steps=None):
+
+        node_ids = self.NODE_IDS if node_ids is None else node_ids
+        time_steps = self.TIME_STEPS if time_steps is None else time_steps
+        data = (scale * np.arange(time_steps * len(node_ids))).reshape((time_steps, len(node_ids))).astype(np.float32)
+        SpatialReport(node_ids=node_ids, data=data).write_file(os.path.join(directory, f"SpatialReport_{channel}.bin"))
+
+        return data
+
+    def test_channels(self):
+
+        with tempfile.TemporaryDirectory() as temp:
+            infections = self.write_report(temp, "New_Infections", 1)
+            population = self.write_report(temp, "Population", 10)
+            prevalence = self.write_report(temp, "Prevalence", 0.5)
+            transpose(os.path.join(temp, "SpatialReport_Prevalence.bin"))   # node-major copies aren't channels
+
+            reports = SpatialReportSet(temp)
+            self.assertListEqual(reports.channels, ["New_Infections", "Population", "Prevalence"])
+            self.assertEqual(len(reports), 3)
+            self.assertIn("Population", reports)
+            self.assertListEqual(reports.node_ids, self.NODE_IDS)
+            self.assertEqual(reports.time_steps, self.TIME_STEPS)
+            self.assertEqual(reports.node_count, 3)
+            self.assertIsInstance(reports["Population"].data, np.memmap)
+
+            data = reports.data
+            self.assertEqual(data.shape, (3, self.TIME_STEPS, 3))
+            self.assertTrue(np.array_equal(data["Prevalence"], prevalence))
+            self.assertTrue(np.array_equal(data[1, 4], population[4]))
+            self.assertTrue(np.array_equal(data[["Population", "New_Infections"], 2:5, 1], np.stack([population[2:5, 1], infections[2:5, 1]])))
+            self.assertTrue(np.array_equal(data[:2, -1], np.stack([infections[-1], population[-1]])))
+            self.assertTrue(np.array_equal(np.asarray(data), np.stack([infections, population, prevalence])))
+            with self.assertRaises(KeyError):
+                _ = data["Incidence"]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                per_capita = reports["New_Infections"].data / reports["Population"].data
+            self.assertTrue(np.allclose(per_capita[1:], 0.1))
+
+            reports = SpatialReportSet(temp, channels=["Prevalence", "Population"])
+            self.assertListEqual(reports.channels, ["Prevalence", "Population"])
+            with self.assertRaises(ValueError):
+                SpatialReportSet(temp, channels=["Incidence"])
+
+        return
+
+    def test_mismatched(self):
+
+        with tempfile.TemporaryDirectory() as temp:
+            self.write_report(temp, "Population", 1)
+            self.write_report(temp, "Prevalence", 1, node_ids=[1, 2, 3])
+            with self.assertRaises(ValueError):
+                SpatialReportSet(temp)
+
+        with tempfile.TemporaryDirectory() as temp:
+            self.write_report(temp, "Population", 1)
+            self.write_report(temp, "Prevalence", 1, time_steps=self.TIME_STEPS + 1)
+            with self.assertRaises(ValueError):
+                SpatialReportSet(temp)
+
+        with tempfile.TemporaryDirectory() as temp:
+            with self.assertRaises(ValueError):
+                SpatialReportSet(temp)
+
+        return
+
+
+class TestEnsemble(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # An "experiment" of three simulations with different lengths (730, 600, 400 time steps), the last with its nodes reversed
+        cls.temp = tempfile.TemporaryDirectory()
+        cls.experiment = pathlib.Path(cls.temp.name) / "experiment"
+        cls.source = SpatialReport(os.path.join(manifest.spatrep_folder, "SpatialReport_Prevalence.bin"))
+        cls.paths = []
+        for index, length in enumerate([730, 600, 400]):
+            node_ids = cls.source.node_ids if index < 2 else cls.source.node_ids[::-1]
+            report = SpatialReport(node_ids=node_ids, data=cls.source.series(node_ids)[:length] * (index + 1))
+            path = cls.experiment / f"sim{index}" / "SpatialReport_Prevalence.bin"
+            path.parent.mkdir(parents=True)
+            report.write_file(str(path))
+            cls.paths.append(path)
+        (cls.experiment / "results.db").touch()
+
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp.cleanup()
+        return
+
+    def test_aggregate(self):
+
+        data = self.source.data
+        results = aggregate(self.paths, stats=["mean", "std", "max", "quantiles"], workers=1)
+        self.assertListEqual(results["node_ids"], self.source.node_ids)
+        self.assertEqual(results["mean"].shape, data.shape)
+        self.assertListEqual(list(results["count"][[0, 500, 700]]), [3, 2, 1])
+        self.assertTrue(np.allclose(results["mean"][:400], data[:400] * 2))
+        self.assertTrue(np.allclose(results["mean"][400:600], data[400:600] * 1.5))
+        self.assertTrue(np.allclose(results["mean"][600:], data[600:]))
+        self.assertTrue(np.allclose(results["std"][:400], data[:400] * np.std([1, 2, 3])))
+        self.assertTrue(np.allclose(results["max"][:400], data[:400] * 3))
+        self.assertEqual(results["quantiles"].shape, (3,) + data.shape)
+        self.assertTrue(np.allclose(results["quantiles"][1, :400], data[:400] * 2))
+
+        node_ids = self.source.node_ids[10:20]
+        subset = aggregate(self.paths, node_ids=node_ids, steps=slice(100, 500), workers=2)
+        self.assertListEqual(subset["node_ids"], node_ids)
+        self.assertTrue(np.allclose(subset["mean"], results["mean"][100:500, 10:20]))
+        self.assertTrue(np.allclose(subset["std"], results["std"][100:500, 10:20]))
+
+        with self.assertRaises(ValueError):
+            aggregate(self.paths, stats=["median"])
+        with self.assertRaises(ValueError):
+            aggregate([])
+
+        return
+
+    def test_collect(self):
+
+        means = plot_spat_means.collect(str(self.experiment), "Prevalence", workers=1)
+        self.assertEqual(len(means), self.source.node_count)
+        node_id = self.source.node_ids[42]
+        self.assertTrue(np.allclose(means[node_id][:400], self.source[node_id].data[:400] * 2))
+
+        return
+
+
+class TestCommandLine(unittest.TestCase):
+
+    filename = os.path.join(manifest.spatrep_folder, "SpatialReportMalariaFiltered_Adult_Vectors.bin")
+
+    def run_command(self, function, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            function(argparse.Namespace(filename=self.filename, **kwargs))
+        return output.getvalue()
+
+    def test_info(self):
+
+        text = self.run_command(cli.__do_info__, node_ids=False)
+        self.assertIn("Nodes:           1,423", text)
+        self.assertIn("Time steps:      45", text)
+        self.assertIn("Start:           8", text)
+        self.assertIn("Interval:        16", text)
+        self.assertIn("Node-major copy: none", text)
+
+        return
+
+    def test_extract(self):
+
+        report = SpatialReport(self.filename)
+        node_ids = [report.node_ids[100], report.node_ids[3]]
+        with tempfile.TemporaryDirectory() as temp:
+            filename = os.path.join(temp, "subset.npy")
+            self.run_command(cli.__do_extract__, output=filename, steps="10:20:2", nodes=node_ids, format="%.7g")
+            self.assertTrue(np.array_equal(np.load(filename), report.series(node_ids)[10:20:2]))
+
+            filename = os.path.join(temp, "subset.csv")
+            self.run_command(cli.__do_extract__, output=filename, steps="-1", nodes=None, format="%.9g")
+            with open(filename) as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], ",".join(["Time Step"] + [str(node_id) for node_id in report.node_ids]))
+            self.assertEqual(len(lines), 2)
+            values = np.array(lines[1].split(","), dtype=np.float64)
+            self.assertEqual(values[0], 8 + 44 * 16)
+            self.assertTrue(np.array_equal(values[1:].astype(np.float32), report.data[-1]))
+
+        return
+
+    def test_summary(self):
+
+        report = SpatialReport(self.filename)
+        summary = report.summary()
+        self.assertTrue(np.allclose(summary["mean"], report.data.mean(axis=0, dtype=np.float64)))
+        self.assertTrue(np.array_equal(summary["max"], report.data.max(axis=0)))
+        self.assertTrue(np.array_equal(summary["final"], report.data[-1]))
+
+        text = self.run_command(cli.__do_summary__, output=None, format="%.9g")
+        lines = text.splitlines()
+        self.assertEqual(lines[0], "Node ID,min,max,mean,final")
+        self.assertEqual(len(lines), report.node_count + 1)
+        values = np.array(lines[1].split(","), dtype=np.float64)
+        self.assertEqual(values[0], report.node_ids[0])
+        self.assertAlmostEqual(values[3], summary["mean"][0], places=5)
+
+        return
+
+    def test_plot(self):
+
+        import matplotlib
+
+        report = SpatialReport(self.filename)
+        backend = matplotlib.get_backend()
+        with tempfile.TemporaryDirectory() as temp:
+            for nodes in [None, report.node_ids[:2]]:
+                filename = os.path.join(temp, "plot.png")
+                self.run_command(cli.__do_plot__, output=filename, steps=None, nodes=nodes, dpi=50)
+                with open(filename, "rb") as file:
+                    self.assertEqual(file.read(8), b"\x89PNG\r\n\x1a\n")
+                os.remove(filename)
+        self.assertEqual(backend, matplotlib.get_backend())
+
+        return
@@ -165,6 +165,27 @@ class TestWeather(unittest.TestCase):
 
         return
 
+    def test_resample(self):
+
+        w = Weather(os.path.join(manifest.weather_folder, "Kenya_Nairobi_2.5arcmin_air_temperature_daily.bin"))
+
+        weekly = w.resample(7)
+        self.assertEqual(weekly.datavalue_count, 53)     # 52 weeks and one day
+        self.assertEqual(weekly.update_resolution, weather.CLIMATE_UPDATE_WEEK)
+        self.assertEqual(weekly.node_ids, w.node_ids)
+        self.assertEqual(weekly.data.dtype, np.float32)
+        self.assertAlmostEqual(weekly.nodes[340789328][1], np.mean(w.nodes[340789328].data[7:14]), 5)
+        self.assertAlmostEqual(weekly.nodes[341444690][52], w.nodes[341444690][364], 5)
+
+        hottest = w.resample(30, how="max", frequency=weather.CLIMATE_UPDATE_MONTH)
+        self.assertEqual(hottest.datavalue_count, 13)
+        self.assertEqual(hottest.nodes[340789329][2], np.max(w.nodes[340789329].data[60:90]))
+
+        with self.assertRaises(ValueError):
+            w.resample(30)
+
+        return
+
     def test_badMetadata(self):
 
         # TODO create .json file where #nodes * #values != size of data